@@ -15,56 +15,128 @@
 """FXOS8700 accelerometer."""
 import math
 import time
-from typing import Text
+from typing import Optional
 from typing import Tuple
 
 import adafruit_fxos8700
 import board
 import busio
+import numpy as np
 from absl import app
+from absl import logging
+from adafruit_bus_device import i2c_device
 
 from exit_speed import exit_speed_pb2
+from exit_speed import imu_calibration
 from exit_speed import sensor
 
+# FXOS8700 registers used for FIFO reads.
+# https://www.nxp.com/docs/en/data-sheet/FXOS8700CQ.pdf
+FXOS8700_ADDRESS = 0x1F
+REGISTER_F_STATUS = 0x00  # STATUS is F_STATUS while the FIFO is enabled.
+REGISTER_OUT_X_MSB = 0x01
+REGISTER_F_SETUP = 0x09
+REGISTER_CTRL_REG1 = 0x2A
+REGISTER_MCTRL_REG1 = 0x5B
+REGISTER_MCTRL_REG2 = 0x5C
+F_SETUP_CIRCULAR = 0x40
+F_STATUS_OVERFLOW = 0x80
+F_STATUS_COUNT = 0x3F
+CTRL_REG1_ACTIVE = 0x01
+FIFO_SIZE = 32
+# Accelerometer only output data rates of CTRL_REG1.
+FIFO_RATES_HZ = {800: 0b000, 400: 0b001, 200: 0b010, 100: 0b011, 50: 0b100}
+# m/s^2 of the 14 bit samples in the 8G range, see adafruit_fxos8700.
+ACCEL_MS2_LSB_8G = 0.000976 * 9.80665
+
 
 class Accelerometer(object):
   """Measures the G forces the car experiences."""
-  GRAVITY = 9.81
-  X_LOW = -9.7459664498
-  Y_LOW = -9.8632147572
-  Z_LOW = -9.4660062056
-  X_HIGH = 10.420742422999998
-  Y_HIGH = 9.164510558
-  Z_HIGH = 10.301101292999999
-
-  def __init__(self):
-    self.i2c = busio.I2C(board.SCL, board.SDA)
+  GRAVITY = imu_calibration.GRAVITY
+
+  def __init__(
+      self,
+      i2c: Optional[busio.I2C] = None,
+      calibration: imu_calibration.Calibration = (
+          imu_calibration.DEFAULT_CALIBRATION)):
+    self.i2c = i2c or busio.I2C(board.SCL, board.SDA)
+    self.calibration = calibration
     self.accelerometer = adafruit_fxos8700.FXOS8700(
         self.i2c, accel_range=adafruit_fxos8700.ACCEL_RANGE_8G)
+    self.device = None
+    self.fifo_period_ns = None
+    self.fifo_overflows = 0
 
-  def CorrectValue(self, axis: Text, value: float) -> float:
-    """Returns the values after correcting for calibration.
+  def Correct(self, values: np.ndarray) -> np.ndarray:
+    """Returns x, y, z or (n, 3) values after correcting for calibration."""
+    return imu_calibration.Correct(self.calibration, values)
 
-    Args:
-      axis: A string of the axis such as x,y,z.
-      value: A value from self.accelerometer.accelerometer
+  def GetGForces(self) -> Tuple[float, float, float]:
+    """Returns the number of G forces measured in each direction."""
+    g_forces = self.Correct(
+        np.array(self.accelerometer.accelerometer)) / self.GRAVITY
+    return tuple(g_forces.tolist())
+
+  def _ReadRegisters(self, register: int, length: int) -> bytearray:
+    data = bytearray(length)
+    with self.device as i2c:
+      i2c.write_then_readinto(bytes((register,)), data)
+    return data
+
+  def _WriteRegister(self, register: int, value: int) -> None:
+    with self.device as i2c:
+      i2c.write(bytes((register, value)))
+
+  def EnableFifo(self, sample_rate_hz: int) -> None:
+    """Buffers samples in the FXOS8700's FIFO to be read in bursts.
+
+    The magnetometer is disabled which allows the FIFO to be drained with a
+    single read and the accelerometer to sample at the full data rate.
 
-    https://learn.sparkfun.com/tutorials/adxl345-hookup-guide#calibration
-    https://www.nxp.com/docs/en/application-note/AN4399.pdf
+    Args:
+      sample_rate_hz: One of FIFO_RATES_HZ.
     """
-    low = getattr(self, '%s_LOW' % axis.upper())
-    high = getattr(self, '%s_HIGH' % axis.upper())
-    offset = 0.5 * (high + low)
-    gain = 0.5 * ((high - low) / 9.81)
-    return (value - offset) / gain
+    if sample_rate_hz not in FIFO_RATES_HZ:
+      raise ValueError('FIFO sample rate must be one of %s' %
+                       sorted(FIFO_RATES_HZ))
+    self.device = i2c_device.I2CDevice(self.i2c, FXOS8700_ADDRESS)
+    # Settings can only be changed in standby.
+    self._WriteRegister(REGISTER_CTRL_REG1, 0)
+    self._WriteRegister(REGISTER_MCTRL_REG1, 0)  # Accelerometer only.
+    self._WriteRegister(REGISTER_MCTRL_REG2, 0)
+    self._WriteRegister(REGISTER_F_SETUP, F_SETUP_CIRCULAR)
+    self._WriteRegister(REGISTER_CTRL_REG1,
+                        FIFO_RATES_HZ[sample_rate_hz] << 3 | CTRL_REG1_ACTIVE)
+    self.fifo_period_ns = int(1e9 / sample_rate_hz)
+
+  def ReadFifo(self, read_time_ns: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Drains the FIFO.
 
-  def GetGForces(self) -> Tuple[float, float, float]:
-    """Returns the number of G forces measured in each direction."""
-    x, y, z = self.accelerometer.accelerometer
-    x = self.CorrectValue('x', x)
-    y = self.CorrectValue('y', y)
-    z = self.CorrectValue('z', z)
-    return x / self.GRAVITY, y / self.GRAVITY, z / self.GRAVITY
+    Args:
+      read_time_ns: Wall clock nanoseconds of the read.  The newest sample is
+                    assumed to be from this time with the older ones spaced
+                    by the sample rate before it.
+
+    Returns:
+      The nanosecond timestamps and a (samples, 3) array of x, y, z G forces.
+    """
+    status = self._ReadRegisters(REGISTER_F_STATUS, 1)[0]
+    if status & F_STATUS_OVERFLOW:
+      self.fifo_overflows += 1
+      logging.log_every_n_seconds(
+          logging.WARNING, 'Accelerometer FIFO overflowed %d times', 10,
+          self.fifo_overflows)
+    count = status & F_STATUS_COUNT
+    if not count:
+      return np.empty(0, dtype=np.int64), np.empty((0, 3))
+    data = self._ReadRegisters(REGISTER_OUT_X_MSB, count * 6)
+    # 14 bit samples left aligned in big endian 16 bit two's complement.
+    raw = np.frombuffer(data, dtype='>i2').reshape(count, 3) >> 2
+    values = raw * ACCEL_MS2_LSB_8G
+    g_forces = self.Correct(values) / self.GRAVITY
+    timestamps = read_time_ns - self.fifo_period_ns * np.arange(
+        count - 1, -1, -1, dtype=np.int64)
+    return timestamps, g_forces
 
   def CalcPitchAndRoll(self, x_gs, y_gs, z_gs) -> Tuple[float, float]:
     """Calculates the pitch and roll based on the G readings."""
@@ -80,18 +152,38 @@ class AccelerometerProcess(sensor.SensorBase):
 
   def Loop(self):
     """Adds point data with accelerometer values to point queue."""
-    accel = Accelerometer()
+    accel = Accelerometer(calibration=imu_calibration.Load(
+        self.config.get('accelerometer')))
     frequency_hz = int(
         self.config.get('accelerometer', {}).get('frequency_hz')) or 10
+    if self.config.get('accelerometer', {}).get('fifo'):
+      self.LoopFifo(accel, frequency_hz)
+      return
+    scheduler = sensor.Scheduler(self.__class__.__name__, frequency_hz)
     while not self.stop_process_signal.value:
-      cycle_time = time.time()
+      timestamp_ns = scheduler.Wait()
       x, y, z = accel.GetGForces()
       proto = exit_speed_pb2.Accelerometer(
 				accelerometer_x=x,
 				accelerometer_y=y,
 				accelerometer_z=z)
-      self.LogAndExportProto(proto)
-      time.sleep(sensor.SleepBasedOnHertz(cycle_time, frequency_hz))
+      self.LogAndExportProto(proto, timestamp_ns)
+
+  def LoopFifo(self, accel: Accelerometer, sample_rate_hz: int):
+    """Samples at high rates by draining the FIFO several samples at a time."""
+    accel.EnableFifo(sample_rate_hz)
+    # Drained when half full so the FIFO has room for a late cycle.
+    scheduler = sensor.Scheduler(self.__class__.__name__,
+                                 sample_rate_hz / (FIFO_SIZE / 2))
+    while not self.stop_process_signal.value:
+      timestamps, g_forces = accel.ReadFifo(scheduler.Wait())
+      for timestamp_ns, (x, y, z) in zip(timestamps.tolist(),
+                                         g_forces.tolist()):
+        proto = exit_speed_pb2.Accelerometer(
+            accelerometer_x=x,
+            accelerometer_y=y,
+            accelerometer_z=z)
+        self.LogAndExportProto(proto, timestamp_ns)
 
 
 
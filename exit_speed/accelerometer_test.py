@@ -13,11 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Unitests for accelerometer.py"""
+import struct
 import sys
 import unittest
 
 import fake_rpi
 import mock
+import numpy as np
 from absl import flags
 from absl.testing import absltest
 # pylint: disable=wrong-import-position
@@ -31,6 +33,7 @@ with mock.patch.object(adafruit_platformdetect, 'Detector') as mock_detector:
   from exit_speed import accelerometer
   import busio
   import adafruit_fxos8700
+  from adafruit_bus_device import i2c_device
 # pylint: enable=wrong-import-position
 
 FLAGS = flags.FLAGS
@@ -46,13 +49,18 @@ class TestAccelerometer(unittest.TestCase):
       with mock.patch.object(adafruit_fxos8700, 'FXOS8700'):
         self.accel = accelerometer.Accelerometer()
 
-  def testCorrectValue(self):
-    self.assertEqual(9.32704486216904,
-        self.accel.CorrectValue('x', 9.924329799999999))
-    self.assertEqual(10.836155704720122,
-        self.accel.CorrectValue('y', 10.1596894))
-    self.assertEqual(9.76962474276722,
-        self.accel.CorrectValue('z', 10.260423308799998))
+  def testCorrect(self):
+    self.assertEqual([9.32704486216904, 10.836155704720122, 9.76962474276722],
+        self.accel.Correct(np.array(
+            [9.924329799999999, 10.1596894, 10.260423308799998])).tolist())
+
+  def testCorrectBatch(self):
+    values = np.array([[9.924329799999999, 10.1596894, 10.260423308799998],
+                       [0.3924229, -0.5072783912, 10.29870]])
+    corrected = self.accel.Correct(values)
+    self.assertEqual((2, 3), corrected.shape)
+    self.assertEqual(self.accel.Correct(values[1]).tolist(),
+                     corrected[1].tolist())
 
   def testGetGForces(self):
     self.accel.accelerometer.accelerometer = (
@@ -61,6 +69,53 @@ class TestAccelerometer(unittest.TestCase):
     expected = (0.005457996517639941, -0.016599597585513083, 0.9997570415398239)
     self.assertEqual(expected, result)
 
+  def _EnableFifo(self, registers):
+    """Enables the FIFO with a fake device backed by registers."""
+    writes = []
+    def _WriteThenReadinto(out_buffer, in_buffer):
+      in_buffer[:] = registers[out_buffer[0]][:len(in_buffer)]
+    with mock.patch.object(i2c_device, 'I2CDevice') as mock_device:
+      mock_i2c = mock_device.return_value.__enter__.return_value
+      mock_i2c.write.side_effect = lambda data: writes.append(bytes(data))
+      mock_i2c.write_then_readinto.side_effect = _WriteThenReadinto
+      self.accel.EnableFifo(200)
+    return writes
+
+  def testEnableFifo(self):
+    writes = self._EnableFifo({})
+    self.assertEqual(
+        [b'\x2a\x00', b'\x5b\x00', b'\x5c\x00', b'\x09\x40', b'\x2a\x11'],
+        writes)
+    self.assertEqual(5000000, self.accel.fifo_period_ns)
+    with self.assertRaises(ValueError):
+      self.accel.EnableFifo(40)
+
+  def testReadFifo(self):
+    samples = [(402, -520, 8000), (0, 0, 1024), (-4096, 4096, 0)]
+    registers = {
+        accelerometer.REGISTER_F_STATUS: bytes((len(samples),)),
+        accelerometer.REGISTER_OUT_X_MSB: b''.join(
+            struct.pack('>3h', *(value << 2 for value in sample))
+            for sample in samples),
+    }
+    self._EnableFifo(registers)
+    timestamps, g_forces = self.accel.ReadFifo(1000000000)
+    self.assertEqual([990000000, 995000000, 1000000000], timestamps.tolist())
+    # Matches the calibrated values of the adafruit driver's reading.
+    self.accel.accelerometer.accelerometer = [
+        value * accelerometer.ACCEL_MS2_LSB_8G for value in samples[0]]
+    np.testing.assert_allclose(self.accel.GetGForces(), g_forces[0])
+    self.assertEqual((3, 3), g_forces.shape)
+    self.assertEqual(0, self.accel.fifo_overflows)
+
+  def testReadFifoEmptyAndOverflow(self):
+    registers = {accelerometer.REGISTER_F_STATUS: bytes((0x80,))}
+    self._EnableFifo(registers)
+    timestamps, g_forces = self.accel.ReadFifo(1000000000)
+    self.assertEqual(0, len(timestamps))
+    self.assertEqual((0, 3), g_forces.shape)
+    self.assertEqual(1, self.accel.fifo_overflows)
+
   def testCalcPitchAndRoll(self):
     x_gs = 0.02
     y_gs = -0.71
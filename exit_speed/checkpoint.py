@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Checkpoints session and lap state for a fast warm restart.
+
+If the main process crashes mid session a new ExitSpeed instance would have to
+wait for a fresh GPS fix, create a new session row and would lose the laps so
+far.  Instead the state is periodically pickled to local disk and reloaded on
+startup if it is recent enough to belong to the same session.  The best lap is
+not included, it is reloaded from the saved reference lap.
+"""
+import os
+import pickle
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Text
+
+from absl import flags
+from absl import logging
+
+from exit_speed import common_lib
+from exit_speed import exit_speed_pb2
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('checkpoint_path', None,
+                    'Path of the session checkpoint file.  Defaults to '
+                    'checkpoint.pickle in --data_log_path.')
+flags.DEFINE_integer('checkpoint_max_age', 600,
+                     'Checkpoints older than this many seconds are treated as '
+                     'a prior session and ignored on startup.')
+flags.DEFINE_float('checkpoint_interval', 5.0,
+                   'Seconds between checkpoints of the current lap.  Laps '
+                   'are always checkpointed when crossing start/finish.')
+
+# Number of points kept from the end of the prior lap.  Only the last couple of
+# unique points are needed to interpolate when start/finish was crossed.
+PRIOR_LAP_POINTS = 10
+
+
+class Snapshot(NamedTuple):
+  session: common_lib.Session
+  lap_number: int
+  prior_lap: List[exit_speed_pb2.Gps]
+  current_lap: List[exit_speed_pb2.Gps]
+  saved_time: float
+
+
+def GetCheckpointPath() -> Text:
+  return FLAGS.checkpoint_path or os.path.join(FLAGS.data_log_path,
+                                               'checkpoint.pickle')
+
+
+def _SerializeLap(lap: Sequence[exit_speed_pb2.Gps]) -> List[bytes]:
+  return [point.SerializeToString() for point in lap]
+
+
+def _ParseLap(lap: List[bytes]) -> List[exit_speed_pb2.Gps]:
+  return [exit_speed_pb2.Gps().FromString(point) for point in lap]
+
+
+def Save(snapshot: Snapshot, path: Optional[Text] = None) -> None:
+  """Atomically writes the snapshot to disk.
+
+  The snapshot is written to a temporary file and renamed so a crash during
+  the write never leaves a truncated checkpoint behind.  Points are stored as
+  serialized protos which keeps the file compact.
+  """
+  path = path or GetCheckpointPath()
+  temp_path = path + '.tmp'
+  serialized = snapshot._replace(
+      prior_lap=_SerializeLap(snapshot.prior_lap),
+      current_lap=_SerializeLap(snapshot.current_lap))
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(temp_path, 'wb') as temp_file:
+      pickle.dump(serialized, temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+  except OSError:
+    logging.log_every_n_seconds(logging.ERROR,
+                                'Unable to write checkpoint %s',
+                                60, path, exc_info=True)
+
+
+def Load(path: Optional[Text] = None,
+         max_age: Optional[float] = None) -> Optional[Snapshot]:
+  """Returns the last snapshot if it is recent enough to resume from."""
+  path = path or GetCheckpointPath()
+  if max_age is None:
+    max_age = FLAGS.checkpoint_max_age
+  if not os.path.exists(path):
+    return None
+  try:
+    with open(path, 'rb') as checkpoint_file:
+      snapshot = pickle.load(checkpoint_file)
+  # The session pickles the track by module which may have been renamed.  A
+  # bad checkpoint should never stop Exit Speed from starting.
+  except Exception:  # pylint: disable=broad-except
+    logging.exception('Unable to read checkpoint %s', path)
+    return None
+  age = time.time() - snapshot.saved_time
+  if age > max_age:
+    logging.info('Ignoring checkpoint from %.0f seconds ago.', age)
+    return None
+  return snapshot._replace(
+      prior_lap=_ParseLap(snapshot.prior_lap),
+      current_lap=_ParseLap(snapshot.current_lap))
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for checkpoint.py"""
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from absl.testing import absltest
+
+from exit_speed import checkpoint
+from exit_speed import common_lib
+from exit_speed import exit_speed_pb2
+from exit_speed import tracks
+
+
+def _CreateSnapshot(saved_time):
+  point = exit_speed_pb2.Gps(lat=45.595015, lon=-122.694526, speed_ms=50)
+  point.time.FromJsonString(u'2020-05-23T17:47:44.100Z')
+  session = common_lib.Session(
+      time=datetime.datetime(2020, 5, 23, 17, 47, 44),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car='RC Car',
+      live_data=True)
+  return checkpoint.Snapshot(
+      session=session,
+      lap_number=3,
+      prior_lap=[point],
+      current_lap=[point, point],
+      saved_time=saved_time)
+
+
+class TestCheckpoint(unittest.TestCase):
+  """Checkpoint unittests."""
+
+  def setUp(self):
+    super().setUp()
+    self.path = os.path.join(tempfile.mkdtemp(), 'checkpoint.pickle')
+
+  def testSaveAndLoad(self):
+    snapshot = _CreateSnapshot(time.time())
+    checkpoint.Save(snapshot, self.path)
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+    self.assertEqual(snapshot, checkpoint.Load(self.path, max_age=60))
+
+  def testLoadStale(self):
+    checkpoint.Save(_CreateSnapshot(time.time() - 120), self.path)
+    self.assertIsNone(checkpoint.Load(self.path, max_age=60))
+
+  def testLoadMissing(self):
+    self.assertIsNone(checkpoint.Load(self.path, max_age=60))
+
+  def testLoadCorrupt(self):
+    with open(self.path, 'wb') as checkpoint_file:
+      checkpoint_file.write(b'\x80\x05corrupt')
+    self.assertIsNone(checkpoint.Load(self.path, max_age=60))
+
+  def testLoadMissingModule(self):
+    with open(self.path, 'wb') as checkpoint_file:
+      checkpoint_file.write(b'cmissing_module\nTrack\n.')
+    self.assertIsNone(checkpoint.Load(self.path, max_age=60))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,14 +14,22 @@
 # limitations under the License.
 """Common libaries."""
 import datetime
+import functools
+import math
+from typing import Any
+from typing import Dict
 from typing import NamedTuple
 from typing import Text
 
 import gps
+from absl import flags
+from absl import logging
 
 from exit_speed import exit_speed_pb2
 from exit_speed.tracks import base
 
+FLAGS = flags.FLAGS
+
 
 class Session(NamedTuple):
   track: base.Track
@@ -36,8 +44,73 @@ def PointDelta(point_a: exit_speed_pb2.Gps,
   return gps.EarthDistanceSmall((point_a.lat, point_a.lon),
                                 (point_b.lat, point_b.lon))
 
+
 def PointDeltaFromTrack(track: base.Track, point: exit_speed_pb2.Gps) -> float:
   """Returns the distance in meters between two points."""
-  return gps.EarthDistanceSmall((track.start_finish[0],
-                                 track.start_finish[1]),
-                                (point.lat, point.lon))
+  return math.hypot(*GetTrackProjection(track).ToXY(point.lat, point.lon))
+
+
+class LocalProjection(object):
+  """Converts lat/lon to x/y meters on a plane around an origin.
+
+  The meters per degree are the ellipsoid corrected values used by
+  gps.EarthDistanceSmall, fixed at the origin's latitude.  Within 2km of the
+  origin, which covers a race track, distances between nearby points are
+  within 0.04% of gps.EarthDistanceSmall at latitudes up to 50 degrees.  That
+  is under 4mm over 10m.
+
+  ToXY and ToLatLon accept floats or numpy arrays.
+  """
+
+  def __init__(self, lat: float, lon: float):
+    self.lat = lat
+    self.lon = lon
+    phi = math.radians(lat)
+    self.y_scale = (111132.954 - 559.822 * math.cos(2 * phi) +
+                    1.175 * math.cos(4 * phi))
+    self.x_scale = self.y_scale * math.cos(phi)
+
+  def ToXY(self, lat, lon):
+    """Returns the x (east) and y (north) meters from the origin."""
+    return (lon - self.lon) * self.x_scale, (lat - self.lat) * self.y_scale
+
+  def ToLatLon(self, x, y):
+    return self.lat + y / self.y_scale, self.lon + x / self.x_scale
+
+  def PointToXY(self, point: exit_speed_pb2.Gps):
+    return self.ToXY(point.lat, point.lon)
+
+  def Distance(self,
+               point_a: exit_speed_pb2.Gps,
+               point_b: exit_speed_pb2.Gps) -> float:
+    """Returns the distance in meters between two points."""
+    return math.hypot((point_a.lon - point_b.lon) * self.x_scale,
+                      (point_a.lat - point_b.lat) * self.y_scale)
+
+
+@functools.lru_cache(maxsize=None)
+def GetTrackProjection(track: base.Track) -> LocalProjection:
+  """Returns the projection centered on the start/finish of the track."""
+  return LocalProjection(*track.start_finish)
+
+
+def GetFlagValues() -> Dict[Text, Any]:
+  """Returns the current flag values for passing to a child process."""
+  return FLAGS.flag_values_dict()
+
+
+def RestoreFlagValues(flag_values: Dict[Text, Any]) -> None:
+  """Restores flag values within a spawn or forkserver child process.
+
+  Unlike fork these start methods begin with a fresh interpreter in which the
+  flags have not been parsed.  Flags defined by modules which have not been
+  imported in the child are skipped.
+  """
+  if FLAGS.is_parsed():
+    return
+  for name, value in flag_values.items():
+    if name in FLAGS:
+      FLAGS[name].value = value
+  FLAGS.mark_as_parsed()
+  if FLAGS.log_dir:
+    logging.get_absl_handler().use_absl_log_file()
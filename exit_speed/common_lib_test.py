@@ -15,10 +15,13 @@
 """Common library unittest."""
 import unittest
 
+import gps
+import numpy as np
 from absl.testing import absltest
 
 from exit_speed import common_lib
 from exit_speed import exit_speed_pb2
+from exit_speed import tracks
 
 
 class TestExitSpeed(unittest.TestCase):
@@ -34,6 +37,33 @@ class TestExitSpeed(unittest.TestCase):
     self.assertEqual(171979.02735070087,
                      common_lib.PointDelta(proto_a, proto_b))
 
+  def testLocalProjection(self):
+    projection = common_lib.LocalProjection(45.595015, -122.694526)
+    self.assertEqual((0, 0), projection.ToXY(45.595015, -122.694526))
+    x, y = projection.ToXY(np.array([45.594980, 45.595064]),
+                           np.array([-122.694389, -122.694638]))
+    lat, lon = projection.ToLatLon(x, y)
+    np.testing.assert_allclose([45.594980, 45.595064], lat, rtol=0, atol=1e-12)
+    np.testing.assert_allclose([-122.694389, -122.694638], lon,
+                               rtol=0, atol=1e-12)
+
+  def testLocalProjectionDistance(self):
+    projection = common_lib.LocalProjection(45.595015, -122.694526)
+    point_a = exit_speed_pb2.Gps(lat=45.594980, lon=-122.694389)
+    # About 1.5km north east of the origin.
+    for lat, lon in ((45.595064, -122.694638), (45.605, -122.68)):
+      point_b = exit_speed_pb2.Gps(lat=lat, lon=lon)
+      expected = gps.EarthDistanceSmall((point_a.lat, point_a.lon),
+                                        (point_b.lat, point_b.lon))
+      self.assertAlmostEqual(expected, projection.Distance(point_a, point_b),
+                             delta=expected * 0.0004)
+
+  def testGetTrackProjection(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    projection = common_lib.GetTrackProjection(track)
+    self.assertIs(projection, common_lib.GetTrackProjection(track))
+    self.assertEqual((0, 0), projection.ToXY(*track.start_finish))
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -21,11 +21,12 @@ from typing import Text
 from typing import Tuple
 
 import funcy
-import gps
+import numpy as np
 import pandas as pd
 from absl import logging
 from psycopg2 import sql
 
+from exit_speed import common_lib
 from exit_speed import postgres
 from exit_speed import tracks
 
@@ -151,6 +152,16 @@ def GetTableData(table_name: Text,
                   'end_time': end_time})
 
 
+def GetElapsedDistance(gps_df: pd.DataFrame) -> np.ndarray:
+  """Returns the cumulative distance in meters driven at each GPS row."""
+  if gps_df.empty:
+    return np.array([])
+  projection = common_lib.LocalProjection(gps_df['lat'].iloc[0],
+                                          gps_df['lon'].iloc[0])
+  x, y = projection.ToXY(gps_df['lat'].to_numpy(), gps_df['lon'].to_numpy())
+  return np.concatenate(([0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+
+
 @DfCache
 @funcy.log_durations(logging.debug)
 def GetLapData(columns: Set[Text],
@@ -164,17 +175,7 @@ def GetLapData(columns: Set[Text],
       table_df = GetTableData(table_name, columns_to_query,
                               start_time, end_time)
       if table_name == 'gps':
-        elapsed_distance_col = []
-        elapsed_distance = 0
-        prior_row = None
-        for row in table_df.itertuples():
-          if prior_row:
-            elapsed_distance += gps.EarthDistanceSmall(
-                (row.lat, row.lon),
-                (prior_row.lat, prior_row.lon))
-          elapsed_distance_col.append(elapsed_distance)
-          prior_row = row
-        table_df['elapsed_distance_m'] = elapsed_distance_col
+        table_df['elapsed_distance_m'] = GetElapsedDistance(table_df)
       if df is not None:
         df = pd.merge_asof(df, table_df, on='time')
       else:
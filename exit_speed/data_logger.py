@@ -71,13 +71,39 @@ class Logger(object):
   def _SetFilePath(self):
     self.file_path = '%s_%s.data' % (self.file_prefix, self.current_proto_len)
 
+  def _TruncatePartialRecord(self):
+    """Removes a record left partially written by a crash.
+
+    ReadProtos stops at the first record it can not read so appending after a
+    partial record would make every appended record unreadable.
+    """
+    with open(self.file_path, 'r+b') as data_file:
+      size = data_file.seek(0, os.SEEK_END)
+      data_file.seek(0)
+      end = 0
+      while True:
+        header = data_file.read(self.current_proto_len)
+        proto_len = int.from_bytes(header, BYTE_ORDER)
+        record_end = end + len(header) + proto_len
+        if (len(header) < self.current_proto_len or not proto_len or
+            record_end > size):
+          break
+        end = data_file.seek(record_end)
+      if end < size:
+        logging.warning('Truncating %d bytes of a partial record from %s',
+                        size - end, self.file_path)
+        data_file.truncate(end)
+
   def _SetCurrentFile(self):
     if self.current_file:
       self.current_file.flush()
     parent_dir = os.path.dirname(self.file_path)
     if not os.path.exists(parent_dir):
       os.makedirs(parent_dir, exist_ok=True)
-    self.current_file = open(self.file_path, 'wb')
+    if os.path.exists(self.file_path):
+      self._TruncatePartialRecord()
+    # Append so a resumed session continues the existing data files.
+    self.current_file = open(self.file_path, 'ab')
 
   def GetFile(self, proto_len):
     if proto_len < int.from_bytes(b'\xff' * self.current_proto_len, 'big'):
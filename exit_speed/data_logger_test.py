@@ -77,6 +77,26 @@ class TestDataLogger(unittest.TestCase):
     expected = [self.point]
     self.assertEqual(expected, file_points)
 
+  def testResumeAfterShortWrite(self):
+    logger = data_logger.Logger(self.file_path, proto_class=exit_speed_pb2.Gps)
+    logger.WriteProto(self.point)
+    logger.WriteProto(self.point)
+    logger.current_file.close()
+    # The process crashed part way through writing the second record.
+    with open(logger.file_path, 'rb') as temp_file:
+      contents = temp_file.read()
+    with open(logger.file_path, 'wb') as temp_file:
+      temp_file.write(contents[:-5])
+
+    resumed_point = exit_speed_pb2.Gps(lat=1, lon=2)
+    resumed = data_logger.Logger(self.file_path,
+                                 proto_class=exit_speed_pb2.Gps)
+    resumed.WriteProto(resumed_point)
+    resumed.WriteProto(resumed_point)
+    resumed.current_file.flush()
+    self.assertEqual([self.point, resumed_point, resumed_point],
+                     list(resumed.ReadProtos()))
+
   def testZeroProtoBytes(self):
     logger = data_logger.Logger(self.file_path, proto_class=exit_speed_pb2.Gps)
     logger.WriteProto(self.point)
@@ -15,6 +15,7 @@
 """FXAS21002C gyroscope."""
 import math
 import time
+from typing import Optional
 from typing import Tuple
 
 import adafruit_fxas21002c
@@ -29,8 +30,8 @@ from exit_speed import sensor
 class Gyroscope(object):
   """Measures rotational rate."""
 
-  def __init__(self):
-    self.i2c = busio.I2C(board.SCL, board.SDA)
+  def __init__(self, i2c: Optional[busio.I2C] = None):
+    self.i2c = i2c or busio.I2C(board.SCL, board.SDA)
     self.sensor = adafruit_fxas21002c.FXAS21002C(self.i2c)
 
   def GetRotationalValues(self) -> Tuple[float, float, float]:
@@ -50,15 +51,15 @@ class GyroscopeProcess(sensor.SensorBase):
     gyro = Gyroscope()
     frequency_hz = int(
         self.config.get('gyroscope', {}).get('frequency_hz')) or 10
+    scheduler = sensor.Scheduler(self.__class__.__name__, frequency_hz)
     while not self.stop_process_signal.value:
-      cycle_time = time.time()
+      timestamp_ns = scheduler.Wait()
       x, y, z = gyro.GetRotationalValues()
       proto = exit_speed_pb2.Gyroscope(
         gyro_x=x,
         gyro_y=y,
         gyro_z=z)
-      self.LogAndExportProto(proto)
-      time.sleep(sensor.SleepBasedOnHertz(cycle_time, frequency_hz))
+      self.LogAndExportProto(proto, timestamp_ns)
 
 
 def main(unused_argv):
@@ -15,9 +15,9 @@
 """Converts a data log generated by exit speed to the new proto format."""
 import os
 import pathlib
-import time
 
 import dateutil.parser
+import pytz
 from absl import app
 from absl import flags
 from absl import logging
@@ -25,14 +25,12 @@ from absl import logging
 from exit_speed import common_lib
 from exit_speed import data_logger
 from exit_speed import exit_speed_pb2
-from exit_speed import main as exit_speed
+from exit_speed import lap_lib
 from exit_speed import postgres
 from exit_speed import tracks
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('data_dir', None, 'Path to a directory with data files.')
-FLAGS.set_default('data_log_path', '/tmp')  # Dont clobber on import.
-FLAGS.set_default('led_brightness', 0.05)
 
 
 PREFIX_PROTO_MAP = {
@@ -64,24 +62,33 @@ def CopyProtosToPostgres(prefix_protos):
 
 
 def ReRunMain(data_dir, protos):
+  """Splits the session into laps and exports the lap times to Postgres.
+
+  Crossings are found over the whole session at once rather than replaying
+  each point through ExitSpeed.ProcessLap.
+  """
   path = pathlib.Path(data_dir)
-  es = exit_speed.ExitSpeed(live_data=False)
-  es.postgres = postgres.PostgresWithoutPrepare()
-  es.session = common_lib.Session(
+  session = common_lib.Session(
     time=dateutil.parser.parse(path.name),
     track=tracks.FindClosestTrack({'lat': protos[0].lat,
 																	 'lon': protos[0].lon}),
     car=path.parts[-3],
     live_data=False)
-  es.postgres.AddToQueue(es.session)
-  es.postgres.AddToQueue(postgres.LapStart(number=es.lap_number,
-                         start_time=es.session.time))
-  logging.info(es.session)
-  for proto in protos:
-    es.point = proto
-    es.ProcessLap()
-  es.stop_process_signal = True
-  time.sleep(2)
+  logging.info(session)
+  db_writer = postgres.PostgresWithoutPrepare(start_process=False)
+  db_writer.ExportSession(session)
+  db_writer.ExportLapStart(postgres.LapStart(number=1,
+                                             start_time=session.time))
+  crossings, durations = lap_lib.SplitLaps(session.track,
+                                           *lap_lib.GpsArrays(protos))
+  for lap_number, (index, duration_ns) in enumerate(
+      zip(crossings, durations), start=2):
+    cross_time = protos[index].time.ToDatetime(tzinfo=pytz.UTC)
+    logging.info('Lap %d: %d', lap_number - 1, duration_ns)
+    db_writer.ExportLapEnd(postgres.LapEnd(end_time=cross_time,
+                                           duration_ns=int(duration_ns)))
+    db_writer.ExportLapStart(postgres.LapStart(number=lap_number,
+                                               start_time=cross_time))
 
 
 def main(unused_argv):
@@ -20,7 +20,6 @@ import unittest
 import fake_rpi
 import gps
 import mock
-from absl import flags
 from absl.testing import absltest
 
 from exit_speed import postgres_test_lib
@@ -39,12 +38,6 @@ with mock.patch.object(adafruit_platformdetect, 'Detector') as mock_detector:
 # pylint: enable=wrong-import-position
 
 
-FLAGS = flags.FLAGS
-FLAGS.set_default('config_path',
-    os.path.join(os.path.dirname(os.path.abspath(__file__)),
-        'testdata/test_postgres.yaml'))
-
-
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                         'testdata/')
 EXPECTED_DURATIONS = {
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""FXOS8700 accelerometer and FXAS21002C gyroscope read by one process.
+
+Both sensors are on the same I2C bus.  Reading them in the same cycle avoids a
+second process polling the bus and gives both readings the same timestamp.
+"""
+import multiprocessing
+import time
+from typing import Dict
+from typing import Tuple
+
+import board
+import busio
+from absl import app
+from absl import logging
+from google.protobuf import any_pb2
+
+from exit_speed import accelerometer
+from exit_speed import common_lib
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import gyroscope
+from exit_speed import imu_calibration
+from exit_speed import postgres
+from exit_speed import sensor
+
+
+class IMU(object):
+  """Accelerometer and gyroscope sharing an I2C bus."""
+
+  def __init__(
+      self,
+      calibration: imu_calibration.Calibration = (
+          imu_calibration.DEFAULT_CALIBRATION)):
+    self.i2c = busio.I2C(board.SCL, board.SDA)
+    self.accel = accelerometer.Accelerometer(self.i2c, calibration)
+    self.gyro = gyroscope.Gyroscope(self.i2c)
+
+  def GetProtos(self) -> Tuple[exit_speed_pb2.Accelerometer,
+                               exit_speed_pb2.Gyroscope]:
+    """Reads both sensors back to back."""
+    x, y, z = self.accel.GetGForces()
+    gyro_x, gyro_y, gyro_z = self.gyro.GetRotationalValues()
+    return (exit_speed_pb2.Accelerometer(accelerometer_x=x,
+                                         accelerometer_y=y,
+                                         accelerometer_z=z),
+            exit_speed_pb2.Gyroscope(gyro_x=gyro_x,
+                                     gyro_y=gyro_y,
+                                     gyro_z=gyro_z))
+
+
+class IMUProcess(sensor.SensorBase):
+  """Logs and exports accelerometer and gyroscope values per loop."""
+  # Logged to the same files as the separate processes so import_data and the
+  # dashboards work with either.
+  LOG_FILE_NAMES = {
+      'Accelerometer': 'AccelerometerProcess',
+      'Gyroscope': 'GyroscopeProcess',
+  }
+
+  def __init__(
+      self,
+      session: common_lib.Session,
+      config: Dict,
+      point_queue: multiprocessing.Queue,
+      start_process: bool=True):
+    # Keyed by proto name as the proto classes can not be pickled.
+    self.data_loggers = {}
+    self.exporters = {
+        name: postgres.Postgres(getattr(exit_speed_pb2, name),
+                                start_process=start_process)
+        for name in self.LOG_FILE_NAMES}
+    super().__init__(
+        session, config, point_queue, start_process=start_process)
+
+  def WriteMessage(self, proto: any_pb2.Any):
+    name = proto.DESCRIPTOR.name
+    if name not in self.data_loggers:
+      file_prefix = sensor.GetLogFilePrefix(
+          self.session, self, self.LOG_FILE_NAMES[name])
+      logging.info('Logging data to %s', file_prefix)
+      self.data_loggers[name] = data_logger.Logger(
+          file_prefix, proto_class=type(proto))
+    self.data_loggers[name].WriteProto(proto)
+
+  def ExportProto(self, proto: any_pb2.Any):
+    self.exporters[proto.DESCRIPTOR.name].AddProtoToQueue(proto)
+
+  def Loop(self):
+    """Reads both sensors each cycle and timestamps them together."""
+    imu = IMU(imu_calibration.Load(self.config.get('imu')))
+    frequency_hz = int(
+        self.config.get('imu', {}).get('frequency_hz')) or 10
+    scheduler = sensor.Scheduler(self.__class__.__name__, frequency_hz)
+    while not self.stop_process_signal.value:
+      timestamp_ns = scheduler.Wait()
+      for proto in imu.GetProtos():
+        self.LogAndExportProto(proto, timestamp_ns)
+
+
+def main(unused_argv):
+  imu = IMU()
+  while True:
+    accel_proto, gyro_proto = imu.GetProtos()
+    print('%.2f %.2f %.2f  %.2f %.2f %.2f' % (
+        accel_proto.accelerometer_x, accel_proto.accelerometer_y,
+        accel_proto.accelerometer_z, gyro_proto.gyro_x, gyro_proto.gyro_y,
+        gyro_proto.gyro_z))
+    time.sleep(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
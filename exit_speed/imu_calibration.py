@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Accelerometer calibration.
+
+Each axis has an offset and gain derived from the readings with that axis
+pointing straight up and down.
+https://learn.sparkfun.com/tutorials/adxl345-hookup-guide#calibration
+https://www.nxp.com/docs/en/application-note/AN4399.pdf
+
+To fit a new calibration log the accelerometer while holding it still in each
+of the six orientations then run:
+
+  python3 -m exit_speed.imu_calibration \
+    --calibration_log=<AccelerometerProcess data> --config_path=<config>
+
+The log is converted back to the raw readings with the calibration of the
+config it was recorded with.  This does not need the hardware libraries.
+"""
+from typing import Dict
+from typing import NamedTuple
+
+import numpy as np
+from absl import app
+from absl import flags
+
+from exit_speed import config_lib
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('calibration_log', None,
+                    'AccelerometerProcess data file recorded in each of the '
+                    'six orientations.')
+flags.DEFINE_enum('calibration_sensor', 'imu', ['accelerometer', 'imu'],
+                  'Config key of the sensor the log was recorded with.')
+flags.DEFINE_integer('calibration_static_window', 10,
+                     'Number of consecutive readings which must be still for '
+                     'them to be used in the calibration.')
+flags.DEFINE_float('calibration_static_std', 0.1,
+                   'Maximum standard deviation in m/s^2 of each axis over '
+                   'the window for the readings to be considered still.')
+
+GRAVITY = 9.81
+# Readings in m/s^2 of the Corrado's FXOS8700 with each axis pointing down and
+# up.
+DEFAULT_LOW = np.array([-9.7459664498, -9.8632147572, -9.4660062056])
+DEFAULT_HIGH = np.array([10.420742422999998, 9.164510558, 10.301101292999999])
+
+
+class Calibration(NamedTuple):
+  offset: np.ndarray  # m/s^2 of x, y, z.
+  gain: np.ndarray  # Of x, y, z.
+
+
+def FromLowHigh(low: np.ndarray, high: np.ndarray) -> Calibration:
+  """Returns the calibration of the readings pointing down and up."""
+  return Calibration(offset=0.5 * (high + low),
+                     gain=0.5 * ((high - low) / GRAVITY))
+
+
+DEFAULT_CALIBRATION = FromLowHigh(DEFAULT_LOW, DEFAULT_HIGH)
+
+
+def Load(sensor_config: Dict) -> Calibration:
+  """Returns the calibration of the sensor's config or the default.
+
+  Args:
+    sensor_config: Such as config['imu'] which may contain
+                   calibration: {offset: [x, y, z], gain: [x, y, z]}
+  """
+  calibration = (sensor_config or {}).get('calibration')
+  if not calibration:
+    return DEFAULT_CALIBRATION
+  return Calibration(offset=np.array(calibration['offset'], dtype=float),
+                     gain=np.array(calibration['gain'], dtype=float))
+
+
+def Correct(calibration: Calibration, values: np.ndarray) -> np.ndarray:
+  """Returns the calibrated m/s^2 of a x, y, z reading or (n, 3) readings."""
+  return (values - calibration.offset) / calibration.gain
+
+
+def Uncorrect(calibration: Calibration, values: np.ndarray) -> np.ndarray:
+  """Inverse of Correct which returns the raw readings."""
+  return values * calibration.gain + calibration.offset
+
+
+def Fit(values: np.ndarray) -> Calibration:
+  """Fits the calibration to raw readings.
+
+  Args:
+    values: (n, 3) m/s^2 readings with the accelerometer held still in each of
+            the six orientations.  Readings while moving between them are
+            ignored.
+
+  Returns:
+    The calibration.
+
+  Raises:
+    ValueError: If any orientation is missing.
+  """
+  windows = np.lib.stride_tricks.sliding_window_view(
+      values, FLAGS.calibration_static_window, axis=0)
+  still = np.all(windows.std(axis=2) < FLAGS.calibration_static_std, axis=1)
+  static = values[:len(still)][still]
+  dominant_axis = np.argmax(np.abs(static), axis=1)
+  low = np.empty(3)
+  high = np.empty(3)
+  for axis, name in enumerate('xyz'):
+    readings = static[dominant_axis == axis, axis]
+    down = readings[readings < 0]
+    up = readings[readings > 0]
+    if not down.size or not up.size:
+      raise ValueError('The log is missing static readings with %s pointing '
+                       '%s.' % (name, 'down' if not down.size else 'up'))
+    low[axis] = np.median(down)
+    high[axis] = np.median(up)
+  return FromLowHigh(low, high)
+
+
+def main(unused_argv):
+  config = config_lib.LoadConfig()
+  recorded_with = Load(config.get(FLAGS.calibration_sensor))
+  logger = data_logger.Logger(FLAGS.calibration_log,
+                              proto_class=exit_speed_pb2.Accelerometer)
+  g_forces = np.array([
+      (proto.accelerometer_x, proto.accelerometer_y, proto.accelerometer_z)
+      for proto in logger.ReadProtos()])
+  calibration = Fit(Uncorrect(recorded_with, g_forces * GRAVITY))
+  print('%s:' % FLAGS.calibration_sensor)
+  print('  calibration:')
+  print('    offset: [%s]' % ', '.join('%.6f' % v for v in calibration.offset))
+  print('    gain: [%s]' % ', '.join('%.6f' % v for v in calibration.gain))
+
+
+if __name__ == '__main__':
+  flags.mark_flag_as_required('calibration_log')
+  app.run(main)
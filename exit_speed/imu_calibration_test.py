@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for imu_calibration.py"""
+import unittest
+
+import numpy as np
+from absl.testing import absltest
+
+from exit_speed import imu_calibration
+
+
+def _StaticLog(calibration: imu_calibration.Calibration) -> np.ndarray:
+  """Raw readings held still in each orientation and moving in between."""
+  rand = np.random.default_rng(0)
+  values = []
+  for axis in range(3):
+    for sign in (-1, 1):
+      g_forces = np.zeros((50, 3))
+      g_forces[:, axis] = sign
+      values.append(g_forces + rand.normal(0, 0.002, g_forces.shape))
+      values.append(rand.uniform(-2, 2, (20, 3)))
+  return imu_calibration.Uncorrect(
+      calibration, np.concatenate(values) * imu_calibration.GRAVITY)
+
+
+class TestIMUCalibration(unittest.TestCase):
+  """IMU calibration unittests."""
+
+  def testLoadDefault(self):
+    for sensor_config in (None, {}, {'frequency_hz': '40'}):
+      self.assertIs(imu_calibration.DEFAULT_CALIBRATION,
+                    imu_calibration.Load(sensor_config))
+
+  def testLoad(self):
+    # yaml.BaseLoader loads the values as strings.
+    calibration = imu_calibration.Load(
+        {'calibration': {'offset': ['0.1', '-0.2', '0.3'],
+                         'gain': ['1.01', '0.99', '1']}})
+    self.assertEqual([0.1, -0.2, 0.3], calibration.offset.tolist())
+    self.assertEqual([1.01, 0.99, 1], calibration.gain.tolist())
+
+  def testCorrectAndUncorrect(self):
+    calibration = imu_calibration.DEFAULT_CALIBRATION
+    low = imu_calibration.Correct(calibration, imu_calibration.DEFAULT_LOW)
+    high = imu_calibration.Correct(calibration, imu_calibration.DEFAULT_HIGH)
+    np.testing.assert_allclose([-imu_calibration.GRAVITY] * 3, low)
+    np.testing.assert_allclose([imu_calibration.GRAVITY] * 3, high)
+    values = np.array([[1, 2, 3], [-4, 5, -6]], dtype=float)
+    np.testing.assert_allclose(
+        values,
+        imu_calibration.Uncorrect(
+            calibration, imu_calibration.Correct(calibration, values)))
+
+  def testFit(self):
+    expected = imu_calibration.DEFAULT_CALIBRATION
+    calibration = imu_calibration.Fit(_StaticLog(expected))
+    np.testing.assert_allclose(expected.offset, calibration.offset, atol=0.01)
+    np.testing.assert_allclose(expected.gain, calibration.gain, atol=0.01)
+
+  def testFitMissingOrientation(self):
+    values = _StaticLog(imu_calibration.DEFAULT_CALIBRATION)
+    values = values[values[:, 2] < 5]
+    with self.assertRaisesRegex(ValueError, 'z pointing up'):
+      imu_calibration.Fit(values)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for imu.py"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import unittest
+
+import fake_rpi
+import mock
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+# pylint: disable=wrong-import-position
+# Fixes dotstar import on Travis.
+sys.modules['RPi'] = fake_rpi.RPi     # Fake RPi
+sys.modules['RPi.GPIO'] = fake_rpi.RPi.GPIO # Fake GPIO
+sys.modules['smbus'] = fake_rpi.smbus # Fake smbus (I2C)
+import adafruit_platformdetect
+with mock.patch.object(adafruit_platformdetect, 'Detector') as mock_detector:
+  mock_detector.chip.id.return_value = 'BCM2XXX'
+  import adafruit_fxas21002c
+  import adafruit_fxos8700
+  import busio
+  from exit_speed import imu
+from exit_speed import common_lib
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import tracks
+# pylint: enable=wrong-import-position
+
+FLAGS = flags.FLAGS
+FLAGS.set_default('data_log_path', '/tmp')
+
+
+class TestIMU(unittest.TestCase):
+  """IMU unittests."""
+
+  def setUp(self):
+    super().setUp()
+    with mock.patch.object(busio, 'I2C') as self.mock_i2c:
+      with mock.patch.object(adafruit_fxos8700, 'FXOS8700') as self.mock_accel:
+        with mock.patch.object(
+            adafruit_fxas21002c, 'FXAS21002C') as self.mock_gyro:
+          self.imu = imu.IMU()
+    self.session = common_lib.Session(
+        time=exit_speed_pb2.Gps().time.ToDatetime(),
+        track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+        car='RC Car',
+        live_data=False)
+
+  def testSharedBus(self):
+    self.mock_i2c.assert_called_once()
+    self.mock_accel.assert_called_once_with(
+        self.imu.i2c, accel_range=adafruit_fxos8700.ACCEL_RANGE_8G)
+    self.mock_gyro.assert_called_once_with(self.imu.i2c)
+
+  def testGetProtos(self):
+    self.imu.accel.accelerometer.accelerometer = (
+        0.3924229, -0.5072783912, 10.29870)
+    self.imu.gyro.sensor.gyroscope = (
+        0.024816400301794373, -0.27052603405912107, -0.9467047653591117)
+    accel_proto, gyro_proto = self.imu.GetProtos()
+    self.assertEqual(
+        exit_speed_pb2.Accelerometer(
+            accelerometer_x=0.005457996517639941,
+            accelerometer_y=-0.016599597585513083,
+            accelerometer_z=0.9997570415398239),
+        accel_proto)
+    self.assertEqual(
+        exit_speed_pb2.Gyroscope(
+            gyro_x=1.421875, gyro_y=-15.5, gyro_z=-54.2421875),
+        gyro_proto)
+
+  @flagsaver.flagsaver
+  def testLogAndExportProto(self):
+    # Data files are appended to, use a fresh directory for each run.
+    FLAGS.data_log_path = tempfile.mkdtemp()
+    process = imu.IMUProcess(
+        self.session, {}, multiprocessing.Queue(), start_process=False)
+    timestamp_ns = 1590256064100000000
+    accel_proto = exit_speed_pb2.Accelerometer(accelerometer_x=1)
+    gyro_proto = exit_speed_pb2.Gyroscope(gyro_x=2)
+    with mock.patch.object(
+        process.exporters['Accelerometer'],
+        'AddProtoToQueue') as mock_accel_export:
+      with mock.patch.object(
+          process.exporters['Gyroscope'],
+          'AddProtoToQueue') as mock_gyro_export:
+        process.LogAndExportProto(accel_proto, timestamp_ns)
+        process.LogAndExportProto(gyro_proto, timestamp_ns)
+    mock_accel_export.assert_called_once_with(accel_proto)
+    mock_gyro_export.assert_called_once_with(gyro_proto)
+    self.assertEqual(timestamp_ns, accel_proto.time.ToNanoseconds())
+    self.assertEqual(timestamp_ns, gyro_proto.time.ToNanoseconds())
+    for name, proto in (('Accelerometer', accel_proto),
+                        ('Gyroscope', gyro_proto)):
+      logger = process.data_loggers[name]
+      logger.current_file.flush()
+      file_prefix = logger.file_prefix
+      self.assertEqual('%sProcess' % name, os.path.basename(file_prefix))
+      reader = data_logger.Logger(file_prefix, proto_class=type(proto))
+      self.assertEqual([proto], list(reader.ReadProtos()))
+
+
+if __name__ == '__main__':
+  absltest.main()
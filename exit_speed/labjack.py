@@ -19,13 +19,33 @@ import sys
 import time
 import traceback
 from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Text
+from typing import Tuple
 
+import numpy as np
 import u3
 from absl import logging
 
 from exit_speed import exit_speed_pb2
 from exit_speed import sensor
 
+TEMPERATURE_CHANNEL = 30
+SINGLE_ENDED = 31  # Negative channel of single ended readings.
+STREAM_HEADER_BYTES = 12
+STREAM_FOOTER_BYTES = 2
+
+
+class Channel(NamedTuple):
+  """Converts the binary readings of an input to the value of a proto field."""
+  proto_field: Text
+  channel: int
+  slope: float
+  offset: float
+
 
 class Labjack(sensor.SensorBase):
   """Interface for the labjack DAQ."""
@@ -39,6 +59,12 @@ class Labjack(sensor.SensorBase):
       point_queue: multiprocessing.Queue,
       start_process:bool=True):
     self.u3 = None
+    self.channels = []
+    self.feedback_commands = []
+    self.fields = []
+    self.slopes = np.empty(0)
+    self.offsets = np.empty(0)
+    self.stream_remainder = np.empty(0, dtype=np.uint16)
     super().__init__(
         start_time, config, point_queue, start_process=start_process)
 
@@ -53,29 +79,117 @@ class Labjack(sensor.SensorBase):
         dac0_register = 5000
         self.u3.writeRegister(dac0_register, 5.0)
 
-  def ReadValues(self):
-    """Reads the labjack voltages."""
+  def GetChannels(self) -> List[Channel]:
+    """Returns the configured inputs including the labjack's temperature."""
+    temp_slope = self.u3.binaryToCalibratedAnalogTemperature(1)
+    # Kelvin to fahrenheit.
+    channels = [Channel('labjack_temp_f', TEMPERATURE_CHANNEL,
+                        temp_slope * 9.0/5.0, -459.67)]
+    labjack_config = self.config['labjack']
+    for input_name, proto_field in labjack_config.items():
+      if input_name.startswith('ain') or input_name.startswith('fio'):
+        # Note AIN4 is reading voltage from FIO4.  Physically AIN4 and FIO4 are
+        # identical.  AIN is for analog input and FIO is flexible input/output.
+        channel = int(input_name[-1])
+        slope, offset = self.u3.getCalibratedSlopeOffset(
+            isLowVoltage=channel not in self.HIGH_VOLTAGE_CHANNELS,
+            channelNumber=channel)
+        if input_name in labjack_config.get('tick_divider_10', ()):
+          slope, offset = slope * 10, offset * 10
+        channels.append(Channel(proto_field, channel, slope, offset))
+    return channels
+
+  def InitializeChannels(self) -> None:
+    """Caches the channels, their feedback commands and conversions."""
+    self.channels = self.GetChannels()
+    self.feedback_commands = [u3.AIN(channel.channel, SINGLE_ENDED)
+                              for channel in self.channels]
+    self.fields = [channel.proto_field for channel in self.channels]
+    self.slopes = np.array([channel.slope for channel in self.channels])
+    self.offsets = np.array([channel.offset for channel in self.channels])
+
+  def ToProto(self, values: List[float]) -> exit_speed_pb2.Labjack:
+    return exit_speed_pb2.Labjack(**dict(zip(self.fields, values)))
+
+  def StartStream(self, scan_hz: float) -> None:
+    """Configures the labjack to scan all the channels at the given rate."""
+    self.u3.streamConfig(
+        NumChannels=len(self.channels),
+        PChannels=[channel.channel for channel in self.channels],
+        NChannels=[SINGLE_ENDED] * len(self.channels),
+        Resolution=3,
+        ScanFrequency=scan_hz)
+    self.stream_remainder = np.empty(0, dtype=np.uint16)
+    self.u3.streamStart()
+
+  def DecodeStream(self, result: bytes) -> np.ndarray:
+    """Returns the (scans, channels) binary readings of stream packets.
+
+    A scan can span packets so any samples of an incomplete scan are kept for
+    the next call.
+    """
+    samples_per_packet = self.u3.streamSamplesPerPacket
+    packet_bytes = (
+        STREAM_HEADER_BYTES + samples_per_packet * 2 + STREAM_FOOTER_BYTES)
+    packets = np.frombuffer(result, dtype=np.uint8).reshape(-1, packet_bytes)
+    samples = packets[:, STREAM_HEADER_BYTES:-STREAM_FOOTER_BYTES].copy()
+    samples = np.concatenate((self.stream_remainder,
+                              samples.view('<u2').ravel()))
+    channel_count = len(self.channels)
+    scans = len(samples) // channel_count
+    self.stream_remainder = samples[scans * channel_count:]
+    return samples[:scans * channel_count].reshape(scans, channel_count)
+
+  def ProcessStream(
+      self,
+      data: Dict,
+      read_ns: int,
+      period_ns: float) -> Iterator[Tuple[int, exit_speed_pb2.Labjack]]:
+    """Converts a block of stream data to timestamped protos.
+
+    Args:
+      data: A result of u3.streamData(convert=False).
+      read_ns: Wall clock nanoseconds the block was read.  The newest scan is
+               timestamped with it and the older scans are spaced by the scan
+               period.  Reading the clock per block follows NTP or GPS setting
+               it after start up.
+      period_ns: Nanoseconds between scans.
+
+    Yields:
+      The timestamp and proto of each scan.
+    """
+    if data['missed']:
+      logging.warning('Labjack stream missed %d samples', data['missed'])
+    values = self.DecodeStream(data['result']) * self.slopes + self.offsets
+    newest = len(values) - 1
+    for index, row in enumerate(values.tolist()):
+      yield read_ns - int((newest - index) * period_ns), self.ToProto(row)
+
+  def StreamLoop(self, scan_hz: float) -> None:
+    """Logs every scan of the labjack's hardware clocked stream."""
+    self.StartStream(scan_hz)
+    period_ns = 1e9 / scan_hz
+    try:
+      for data in self.u3.streamData(convert=False):
+        if self.stop_process_signal.value:
+          break
+        if data is None:
+          continue
+        for timestamp_ns, proto in self.ProcessStream(
+            data, time.time_ns(), period_ns):
+          self.LogAndExportProto(proto, timestamp_ns)
+    finally:
+      self.u3.streamStop()
+
+  def ReadValues(self, timestamp_ns: Optional[int] = None):
+    """Reads the labjack voltages in a single feedback command."""
     try:
       if self.config.get('labjack'):
-        proto = exit_speed_pb2.Labjack()
-        proto.labjack_temp_f = (
-            self.u3.getTemperature() * 9.0/5.0 - 459.67)
-        for input_name, proto_field in self.config['labjack'].items():
-          if input_name.startswith('ain') or input_name.startswith('fio'):
-            channel = int(input_name[-1])
-            # Note getFeedback(u3.AIN(4)) is reading voltage from FIO4.
-            # Physically AIN4 and FIO4 are identical.  AIN is for analog input
-            # and FIO is flexible input/output.
-            feedback = self.u3.getFeedback(u3.AIN(channel))[0]
-            is_low_voltage = channel not in self.HIGH_VOLTAGE_CHANNELS
-            voltage = self.u3.binaryToCalibratedAnalogVoltage(
-                feedback,
-                isLowVoltage=is_low_voltage,
-                channelNumber=channel)
-            if input_name in self.config['labjack'].get('tick_divider_10'):
-              voltage = voltage * 10
-            setattr(proto, proto_field, voltage)
-        self.LogAndExportProto(proto)
+        if not self.channels:
+          self.InitializeChannels()
+        binary = np.array(self.u3.getFeedback(*self.feedback_commands))
+        proto = self.ToProto((binary * self.slopes + self.offsets).tolist())
+        self.LogAndExportProto(proto, timestamp_ns)
     except u3.LabJackException:
       stack_trace = ''.join(traceback.format_exception(*sys.exc_info()))
       logging.log_every_n_seconds(logging.ERROR,
@@ -89,9 +203,13 @@ class Labjack(sensor.SensorBase):
     # read voltages on these terminals.
     self.u3.configIO(FIOAnalog = 0b11111111)
     self.Set5vOutput()
+    self.InitializeChannels()
+    stream_hz = self.config.get('labjack', {}).get('stream_hz')
+    if stream_hz:
+      self.StreamLoop(float(stream_hz))
+      return
     frequency_hz = int(
         self.config.get('labjack', {}).get('frequency_hz')) or 10
+    scheduler = sensor.Scheduler(self.__class__.__name__, frequency_hz)
     while not self.stop_process_signal.value:
-      cycle_time = time.time()
-      self.ReadValues()
-      time.sleep(sensor.SleepBasedOnHertz(cycle_time, frequency_hz))
+      self.ReadValues(scheduler.Wait())
@@ -19,6 +19,7 @@ import os
 import unittest
 
 import mock
+import numpy as np
 import u3
 from absl import flags
 from absl.testing import absltest
@@ -48,35 +49,98 @@ class TestLabjack(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.labjack.u3 = self.mock_u3
 
   def testReadValues(self):
+    self._MockCalibration()
+    self.mock_u3.getFeedback.return_value = [
+        22943, 32816, 35696, 32827, 39968]
+    with mock.patch.object(
+        self.labjack, 'LogAndExportProto') as mock_log_and_export:
+      self.labjack.ReadValues(1590256064100000000)
+      self.labjack.ReadValues(1590256064200000000)
+    # All channels are read in one command which is only built once.
+    self.assertEqual(2, self.mock_u3.getFeedback.call_count)
+    commands = self.mock_u3.getFeedback.call_args[0]
+    self.assertEqual([(30, 31), (0, 31), (1, 31), (2, 31), (4, 31)],
+                     [(command.positiveChannel, command.negativeChannel)
+                      for command in commands])
+    self.assertEqual(4, self.mock_u3.getCalibratedSlopeOffset.call_count)
+    mock_log_and_export.assert_called_with(
+      exit_speed_pb2.Labjack(
+        labjack_temp_f=22943 * (0.013021 * 9.0/5.0) - 459.67,
+        fuel_level_voltage=32816 * 0.000314 - 10.3,
+        water_temp_voltage=35696 * 0.000314 - 10.3,
+        oil_pressure_voltage=32827 * 0.000314 - 10.3,
+        battery_voltage=39968 * (0.000037231 * 10)),
+      1590256064200000000)
+
+  def _MockCalibration(self):
     # pylint: disable=invalid-name
-    # pylint: disable=unused-argument
-    def _binaryToCalibratedAnalogVoltage(result, isLowVoltage, channelNumber):
+    def _getCalibratedSlopeOffset(isLowVoltage, channelNumber):
       if channelNumber in self.labjack.HIGH_VOLTAGE_CHANNELS:
         self.assertFalse(isLowVoltage)
-      else:
-        self.assertTrue(isLowVoltage)
-      mapping = {32816: 1.5,
-                 35696: 2.7,
-                 32827: 3.9,
-                 39968: 1.4}
-      return mapping[result]
+        return 0.000314, -10.3
+      self.assertTrue(isLowVoltage)
+      return 0.000037231, 0
     # pylint: enable=invalid-name
-    # pylint: enable=unused-argument
-    self.mock_u3.getTemperature.return_value = 298.73988991230726
-    self.mock_u3.getFeedback.side_effect = [[32816], [35696], [32827], [39968]]
-    self.mock_u3.binaryToCalibratedAnalogVoltage.side_effect = (
-        _binaryToCalibratedAnalogVoltage)
-    with mock.patch.object(
-        self.labjack, 'LogAndExportProto') as mock_log_and_export:
-      self.labjack.ReadValues()
-    mock_log_and_export.assert_called_once_with(
-      exit_speed_pb2.Labjack(
-        labjack_temp_f=78.061801842153101916,
-        fuel_level_voltage=1.5,
-        water_temp_voltage=2.7,
-        oil_pressure_voltage=3.9,
-        battery_voltage=14.0))
+    self.mock_u3.getCalibratedSlopeOffset.side_effect = (
+        _getCalibratedSlopeOffset)
+    self.mock_u3.binaryToCalibratedAnalogTemperature.return_value = 0.013021
+
+  def testGetChannels(self):
+    self._MockCalibration()
+    self.assertEqual(
+        [labjack.Channel('labjack_temp_f', 30, 0.013021 * 9.0/5.0, -459.67),
+         labjack.Channel('fuel_level_voltage', 0, 0.000314, -10.3),
+         labjack.Channel('water_temp_voltage', 1, 0.000314, -10.3),
+         labjack.Channel('oil_pressure_voltage', 2, 0.000314, -10.3),
+         labjack.Channel('battery_voltage', 4, 0.000037231 * 10, 0)],
+        self.labjack.GetChannels())
+
+  def _StreamPackets(self, samples, samples_per_packet=4):
+    """Packs samples into stream packets."""
+    packets = []
+    for start in range(0, len(samples), samples_per_packet):
+      packet = samples[start:start + samples_per_packet]
+      packets.append(bytes(12) + np.array(packet, dtype='<u2').tobytes() +
+                     bytes(2))
+    return b''.join(packets)
+
+  def testDecodeStream(self):
+    self.mock_u3.streamSamplesPerPacket = 4
+    self.labjack.channels = [
+        labjack.Channel('labjack_temp_f', 30, 1, 0),
+        labjack.Channel('fuel_level_voltage', 0, 1, 0),
+        labjack.Channel('water_temp_voltage', 1, 1, 0)]
+    # Three channels, the second scan spans both packets.
+    result = self._StreamPackets([1, 2, 3, 4, 5, 6, 7, 8])
+    self.assertEqual([[1, 2, 3], [4, 5, 6]],
+                     self.labjack.DecodeStream(result).tolist())
+    self.assertEqual([7, 8], self.labjack.stream_remainder.tolist())
+    result = self._StreamPackets([9, 10, 11, 12])
+    self.assertEqual([[7, 8, 9], [10, 11, 12]],
+                     self.labjack.DecodeStream(result).tolist())
+    self.assertEqual(0, len(self.labjack.stream_remainder))
 
+  def testProcessStream(self):
+    self.mock_u3.streamSamplesPerPacket = 4
+    with mock.patch.object(self.labjack, 'GetChannels') as mock_channels:
+      mock_channels.return_value = [
+          labjack.Channel('labjack_temp_f', 30, 0.5, -900),
+          labjack.Channel('front_brake_pressure_voltage', 2, 0.001, 0)]
+      self.labjack.InitializeChannels()
+    data = {'result': self._StreamPackets([2000, 1500, 2001, 2500]),
+            'missed': 0}
+    self.assertEqual(
+        [(1000000000, exit_speed_pb2.Labjack(
+            labjack_temp_f=100, front_brake_pressure_voltage=1.5)),
+         (1005000000, exit_speed_pb2.Labjack(
+            labjack_temp_f=100.5, front_brake_pressure_voltage=2.5))],
+        list(self.labjack.ProcessStream(data, 1005000000, 5e6)))
+    # Each block is timestamped by when it was read even if samples were
+    # missed or the clock was set in between.
+    data = {'result': self._StreamPackets([2000, 1000, 0, 0]), 'missed': 4}
+    timestamps = [timestamp for timestamp, _ in self.labjack.ProcessStream(
+        data, 3600025000000, 5e6)]
+    self.assertEqual([3600020000000, 3600025000000], timestamps)
 
 if __name__ == '__main__':
   absltest.main()
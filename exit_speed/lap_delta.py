@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Predictive time delta of the current lap against the best lap.
+
+The best lap is stored as cumulative distance and elapsed time arrays.  Each
+point of the current lap is projected onto the best lap's driving line near
+where the prior point matched, and the best lap's elapsed time at that
+distance is compared with the current lap's elapsed time.
+"""
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from exit_speed import exit_speed_pb2
+from exit_speed import reference_lap
+from exit_speed import track_cursor
+
+
+class LapDelta(object):
+  """Running time gain or loss of the current lap against the best lap."""
+
+  def __init__(self):
+    self.best_lap_duration_ns = None
+    self.x = None
+    self.y = None
+    self.distance = None
+    self.elapsed_ns = None
+    self.projection = None
+    self.cursor = None
+    self.lap_start_ns = None
+    self.delta = None  # Seconds, positive is behind the best lap.
+
+  def SetBestLap(self,
+                 lap: List[exit_speed_pb2.Gps],
+                 duration_ns: float) -> None:
+    """Builds the reference arrays if the lap is the fastest so far."""
+    if self.best_lap_duration_ns and duration_ns >= self.best_lap_duration_ns:
+      return
+    if len(lap) < 2:
+      return
+    self.SetReference(reference_lap.Build(lap, duration_ns))
+
+  def SetReference(self, reference: reference_lap.ReferenceLap) -> None:
+    """Uses the precomputed lap if it is the fastest so far."""
+    if (self.best_lap_duration_ns and
+        reference.duration_ns >= self.best_lap_duration_ns):
+      return
+    if len(reference.x) < 2:
+      return
+    self.best_lap_duration_ns = reference.duration_ns
+    self.projection = reference.projection
+    self.x = reference.x
+    self.y = reference.y
+    self.distance = reference.distance
+    self.elapsed_ns = reference.elapsed_ns
+    self.cursor = track_cursor.TrackCursor(self.x, self.y, reference.tree)
+
+  def StartLap(self, point: exit_speed_pb2.Gps) -> None:
+    """Starts timing a new lap from the given first point."""
+    self.lap_start_ns = point.time.ToNanoseconds()
+    if self.cursor:
+      self.cursor.Reset()
+    self.delta = None
+
+  def _ProjectOntoSegment(self, index: int, x: float, y: float):
+    """Returns the squared distance and best lap distance of the projection."""
+    start_x = self.x[index]
+    start_y = self.y[index]
+    segment_x = self.x[index + 1] - start_x
+    segment_y = self.y[index + 1] - start_y
+    length_2 = segment_x ** 2 + segment_y ** 2
+    fraction = 0.0
+    if length_2:
+      fraction = ((x - start_x) * segment_x +
+                  (y - start_y) * segment_y) / length_2
+      fraction = min(max(fraction, 0.0), 1.0)
+    proj_x = start_x + fraction * segment_x
+    proj_y = start_y + fraction * segment_y
+    distance = self.distance[index] + fraction * (
+        self.distance[index + 1] - self.distance[index])
+    return (x - proj_x) ** 2 + (y - proj_y) ** 2, distance
+
+  def FindDistance(self, point: exit_speed_pb2.Gps) -> float:
+    """Returns the distance along the best lap nearest to the point."""
+    x, y = self.projection.PointToXY(point)
+    index = self.cursor.FindNearest(x, y)
+    last = len(self.x) - 1
+    # The point is on either side of the nearest best lap point.
+    projections = []
+    if index < last:
+      projections.append(self._ProjectOntoSegment(index, x, y))
+    if index > 0:
+      projections.append(self._ProjectOntoSegment(index - 1, x, y))
+    return min(projections)[1]
+
+  def ElapsedAtDistance(self, distance: float) -> float:
+    """Returns the best lap's elapsed time (nanoseconds) at the distance."""
+    index = int(np.searchsorted(self.distance, distance, side='right'))
+    if index >= len(self.distance):
+      return self.elapsed_ns[-1]
+    if index == 0:
+      return self.elapsed_ns[0]
+    start = self.distance[index - 1]
+    span = self.distance[index] - start
+    fraction = (distance - start) / span if span else 0.0
+    return self.elapsed_ns[index - 1] + fraction * (
+        self.elapsed_ns[index] - self.elapsed_ns[index - 1])
+
+  def Update(self, point: exit_speed_pb2.Gps) -> Optional[float]:
+    """Returns how many seconds the current lap is behind the best lap.
+
+    Negative values are ahead of the best lap.  None until there is a best
+    lap and the current lap has started.
+    """
+    if self.distance is None or self.lap_start_ns is None:
+      return None
+    best_elapsed_ns = self.ElapsedAtDistance(self.FindDistance(point))
+    elapsed_ns = point.time.ToNanoseconds() - self.lap_start_ns
+    self.delta = float(elapsed_ns - best_elapsed_ns) / 1e9
+    return self.delta
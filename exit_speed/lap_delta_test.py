@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for lap_delta.py"""
+import os
+import unittest
+
+from absl.testing import absltest
+
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import lap_delta
+from exit_speed import lap_lib
+from exit_speed import tracks
+
+PIR_SESSION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'testdata/Corrado/Portland International Raceway/2020-06-20/'
+    'GPSProcess_1.data')
+
+
+def _StraightLap(seconds_per_point, points=11):
+  """Drives north 0.0001 degrees (~11m) per point."""
+  lap = []
+  for index in range(points):
+    point = exit_speed_pb2.Gps(lat=45.0 + index * 0.0001, lon=-122.0)
+    point.time.FromNanoseconds(int(index * seconds_per_point * 1e9))
+    lap.append(point)
+  return lap
+
+
+class TestLapDelta(unittest.TestCase):
+  """Lap delta unittests."""
+
+  def testNoBestLap(self):
+    delta = lap_delta.LapDelta()
+    point = _StraightLap(1)[0]
+    delta.StartLap(point)
+    self.assertIsNone(delta.Update(point))
+
+  def testSetBestLap(self):
+    delta = lap_delta.LapDelta()
+    delta.SetBestLap(_StraightLap(1), 10e9)
+    self.assertEqual(0, delta.distance[0])
+    self.assertAlmostEqual(111.1, delta.distance[-1], places=1)
+    self.assertEqual(10e9, delta.elapsed_ns[-1])
+    # Slower laps are ignored.
+    delta.SetBestLap(_StraightLap(2), 20e9)
+    self.assertEqual(10e9, delta.elapsed_ns[-1])
+
+  def testElapsedAtDistance(self):
+    delta = lap_delta.LapDelta()
+    delta.SetBestLap(_StraightLap(1), 10e9)
+    self.assertEqual(0, delta.ElapsedAtDistance(0))
+    self.assertAlmostEqual(
+        5.5e9, delta.ElapsedAtDistance(delta.distance[-1] * 0.55), delta=1e6)
+    self.assertEqual(10e9, delta.ElapsedAtDistance(1000))
+
+  def testUpdate(self):
+    delta = lap_delta.LapDelta()
+    delta.SetBestLap(_StraightLap(1), 10e9)
+    lap = _StraightLap(1.5)
+    delta.StartLap(lap[0])
+    deltas = [delta.Update(point) for point in lap]
+    for index, returned in enumerate(deltas):
+      self.assertAlmostEqual(index * 0.5, returned)
+    # Halfway between two points of the best lap.
+    point = exit_speed_pb2.Gps(lat=45.00005, lon=-122.00001)
+    point.time.FromNanoseconds(int(0.25e9))
+    delta.StartLap(lap[0])
+    self.assertAlmostEqual(-0.25, delta.Update(point), places=3)
+
+  def testPortlandInternationalRaceway(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    crossings, durations = lap_lib.SplitLaps(
+        track, *lap_lib.GpsArrays(points))
+    best = int(durations.argmin())
+    best_lap = points[crossings[best - 1] - 1:crossings[best]]
+    for lap_number in range(1, len(durations)):
+      delta = lap_delta.LapDelta()
+      delta.SetBestLap(best_lap, durations[best])
+      lap = points[crossings[lap_number - 1] - 1:crossings[lap_number]]
+      delta.StartLap(lap[0])
+      for point in lap:
+        delta.Update(point)
+      # Predicted delta at the end of each lap matches the lap times to within
+      # half a 10hz GPS point.
+      self.assertAlmostEqual(
+          (durations[lap_number] - durations[best]) / 1e9, delta.delta,
+          delta=0.05, msg='Lap %d' % lap_number)
+
+if __name__ == '__main__':
+  absltest.main()
@@ -13,14 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Unitests for lab_lib.py"""
+import os
 import unittest
 
+import attr
+import numpy as np
 from absl.testing import absltest
 
+from exit_speed import data_logger
 from exit_speed import exit_speed_pb2
 from exit_speed import lap_lib
 from exit_speed import tracks
 
+PIR_SESSION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'testdata/Corrado/Portland International Raceway/2020-06-20/'
+    'GPSProcess_1.data')
 
 
 class TestLapLib(unittest.TestCase):
@@ -58,7 +66,7 @@ class TestLapLib(unittest.TestCase):
     point_c = exit_speed_pb2.Gps(
       lat=45.595064,
       lon=-122.694638)
-    self.assertEqual(5.682068147351827,
+    self.assertEqual(5.682019983304959,
                      lap_lib.SolvePointBAngle(track, point_b, point_c))
 
   def testCalcAcceleration(self):
@@ -77,7 +85,7 @@ class TestLapLib(unittest.TestCase):
     point_b = exit_speed_pb2.Gps(
       lat=45.594980,
       lon=-122.694389)
-    self.assertEqual(5.6712016865347605,
+    self.assertEqual(5.671200143478353,
                      lap_lib.PerpendicularDistanceToFinish(track,
                                                            point_b_angle,
                                                            point_b))
@@ -117,7 +125,7 @@ class TestLapLib(unittest.TestCase):
     point_c.lon = -122.694638
     point_b.speed_ms = 70
     point_c.speed_ms = 70.2
-    self.assertEqual(1000000.0548742702,
+    self.assertEqual(1000000.0548742947,
 										 lap_lib.CalcTimeAfterFinish(track, lap))
 
   def testCalcLastLapDuration(self):
@@ -159,5 +167,88 @@ class TestLapLib(unittest.TestCase):
     point_c.speed_ms = 70.2
     self.assertEqual(2000000, lap_lib.CalcLastLapDuration(track, laps))
 
+  def testCalcGateCrossingTime(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    gate = track.start_finish_gate
+    point_b = exit_speed_pb2.Gps(lat=45.595039333, lon=-122.694491)
+    point_c = exit_speed_pb2.Gps(lat=45.595051046, lon=-122.69453468)
+    point_b.time.FromMilliseconds(1000)
+    point_c.time.FromMilliseconds(1100)
+    self.assertAlmostEqual(1042339837.5756304,
+                           lap_lib.CalcGateCrossingTime(gate, point_b, point_c))
+    # Driving backwards over the gate.
+    self.assertIsNone(lap_lib.CalcGateCrossingTime(gate, point_c, point_b))
+    # Same points, over 50 meters away from the end of the gate.
+    point_b.lat += 0.0005
+    point_b.lon += 0.0003
+    point_c.lat += 0.0005
+    point_c.lon += 0.0003
+    self.assertIsNone(lap_lib.CalcGateCrossingTime(gate, point_b, point_c))
+
+  def testCalcGateLapDuration(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    gate = track.start_finish_gate
+    point_b = exit_speed_pb2.Gps(lat=45.595039333, lon=-122.694491)
+    point_c = exit_speed_pb2.Gps(lat=45.595051046, lon=-122.69453468)
+    point_b.time.FromMilliseconds(1000)
+    point_c.time.FromMilliseconds(1100)
+    lap = [point_b, point_c]
+    self.assertEqual(
+        90 * 1e9,
+        lap_lib.CalcGateLapDuration(gate, lap, 90 * 1e9 + 1042339837.5756304))
+    # First lap of a session, starting away from start/finish.
+    self.assertEqual(90 * 1e9,
+                     lap_lib.CalcGateLapDuration(gate, [point_c], 91.1 * 1e9))
+
+  def testSplitLaps(self):
+    track = attr.evolve(
+        tracks.portland_internal_raceways.PortlandInternationalRaceway,
+        start_finish_gate=None)
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    crossings, durations = lap_lib.SplitLaps(
+        track, *lap_lib.GpsArrays(points))
+    self.assertEqual(15, len(crossings))
+    # Durations from replaying the session through ExitSpeed.ProcessLap.
+    self.assertSequenceEqual(
+        [162400000000, 96508634368, 92020972432, 92144408688, 91838929904,
+         90884317056, 91417934480, 91510285472, 93499884336, 92428355488,
+         91658659808, 91076583760, 91270345664, 90930683824, 91508900336],
+        durations.tolist())
+
+  def testSplitLapsGate(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    crossings, durations = lap_lib.SplitLaps(
+        track, *lap_lib.GpsArrays(points))
+    self.assertEqual(3248, crossings[0])
+    # Within a couple of milliseconds of the start/finish point estimates.
+    np.testing.assert_allclose(
+        [96508634400, 92020972432, 92144408672, 91838929920, 90884317040,
+         91417934496, 91510285456, 93499884352, 92428355488, 91658659808,
+         91076583760, 91270345664, 90930683824, 91508900336],
+        durations[1:], atol=2e6, rtol=0)
+    # Same as calculating each lap as the points arrive.
+    for lap_start, lap_end, duration_ns in zip(
+        crossings[:2], crossings[1:3], durations[1:3]):
+      lap = points[lap_start - 1:lap_end]
+      crossing_ns = lap_lib.CalcGateCrossingTime(
+          track.start_finish_gate, points[lap_end - 1], points[lap_end])
+      self.assertAlmostEqual(
+          duration_ns,
+          lap_lib.CalcGateLapDuration(track.start_finish_gate, lap,
+                                      crossing_ns),
+          delta=1000)
+
+  def testSplitLapsMinPointsPerLap(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    crossings, durations = lap_lib.SplitLaps(
+        track, *lap_lib.GpsArrays(points), min_points_per_lap=len(points))
+    self.assertEqual(0, len(crossings))
+    self.assertEqual(0, len(durations))
+
 if __name__ == '__main__':
   absltest.main()
@@ -13,22 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Controls the Adafruit LEDs."""
-import collections
-import statistics
+import threading
 import time
+from typing import Callable
 from typing import List
+from typing import Optional
 from typing import Tuple
 
-import adafruit_dotstar
-import board
-import numpy as np
 from absl import app
 from absl import flags
 from absl import logging
-from gps import EarthDistanceSmall
-from sklearn.neighbors import BallTree
 
 from exit_speed import exit_speed_pb2
+from exit_speed import reference_lap
+from exit_speed import smoothing_lib
+from exit_speed import track_cursor
 
 FLAGS = flags.FLAGS
 flags.DEFINE_float('led_brightness', 0.5,
@@ -40,33 +39,147 @@ flags.DEFINE_integer('speed_deltas', 10,
                      'Used to smooth out GPS data.  This controls how many '
                      'recent speed deltas are stored.  50 at 10hz means a '
                      'median of the last 5 seconds is used.')
+flags.DEFINE_enum('speed_delta_smoothing', 'median', ['median', 'ema'],
+                  'median is the rolling median of the last --speed_deltas '
+                  'deltas, each update is O(--speed_deltas) so it is meant '
+                  'for windows of tens of deltas.  ema is an exponential '
+                  'moving average weighted like a window of --speed_deltas.')
+flags.DEFINE_enum('led_delta_source', 'speed', ['speed', 'time'],
+                  'speed compares the speed with the nearest best lap point.  '
+                  'time shows whether the lap is ahead or behind the best '
+                  'lap based on the predicted time delta.')
+flags.DEFINE_enum('led_display_mode', 'fill', ['fill', 'bar'],
+                  'fill sets every LED to red or green.  bar lights a bar of '
+                  'LEDs which grows with the size of the delta.')
+flags.DEFINE_float('led_bar_speed_range', 5,
+                   'Speed delta in m/s which lights the full bar.')
+flags.DEFINE_float('led_bar_time_range', 1,
+                   'Time delta in seconds which lights the full bar.')
+flags.DEFINE_enum('led_backend', 'dotstar', ['dotstar', 'recording'],
+                  'dotstar drives the Adafruit DotStar LEDs over SPI.  '
+                  'recording keeps the frames in memory which allows running '
+                  'without the LEDs, for example when replaying a session.')
+
+LED_COUNT = 10
+Color = Tuple[int, int, int]
+Frame = Tuple[Color, ...]
+OFF = (0, 0, 0)
+# Bar gradients from the first to the last LED.
+BEHIND_GRADIENT = ((255, 160, 0), (255, 0, 0))  # Orange to red.
+AHEAD_GRADIENT = ((160, 255, 0), (0, 255, 0))  # Lime to green.
+
+
+def _Gradient(start: Color, end: Color, led_count: int) -> List[Color]:
+  steps = max(led_count - 1, 1)
+  return [tuple(round(a + (b - a) * index / steps) for a, b in zip(start, end))
+          for index in range(led_count)]
+
+
+def BuildBarFrames(led_count: int = LED_COUNT) -> List[Frame]:
+  """Returns the frame for each bar level from -led_count to led_count.
+
+  Level 0 is index led_count of the returned list.  Negative levels are ahead
+  of the best lap and light a green bar, positive levels a red bar.
+  """
+  ahead = _Gradient(*AHEAD_GRADIENT, led_count)
+  behind = _Gradient(*BEHIND_GRADIENT, led_count)
+  frames = []
+  for level in range(-led_count, led_count + 1):
+    gradient = ahead if level < 0 else behind
+    lit = abs(level)
+    frames.append(tuple(gradient[:lit]) + (OFF,) * (led_count - lit))
+  return frames
+
+
+class RecordingDots(object):
+  """Stands in for a DotStar strip and records each frame shown.
+
+  Attributes:
+    frames: A list of (time, frame) tuples in the order they were shown.
+    clock: Returns the time recorded with each frame.
+  """
+
+  def __init__(self,
+               led_count: int = LED_COUNT,
+               clock: Callable[[], float] = time.time):
+    self.pixels = [OFF] * led_count
+    self.frames = []
+    self.clock = clock
+
+  def __len__(self) -> int:
+    return len(self.pixels)
+
+  def __getitem__(self, index: int) -> Color:
+    return self.pixels[index]
+
+  def __setitem__(self, index: int, color: Color) -> None:
+    self.pixels[index] = color
+
+  def fill(self, color: Color) -> None:  # pylint: disable=invalid-name
+    self.pixels = [color] * len(self.pixels)
+
+  def show(self) -> None:  # pylint: disable=invalid-name
+    self.frames.append((self.clock(), tuple(self.pixels)))
+
+
+def CreateDots():
+  """Returns the LED strip for --led_backend."""
+  if FLAGS.led_backend == 'recording':
+    return RecordingDots(LED_COUNT)
+  # Only imported for the hardware as board fails to import on other machines.
+  # pylint: disable=import-outside-toplevel
+  import adafruit_dotstar
+  import board
+  return adafruit_dotstar.DotStar(board.SCK, board.MOSI, LED_COUNT,
+                                  brightness=FLAGS.led_brightness,
+                                  auto_write=False)
 
 
 class LEDs(object):
-  """Interface for controlling the changing of the LED colors."""
+  """Interface for controlling the changing of the LED colors.
+
+  Writing to the LEDs over SPI can take milliseconds so frames are handed off
+  to a writer thread and the main loop never blocks on the hardware.  Only the
+  latest frame is written, frames which are already showing are skipped and
+  otherwise only the pixels which changed are updated.
+  """
 
   def __init__(self):
     self.led_update_interval = FLAGS.led_update_interval
-    self.last_led_update = time.time()
-    self.dots = adafruit_dotstar.DotStar(board.SCK, board.MOSI, 10,
-                                         brightness=FLAGS.led_brightness)
+    self.clock = time.time  # Replaced by the GPS time when replaying.
+    self.last_led_update = self.clock()
+    self.dots = CreateDots()
+    self.bar_frames = BuildBarFrames(LED_COUNT)
+    self.frame_condition = threading.Condition()
+    self.pending_frame = None
+    self.written_frame = None
+    self.writing = False
+    self.stop_writer = False
+    self.writer = threading.Thread(target=self._WriteFrames,
+                                   name='LEDWriter', daemon=True)
+    self.writer.start()
     self.Fill((255, 0, 255), ignore_update_interval=True)  # Magenta
-    self.tree = None
-    self.speed_deltas = collections.deque(maxlen=FLAGS.speed_deltas)
+    self.cursor = None
+    self.projection = None
+    if FLAGS.speed_delta_smoothing == 'ema':
+      self.speed_deltas = smoothing_lib.ExponentialMovingAverage(
+          FLAGS.speed_deltas)
+    else:
+      self.speed_deltas = smoothing_lib.RollingMedian(FLAGS.speed_deltas)
     self.best_lap = None
     self.best_lap_duration_ns = None
 
   def LedInterval(self,
                   additional_delay: float = 0) -> bool:
     """Returns True if it is safe to update the LEDs based on interval."""
-    now = time.time()
+    now = self.clock()
     if now - self.last_led_update > self.led_update_interval:
       self.last_led_update = now + additional_delay
       return True
     return False
 
   def Fill(self,
-           color: Tuple[int, int, int],
+           color: Color,
            additional_delay: float = 0.0,
            ignore_update_interval: bool = False) -> None:
     """Sets all of the LEDs to the specified color.
@@ -78,24 +191,99 @@ class LEDs(object):
                         to blue for a full second.
       ignore_update_interval: If True skips the update interval check.
     """
-    update = self.LedInterval(additional_delay)
-    if ignore_update_interval or update:
-      self.dots.fill(color)
+    self.ShowFrame((color,) * LED_COUNT,
+                   additional_delay=additional_delay,
+                   ignore_update_interval=ignore_update_interval)
+
+  def ShowFrame(self,
+                frame: Frame,
+                additional_delay: float = 0.0,
+                ignore_update_interval: bool = False) -> None:
+    """Sets each LED to the color at the same index of the frame.
+
+    See Fill for the arguments.
+    """
+    if ignore_update_interval:
+      # Always hold the frame for the additional delay, even if the LEDs were
+      # updated within the interval.
+      self.last_led_update = self.clock() + additional_delay
+    elif not self.LedInterval(additional_delay):
+      return
+    with self.frame_condition:
+      self.pending_frame = frame
+      self.frame_condition.notify_all()
+
+  def _WriteFrame(self, frame: Frame) -> None:
+    if len(set(frame)) == 1:
+      self.dots.fill(frame[0])
+    else:
+      for index, color in enumerate(frame):
+        if not self.written_frame or self.written_frame[index] != color:
+          self.dots[index] = color
+    self.dots.show()
+    self.written_frame = frame
+
+  def _WriteFrames(self) -> None:
+    """Writes the latest pending frame to the LEDs until stopped."""
+    while True:
+      with self.frame_condition:
+        self.frame_condition.wait_for(
+            lambda: self.pending_frame is not None or self.stop_writer)
+        if self.stop_writer:
+          return
+        frame = self.pending_frame
+        self.pending_frame = None
+        self.writing = True
+      try:
+        if frame != self.written_frame:
+          self._WriteFrame(frame)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Unable to update the LEDs')
+      finally:
+        with self.frame_condition:
+          self.writing = False
+          self.frame_condition.notify_all()
+
+  def Flush(self, timeout: Optional[float] = None) -> bool:
+    """Waits until the pending frame has been written to the LEDs."""
+    with self.frame_condition:
+      return self.frame_condition.wait_for(
+          lambda: self.pending_frame is None and not self.writing, timeout)
+
+  def Stop(self) -> None:
+    """Stops the writer thread, pending frames are dropped."""
+    with self.frame_condition:
+      self.stop_writer = True
+      self.frame_condition.notify_all()
+    self.writer.join()
 
   def FindNearestBestLapPoint(self,
 															point: exit_speed_pb2.Gps) -> exit_speed_pb2.Gps:
     """Returns the nearest point on the best lap to the given point."""
-    neighbors = self.tree.query([[point.lat, point.lon]], k=1,
-                                return_distance=False)
-    index = neighbors[0][0]
+    index = self.cursor.FindNearest(*self.projection.PointToXY(point))
     return self.best_lap[index]
 
-  def GetLedColor(self) -> Tuple[int, int, int]:
+  def GetLedColor(self) -> Color:
     median_delta = self.GetMovingSpeedDelta()
     if median_delta > 0:
       return (255, 0, 0)  # Red
     return (0, 255, 0)  # Green
 
+  def GetTimeDeltaColor(self, time_delta: float) -> Color:
+    if time_delta > 0:
+      return (255, 0, 0)  # Red
+    return (0, 255, 0)  # Green
+
+  def GetBarFrame(self, delta: float, full_scale: float) -> Frame:
+    """Returns the bar frame for the delta, positive is behind the best lap.
+
+    Args:
+      delta: Speed or time delta to the best lap.
+      full_scale: Delta at or beyond which all of the LEDs are lit.
+    """
+    level = round(min(max(delta / full_scale, -1), 1) * LED_COUNT)
+    return self.bar_frames[level + LED_COUNT]
+
   def GetMovingSpeedDelta(self) -> float:
     """Returns the median speed delta over a time period based on the ring size.
 
@@ -104,50 +292,93 @@ class LEDs(object):
     buffer can be, IE the number of deltas to hold on to.  At a GPS singal of
     10hz a ring size of 10 will cover a second worth of time.
     """
-    return statistics.median(self.speed_deltas)
+    return self.speed_deltas.Value()
 
   def UpdateSpeedDeltas(self,
                         point: exit_speed_pb2.Gps,
                         best_point: exit_speed_pb2.Gps) -> float:
     speed_delta = best_point.speed_ms - point.speed_ms
-    self.speed_deltas.append(speed_delta)
-    return statistics.median(self.speed_deltas)
+    return self.speed_deltas.Update(speed_delta)
+
+  def UpdateLeds(self,
+                 point: exit_speed_pb2.Gps,
+                 time_delta: Optional[float] = None) -> None:
+    """Update LEDs based on speed or time difference to the best lap.
 
-  def UpdateLeds(self, point: exit_speed_pb2.Gps) -> None:
-    """Update LEDs based on speed difference to the best lap."""
-    if self.tree:
+    Args:
+      point: The latest GPS point.
+      time_delta: Seconds the current lap is behind the best lap, see
+                  lap_delta.LapDelta.  Used if --led_delta_source=time.
+    """
+    if FLAGS.led_delta_source == 'time':
+      if time_delta is None:
+        return
+      if FLAGS.led_display_mode == 'bar':
+        self.ShowFrame(self.GetBarFrame(time_delta, FLAGS.led_bar_time_range))
+      else:
+        self.Fill(self.GetTimeDeltaColor(time_delta))
+      return
+    if self.cursor:
       best_point = self.FindNearestBestLapPoint(point)
-      self.UpdateSpeedDeltas(point, best_point)
-      led_color = self.GetLedColor()
-      self.Fill(led_color)
+      median_delta = self.UpdateSpeedDeltas(point, best_point)
+      if FLAGS.led_display_mode == 'bar':
+        self.ShowFrame(
+            self.GetBarFrame(median_delta, FLAGS.led_bar_speed_range))
+      else:
+        self.Fill(self.GetLedColor())
 
   def SetBestLap(self,
 								 lap: List[exit_speed_pb2.Gps],
 								 duration_ns: float) -> None:
-    """Sets best lap and builds a KDTree for finding closest points."""
+    """Sets best lap and builds a cursor for finding closest points.
+
+    Points are projected to x/y meters so the cursor's KD tree uses the native
+    euclidean distance instead of calling back into Python for every
+    comparison.
+    """
     if not self.best_lap or duration_ns < self.best_lap_duration_ns:
+      self.SetReference(reference_lap.Build(lap, duration_ns))
+
+  def SetReference(self, reference: reference_lap.ReferenceLap) -> None:
+    """Uses the precomputed lap if it is the fastest so far."""
+    if not self.best_lap or reference.duration_ns < self.best_lap_duration_ns:
+      duration_ns = reference.duration_ns
       minutes = duration_ns / 1e9 // 60
       seconds = (duration_ns / 1e6 % 60000) / 1000.0
       logging.info('New Best Lap %d:%.03f', minutes, seconds)
-      self.best_lap = lap
+      self.best_lap = reference.lap
       self.best_lap_duration_ns = duration_ns
-      x_y_points = []
-      for point in lap:
-        x_y_points.append([point.lat, point.lon])
-      self.tree = BallTree(np.array(x_y_points), leaf_size=30,
-                           metric='pyfunc', func=EarthDistanceSmall)
+      self.projection = reference.projection
+      self.cursor = track_cursor.TrackCursor(reference.x, reference.y,
+                                             reference.tree)
 
   def CrossStartFinish(self) -> None:
+    if self.cursor:
+      self.cursor.Reset()
     self.Fill((0, 0, 255),  # Blue
               additional_delay=1,
               ignore_update_interval=True)
 
+  def CrossSector(self, best_delta_ns: Optional[int]) -> None:
+    """Briefly shows if the sector was faster than the best sector."""
+    if best_delta_ns is None:
+      return
+    if best_delta_ns < 0:
+      color = (0, 255, 0)  # Green
+    else:
+      color = (255, 0, 0)  # Red
+    self.Fill(color, additional_delay=0.5, ignore_update_interval=True)
+
 def main(unused_argv):
   leds = LEDs()
   magenta = (255, 0, 255)
   blue = (0, 0, 255)
   red = (255, 0, 0)
   green = (0, 255, 0)
+  while FLAGS.led_display_mode == 'bar':
+    for frame in leds.bar_frames:
+      leds.ShowFrame(frame, ignore_update_interval=True)
+      time.sleep(0.2)
   while True:
     for color in (magenta, blue, red, green):
       leds.Fill(color, ignore_update_interval=True)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks building and querying the best lap index used by the LEDs.
+
+A recorded session is split into laps.  For each lap the index is built as if
+it were the new best lap and every point of the following lap is looked up in
+it, mirroring leds.LEDs.SetBestLap and FindNearestBestLapPoint.  The LEDs use
+the cursor, kdtree is its global search on its own.
+
+  python3 -m exit_speed.leds_benchmark --benchmark_data=<GPSProcess data>
+"""
+import os
+import statistics
+import time
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+import gps
+import numpy as np
+from absl import app
+from absl import flags
+
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import lap_lib
+from exit_speed import reference_lap
+from exit_speed import track_cursor
+from exit_speed import tracks
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'benchmark_data',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'testdata/Corrado/Portland International Raceway/2020-06-20/'
+                 'GPSProcess_1.data'),
+    'GPSProcess data file of a session to replay.')
+flags.DEFINE_bool('benchmark_pyfunc', True,
+                  'Also benchmark the prior sklearn BallTree with a Python '
+                  'distance function for comparison.  Slow.')
+
+Index = Callable[[exit_speed_pb2.Gps], int]
+
+
+def BuildCursor(lap: List[exit_speed_pb2.Gps]) -> Index:
+  """Same as leds.LEDs.SetBestLap, returns a nearest point lookup."""
+  reference = reference_lap.Build(lap, 0)
+  cursor = track_cursor.TrackCursor(reference.x, reference.y, reference.tree)
+
+  def Query(point: exit_speed_pb2.Gps) -> int:
+    return cursor.FindNearest(*reference.projection.PointToXY(point))
+  return Query
+
+
+def BuildKDTree(lap: List[exit_speed_pb2.Gps]) -> Index:
+  """Searches the whole lap on every lookup."""
+  reference = reference_lap.Build(lap, 0)
+
+  def Query(point: exit_speed_pb2.Gps) -> int:
+    _, index = reference.tree.query(reference.projection.PointToXY(point))
+    return index
+  return Query
+
+
+def BuildPyfuncBallTree(lap: List[exit_speed_pb2.Gps]) -> Index:
+  """The prior index which called back into Python for every distance."""
+  # pylint: disable=import-outside-toplevel
+  from sklearn.neighbors import BallTree
+  tree = BallTree(np.array([(point.lat, point.lon) for point in lap]),
+                  leaf_size=30, metric='pyfunc', func=gps.EarthDistanceSmall)
+
+  def Query(point: exit_speed_pb2.Gps) -> int:
+    neighbors = tree.query([[point.lat, point.lon]], k=1,
+                           return_distance=False)
+    return neighbors[0][0]
+  return Query
+
+
+def GetLaps() -> List[List[exit_speed_pb2.Gps]]:
+  logger = data_logger.Logger(FLAGS.benchmark_data,
+                              proto_class=exit_speed_pb2.Gps)
+  points = list(logger.ReadProtos())
+  track = tracks.FindClosestTrack({'lat': points[0].lat,
+                                   'lon': points[0].lon})
+  crossings, _ = lap_lib.SplitLaps(track, *lap_lib.GpsArrays(points))
+  return [points[start:end + 1]
+          for start, end in zip(crossings[:-1], crossings[1:])]
+
+
+def Benchmark(
+    build: Callable[[List[exit_speed_pb2.Gps]], Index],
+    laps: List[List[exit_speed_pb2.Gps]]) -> Tuple[List[float], List[float],
+                                                    List[int]]:
+  """Returns build seconds per lap, query seconds per point and matches."""
+  build_times = []
+  query_times = []
+  matches = []
+  for best_lap, lap in zip(laps[:-1], laps[1:]):
+    start = time.perf_counter()
+    query = build(best_lap)
+    build_times.append(time.perf_counter() - start)
+    for point in lap:
+      start = time.perf_counter()
+      matches.append(query(point))
+      query_times.append(time.perf_counter() - start)
+  return build_times, query_times, matches
+
+
+def main(unused_argv):
+  laps = GetLaps()
+  print('%d laps, %d points' % (len(laps), sum(len(lap) for lap in laps)))
+  builders = [('cursor', BuildCursor), ('kdtree', BuildKDTree)]
+  if FLAGS.benchmark_pyfunc:
+    builders.append(('balltree_pyfunc', BuildPyfuncBallTree))
+  print('%-16s %12s %12s %12s %12s %12s' % (
+      'index', 'build ms', 'build max', 'query us', 'query p99', 'query max'))
+  results = {}
+  for name, build in builders:
+    build_times, query_times, matches = Benchmark(build, laps)
+    results[name] = matches
+    print('%-16s %12.3f %12.3f %12.1f %12.1f %12.1f' % (
+        name,
+        statistics.median(build_times) * 1e3,
+        max(build_times) * 1e3,
+        statistics.median(query_times) * 1e6,
+        np.percentile(query_times, 99) * 1e6,
+        max(query_times) * 1e6))
+  kdtree = np.array(results['kdtree'])
+  for name, matches in results.items():
+    if name != 'kdtree':
+      print('%s matches kdtree for %.2f%% of queries' %
+            (name, np.mean(kdtree == np.array(matches)) * 100))
+
+
+if __name__ == '__main__':
+  app.run(main)
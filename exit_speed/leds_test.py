@@ -15,6 +15,7 @@
 """Unittests for leds_test.py"""
 import collections
 import sys
+import threading
 import time
 import unittest
 
@@ -22,6 +23,7 @@ import fake_rpi
 import mock
 from absl import flags
 from absl.testing import absltest
+from absl.testing import flagsaver
 
 from exit_speed import exit_speed_pb2
 sys.modules['RPi'] = fake_rpi.RPi     # Fake RPi
@@ -33,6 +35,7 @@ import adafruit_platformdetect
 with mock.patch.object(adafruit_platformdetect, 'Detector') as mock_detector:
   mock_detector.chip.id.return_value = 'BCM2XXX'
   import adafruit_dotstar
+  import board  # pylint: disable=unused-import
   from exit_speed import leds
 # pylint: enable=wrong-import-position
 
@@ -48,11 +51,16 @@ class TestLEDs(unittest.TestCase):
     with mock.patch.object(adafruit_dotstar, 'DotStar') as mock_inst:
       mock_inst.return_value = mock_star
       self.leds = leds.LEDs()
+    self.leds.Flush()
     self.leds.last_led_update = time.time() - self.leds.led_update_interval
     self.mock_dots = mock.create_autospec(adafruit_dotstar.DotStar,
                                           spec_set=True)
     self.leds.dots = self.mock_dots
 
+  def tearDown(self):
+    super().tearDown()
+    self.leds.Stop()
+
   def testLedInterval(self):
     self.assertTrue(self.leds.LedInterval())
     self.assertFalse(self.leds.LedInterval())
@@ -63,41 +71,147 @@ class TestLEDs(unittest.TestCase):
   def testFill(self):
     color = (255, 255, 255)
     self.leds.Fill(color)
+    self.leds.Flush()
     self.mock_dots.fill.assert_called_once_with(color)
     self.mock_dots.fill.reset_mock()
 
+    color = (0, 0, 255)
     self.leds.Fill(color, ignore_update_interval=True)
+    self.leds.Flush()
     self.mock_dots.fill.assert_called_once_with(color)
     self.mock_dots.fill.reset_mock()
 
+    color = (255, 0, 0)
     self.leds.Fill(color, additional_delay=10, ignore_update_interval=True)
+    self.leds.Flush()
     self.assertGreater(time.time() + 5, self.leds.led_update_interval)
     self.mock_dots.fill.assert_called_once_with(color)
 
+  def testFillAdditionalDelay(self):
+    red = (255, 0, 0)
+    blue = (0, 0, 255)
+    self.leds.Fill(red)
+    # Within the update interval of the red fill.
+    self.leds.Fill(blue, additional_delay=1, ignore_update_interval=True)
+    self.assertGreater(self.leds.last_led_update, time.time() + 0.5)
+    self.leds.Fill(red)
+    self.leds.Flush()
+    self.assertEqual(blue, self.leds.written_frame[0])
+
+  def testRecordingDots(self):
+    with flagsaver.flagsaver(led_backend='recording'):
+      dots = leds.CreateDots()
+    self.assertIsInstance(dots, leds.RecordingDots)
+    dots.clock = lambda: 1.5
+    red = (255, 0, 0)
+    green = (0, 255, 0)
+    dots.fill(red)
+    dots[1] = green
+    self.assertEqual(green, dots[1])
+    self.assertEqual([], dots.frames)
+    dots.show()
+    self.assertEqual([(1.5, (red, green) + (red,) * 8)], dots.frames)
+
+  def testFillSameColor(self):
+    color = (255, 255, 255)
+    self.leds.Fill(color, ignore_update_interval=True)
+    self.leds.Flush()
+    self.leds.Fill(color, ignore_update_interval=True)
+    self.leds.Flush()
+    self.mock_dots.fill.assert_called_once_with(color)
+
+  def testFillLatestColor(self):
+    writing = threading.Event()
+    release = threading.Event()
+    def SlowFill(unused_color):
+      writing.set()
+      release.wait(5)
+    self.mock_dots.fill.side_effect = SlowFill
+    red = (255, 0, 0)
+    green = (0, 255, 0)
+    blue = (0, 0, 255)
+    self.leds.Fill(red, ignore_update_interval=True)
+    self.assertTrue(writing.wait(5))
+    # Fill returns while the LEDs are busy and only the latest color is kept.
+    self.leds.Fill(green, ignore_update_interval=True)
+    self.leds.Fill(blue, ignore_update_interval=True)
+    release.set()
+    self.assertTrue(self.leds.Flush(5))
+    self.assertEqual([mock.call(red), mock.call(blue)],
+                     self.mock_dots.fill.mock_calls)
+
+  def testShowFrame(self):
+    red = (255, 0, 0)
+    green = (0, 255, 0)
+    self.leds.Fill(red, ignore_update_interval=True)
+    self.leds.Flush()
+    self.mock_dots.reset_mock()
+    frame = (green, green) + (red,) * 8
+    self.leds.ShowFrame(frame, ignore_update_interval=True)
+    self.leds.Flush()
+    # Only the changed pixels are set.
+    self.assertEqual([mock.call.__setitem__(0, green),
+                      mock.call.__setitem__(1, green),
+                      mock.call.show()],
+                     self.mock_dots.mock_calls)
+    self.assertEqual(frame, self.leds.written_frame)
+
+  def testBuildBarFrames(self):
+    frames = leds.BuildBarFrames(3)
+    off = (0, 0, 0)
+    self.assertEqual(7, len(frames))
+    self.assertEqual(((160, 255, 0), (80, 255, 0), (0, 255, 0)), frames[0])
+    self.assertEqual(((160, 255, 0), off, off), frames[2])
+    self.assertEqual((off, off, off), frames[3])
+    self.assertEqual(((255, 160, 0), off, off), frames[4])
+    self.assertEqual(((255, 160, 0), (255, 80, 0), (255, 0, 0)), frames[6])
+
+  def testGetBarFrame(self):
+    off = (0, 0, 0)
+    self.assertEqual((off,) * 10, self.leds.GetBarFrame(0, 5))
+    frame = self.leds.GetBarFrame(2, 5)
+    self.assertEqual(4, len([color for color in frame if color != off]))
+    self.assertEqual((255, 160, 0), frame[0])
+    self.assertEqual(self.leds.GetBarFrame(5, 5), self.leds.GetBarFrame(50, 5))
+    frame = self.leds.GetBarFrame(-50, 5)
+    self.assertEqual((0, 255, 0), frame[-1])
+
   def testFindNearestBestLapPoint(self):
     lap = []
     lap.append(exit_speed_pb2.Gps(lat=1, lon=1))
     lap.append(exit_speed_pb2.Gps(lat=5, lon=5))
     lap.append(exit_speed_pb2.Gps(lat=20, lon=20))
 
-    self.leds.SetBestLap(lap, 90 * 1e9)  # Build the tree.
+    self.leds.SetBestLap(lap, 90 * 1e9)  # Build the cursor.
     point = exit_speed_pb2.Gps(lat=4, lon=4)
     nearest = self.leds.FindNearestBestLapPoint(point)
     self.assertEqual(nearest.lat, 5)
     self.assertEqual(nearest.lon, 5)
 
+  def _AddSpeedDeltas(self, speed_deltas):
+    for speed_delta in speed_deltas:
+      self.leds.speed_deltas.Update(speed_delta)
+
   def testGetLedColor(self):
-    self.leds.speed_deltas.extend([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+    self._AddSpeedDeltas([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
     self.assertTupleEqual(self.leds.GetLedColor(), (255, 0, 0))
-    self.leds.speed_deltas.extend([0, -1, -2, -3, -4, -5, -6, -7, -8, -9])
+    self._AddSpeedDeltas([0, -1, -2, -3, -4, -5, -6, -7, -8, -9])
     self.assertTupleEqual(self.leds.GetLedColor(), (0, 255, 0))
-    self.leds.speed_deltas.extend([0, 1, 2, 3, 4, -5, -6, -7, -8, -9])
+    self._AddSpeedDeltas([0, 1, 2, 3, 4, -5, -6, -7, -8, -9])
     self.assertTupleEqual(self.leds.GetLedColor(), (0, 255, 0))
 
   def testGetMovingSpeedDelta(self):
-    self.leds.speed_deltas = [-100, 5, 100]
+    self._AddSpeedDeltas([-100, 5, 100])
     self.assertEqual(5, self.leds.GetMovingSpeedDelta())
 
+  @flagsaver.flagsaver(speed_delta_smoothing='ema', speed_deltas=3)
+  def testGetMovingSpeedDeltaEma(self):
+    self.leds.Stop()
+    with mock.patch.object(adafruit_dotstar, 'DotStar'):
+      self.leds = leds.LEDs()
+    self._AddSpeedDeltas([0, 4])
+    self.assertEqual(2, self.leds.GetMovingSpeedDelta())
+
   def testUpdateSpeedDeltas(self):
     point = exit_speed_pb2.Gps()
     point.speed_ms = 88  # m/s
@@ -106,7 +220,7 @@ class TestLEDs(unittest.TestCase):
     self.leds.UpdateSpeedDeltas(point, best_point)
     deltas = collections.deque(maxlen=FLAGS.speed_deltas)
     deltas.append(-1.0)
-    self.assertSequenceEqual(deltas, self.leds.speed_deltas)
+    self.assertSequenceEqual(deltas, self.leds.speed_deltas.values)
 
   @mock.patch.object(leds.LEDs, 'Fill')
   def testUpdateLeds(self, mock_fill):
@@ -114,27 +228,49 @@ class TestLEDs(unittest.TestCase):
     point = exit_speed_pb2.Gps(speed_ms=88)
     lap.append(point)
     self.leds.UpdateLeds(point)
-    self.assertFalse(mock_fill.mock_calls)  # No BallTree yet.
+    self.assertFalse(mock_fill.mock_calls)  # No best lap yet.
 
-    self.leds.SetBestLap(lap, 90 * 1e9)  # Used to build the BallTree.
+    self.leds.SetBestLap(lap, 90 * 1e9)  # Used to build the cursor.
     self.leds.UpdateLeds(point)
     color = (0, 255, 0)  # Green
     mock_fill.assert_called_once_with(color)
     deltas = collections.deque(maxlen=FLAGS.speed_deltas)
     deltas.append(0.0)
-    self.assertSequenceEqual(deltas, self.leds.speed_deltas)
+    self.assertSequenceEqual(deltas, self.leds.speed_deltas.values)
+
+  @flagsaver.flagsaver(led_delta_source='time')
+  @mock.patch.object(leds.LEDs, 'Fill')
+  def testUpdateLedsTimeDelta(self, mock_fill):
+    point = exit_speed_pb2.Gps(speed_ms=88)
+    self.leds.UpdateLeds(point)
+    self.assertFalse(mock_fill.mock_calls)  # No best lap yet.
+    self.leds.UpdateLeds(point, 0.5)
+    mock_fill.assert_called_once_with((255, 0, 0))  # Red
+    self.leds.UpdateLeds(point, -0.5)
+    mock_fill.assert_called_with((0, 255, 0))  # Green
+
+  @flagsaver.flagsaver(led_display_mode='bar')
+  @mock.patch.object(leds.LEDs, 'ShowFrame')
+  def testUpdateLedsBar(self, mock_show_frame):
+    point = exit_speed_pb2.Gps(speed_ms=88)
+    self.leds.SetBestLap([exit_speed_pb2.Gps(speed_ms=90)], 90 * 1e9)
+    self.leds.UpdateLeds(point)
+    mock_show_frame.assert_called_once_with(self.leds.GetBarFrame(2, 5))
+    with flagsaver.flagsaver(led_delta_source='time'):
+      self.leds.UpdateLeds(point, -0.5)
+    mock_show_frame.assert_called_with(self.leds.GetBarFrame(-0.5, 1))
 
   def testSetBestLap(self):
     lap = []
     lap.append(exit_speed_pb2.Gps(speed_ms=88))
 
     self.leds.SetBestLap(lap, 100 * 1e9)
-    first_tree = self.leds.tree
+    first_cursor = self.leds.cursor
 
     lap = []
     lap.append(exit_speed_pb2.Gps(speed_ms=88))
     self.leds.SetBestLap(lap, 99 * 1e9)
-    self.assertNotEqual(first_tree, self.leds.tree)
+    self.assertNotEqual(first_cursor, self.leds.cursor)
 
   @mock.patch.object(leds.LEDs, 'Fill')
   def testCrossStartFinish(self, mock_fill):
@@ -144,6 +280,16 @@ class TestLEDs(unittest.TestCase):
                                       additional_delay=1,
                                       ignore_update_interval=True)
 
+  @mock.patch.object(leds.LEDs, 'Fill')
+  def testCrossSector(self, mock_fill):
+    self.leds.CrossSector(None)  # No best sector yet.
+    self.assertFalse(mock_fill.mock_calls)
+    self.leds.CrossSector(-1)
+    green = (0, 255, 0)
+    mock_fill.assert_called_once_with(green,
+                                      additional_delay=0.5,
+                                      ignore_update_interval=True)
+
 
 if __name__ == '__main__':
   absltest.main()
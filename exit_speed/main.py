@@ -14,26 +14,58 @@
 # limitations under the License.
 """The main script for starting exit speed."""
 import datetime
+import importlib
 import multiprocessing
+import time
+from typing import List
+from typing import Optional
 
 import pytz
 import sdnotify
 from absl import app
+from absl import flags
 from absl import logging
 
-from exit_speed import accelerometer
+from exit_speed import checkpoint
 from exit_speed import common_lib
 from exit_speed import config_lib
 from exit_speed import exit_speed_pb2
 from exit_speed import gps_sensor
-from exit_speed import gyroscope
-from exit_speed import labjack
+from exit_speed import lap_delta
 from exit_speed import lap_lib
 from exit_speed import leds
 from exit_speed import postgres
-from exit_speed import tire_temperature
+from exit_speed import reference_lap
+from exit_speed import sectors
 from exit_speed import tracks
-from exit_speed import wbo2
+
+FLAGS = flags.FLAGS
+flags.DEFINE_enum('start_method', 'forkserver',
+                  ['fork', 'forkserver', 'spawn'],
+                  'Multiprocessing start method for the sensor processes.  '
+                  'forkserver avoids each sensor process inheriting the main '
+                  'process\'s imports such as scipy when started with '
+                  'python3 -m exit_speed.run.')
+
+# (config key, ExitSpeed attribute, module, subprocess class)
+# Modules are only imported if the sensor is configured which avoids loading
+# hardware libraries for sensors the car does not have.
+SUBPROCESSES = (
+    ('accelerometer', 'accel', 'exit_speed.accelerometer',
+     'AccelerometerProcess'),
+    ('gps', 'gps', 'exit_speed.gps_sensor', 'GPSProcess'),
+    ('gyroscope', 'gyro', 'exit_speed.gyroscope', 'GyroscopeProcess'),
+    ('imu', 'imu', 'exit_speed.imu', 'IMUProcess'),
+    ('labjack', 'labjack', 'exit_speed.labjack', 'Labjack'),
+    ('tire_temps', 'tire_temps', 'exit_speed.tire_temperature',
+     'TireSensorServer'),
+    ('wbo2', 'wbo2', 'exit_speed.wbo2', 'WBO2'),
+)
+# Preloaded by the forkserver as every sensor process needs them.
+FORKSERVER_PRELOAD = ['exit_speed.sensor']
+# Laps shorter than this fraction of the best lap's duration or points are
+# assumed to be missing part of the lap such as a dropped GPS fix.
+MIN_BEST_LAP_FRACTION = 0.5
 
 
 class ExitSpeed(object):
@@ -60,38 +92,61 @@ class ExitSpeed(object):
 
     self.config = config_lib.LoadConfig()
     self.leds = leds.LEDs()
+    self.lap_delta = lap_delta.LapDelta()
     self.postgres = None
     self.session = None
     self.lap_number = 1
+    # Lap 1 starts in the pits and the lap a session resumes on is missing the
+    # points from while it was down.
+    self.first_full_lap = 2
     self.current_lap = []
     self.laps = {self.lap_number: self.current_lap}
     self.point = None
+    self.sector_timer = None
+    self.sensors = []
+    self.last_checkpoint = time.time()
+    self.startup_timings = {}
     self.sdnotify = sdnotify.SystemdNotifier()
     self.sdnotify.notify('READY=1')
 
   def InitializeSubProcesses(self):
-    """Initialize subprocess modules based on config.yaml."""
+    """Initialize subprocess modules based on config.yaml.
+
+    Sensor processes are started before waiting on a GPS fix to locate the
+    track.  Each initializes its hardware and connects to Postgres in its own
+    process so they come up in parallel, only importing and starting them is
+    sequential.  Until the session is known each sensor buffers the messages
+    it logs and exports to Postgres immediately.
+    """
+    start = time.time()
     if self.config.get('postgres'):
       self.postgres = postgres.PostgresWithoutPrepare()
-    self.ProcessSession()
-    if self.config.get('accelerometer'):
-      self.accel = accelerometer.AccelerometerProcess(
-          self.session, self.config, self.point_queue)
-    if self.config.get('gps'):
-      self.gps = gps_sensor.GPSProcess(
-          self.session, self.config, self.point_queue)
-    if self.config.get('gyroscope'):
-      self.gyro = gyroscope.GyroscopeProcess(
-          self.session, self.config, self.point_queue)
-    if self.config.get('labjack'):
-      self.labjack = labjack.Labjack(
-          self.session, self.config, self.point_queue)
-    if self.config.get('tire_temps'):
-      self.tire_temps = tire_temperature.MultiTireInterface(
-          self.session, self.config, self.point_queue)
-    if self.config.get('wbo2'):
-      self.wbo2 = wbo2.WBO2(
-          self.session, self.config, self.point_queue)
+    self.startup_timings['postgres'] = time.time() - start
+    start = time.time()
+    resumed = self.ResumeSession()
+    self.startup_timings['resume'] = time.time() - start
+    self.sensors = []
+    for config_key, attr_name, module_name, class_name in SUBPROCESSES:
+      if self.config.get(config_key):
+        start = time.time()
+        process_class = getattr(importlib.import_module(module_name),
+                                class_name)
+        sensor_instance = process_class(
+            self.session, self.config, self.point_queue)
+        setattr(self, attr_name, sensor_instance)
+        self.sensors.append(sensor_instance)
+        self.startup_timings[config_key] = time.time() - start
+    if not resumed:
+      start = time.time()
+      self.ProcessSession()
+      for sensor_instance in self.sensors:
+        sensor_instance.SetSession(self.session)
+      self.startup_timings['session'] = time.time() - start
+    start = time.time()
+    self.LoadReferenceLap()
+    self.startup_timings['reference_lap'] = time.time() - start
+    logging.info('Startup timings: %s', ', '.join(
+        '%s %.3fs' % timing for timing in self.startup_timings.items()))
 
   def AddNewLap(self) -> None:
     """Adds a new lap to the current session."""
@@ -107,12 +162,25 @@ class ExitSpeed(object):
   def ProcessPoint(self) -> None:
     """Updates LEDs, logs point and writes data to PostgresSQL."""
     point = self.point
-    self.leds.UpdateLeds(point)
+    time_delta = None
+    if FLAGS.led_delta_source == 'time':
+      time_delta = self.lap_delta.Update(point)
+    self.leds.UpdateLeds(point, time_delta)
+
+  def SetLapTime(self, crossing_ns: Optional[float] = None) -> None:
+    """Sets the lap duration based on the first and last point time delta.
 
-  def SetLapTime(self) -> None:
-    """Sets the lap duration based on the first and last point time delta."""
-    duration_ns = lap_lib.CalcLastLapDuration(self.session.track, self.laps)
-    self.leds.SetBestLap(self.current_lap, duration_ns)
+    Args:
+      crossing_ns: When the car crossed the start/finish gate, if the track
+                   has one.
+    """
+    if crossing_ns is None:
+      duration_ns = lap_lib.CalcLastLapDuration(self.session.track, self.laps)
+    else:
+      duration_ns = lap_lib.CalcGateLapDuration(
+          self.session.track.start_finish_gate, self.current_lap, crossing_ns)
+    if self.IsFullLap(self.current_lap, duration_ns):
+      self.SetBestLap(self.current_lap, duration_ns)
     minutes = duration_ns / 1e9 // 60
     seconds = (duration_ns / 1e6 % 60000) / 1000.0
     logging.info('New Lap %d:%.03f', minutes, seconds)
@@ -121,6 +189,53 @@ class ExitSpeed(object):
           end_time=self.point.time.ToDatetime(tzinfo=pytz.UTC),
           duration_ns=int(duration_ns)))
 
+  def IsFullLap(self,
+                lap: List[exit_speed_pb2.Gps],
+                duration_ns: float) -> bool:
+    """Returns True if the lap started and ended at the start/finish."""
+    if self.lap_number < self.first_full_lap:
+      logging.info('Lap %d did not start at the start/finish',
+                   self.lap_number)
+      return False
+    if len(lap) < self.min_points_per_lap:
+      logging.info('Lap %d only has %d points', self.lap_number, len(lap))
+      return False
+    best_lap = self.leds.best_lap
+    if best_lap and (
+        duration_ns < self.leds.best_lap_duration_ns * MIN_BEST_LAP_FRACTION or
+        len(lap) < len(best_lap) * MIN_BEST_LAP_FRACTION):
+      logging.info('Lap %d is too short to be a full lap: %d points %.3fs',
+                   self.lap_number, len(lap), duration_ns / 1e9)
+      return False
+    return True
+
+  def SetReference(self, reference: reference_lap.ReferenceLap) -> None:
+    """Compares the LEDs and lap delta against the reference if faster."""
+    self.leds.SetReference(reference)
+    self.lap_delta.SetReference(reference)
+
+  def SetBestLap(self,
+                 lap: List[exit_speed_pb2.Gps],
+                 duration_ns: float) -> None:
+    """Saves the lap as the reference if it's the fastest of the track."""
+    best_lap_duration_ns = self.leds.best_lap_duration_ns
+    if best_lap_duration_ns and duration_ns >= best_lap_duration_ns:
+      return
+    reference = reference_lap.Build(lap, duration_ns,
+                                    track=self.session.track.name,
+                                    car=self.session.car)
+    self.SetReference(reference)
+    if self.live_data:
+      reference_lap.Save(reference)
+
+  def LoadReferenceLap(self) -> None:
+    """Loads the fastest lap of prior sessions at this track."""
+    reference = reference_lap.Load(self.session.track.name, self.session.car)
+    if reference:
+      logging.info('Loaded reference lap of %.3fs',
+                   reference.duration_ns / 1e9)
+      self.SetReference(reference)
+
   def CrossStartFinish(self) -> None:
     """Checks and handles when the car crosses the start/finish."""
     logging.log_every_n_seconds(
@@ -129,25 +244,119 @@ class ExitSpeed(object):
         10,
         len(self.current_lap))
     if len(self.current_lap) >= self.min_points_per_lap:
-      prior_point = lap_lib.GetPriorUniquePoint(self.current_lap, self.point)
-      start_finish_distance = common_lib.PointDeltaFromTrack(
-          self.session.track, self.point)
-      if (start_finish_distance < self.start_finish_range and
-          # First point past start/finish has an obtuse angle.
-          lap_lib.SolvePointBAngle(
-              self.session.track, prior_point, self.point) > 90):
+      gate = self.session.track.start_finish_gate
+      crossing_ns = None
+      if gate:
+        prior_point = self.current_lap[-1]
+        crossing_ns = lap_lib.CalcGateCrossingTime(gate, prior_point,
+                                                   self.point)
+        crossed = crossing_ns is not None
+      else:
+        prior_point = lap_lib.GetPriorUniquePoint(self.current_lap, self.point)
+        start_finish_distance = common_lib.PointDeltaFromTrack(
+            self.session.track, self.point)
+        crossed = (start_finish_distance < self.start_finish_range and
+                   # First point past start/finish has an obtuse angle.
+                   lap_lib.SolvePointBAngle(
+                       self.session.track, prior_point, self.point) > 90)
+      if crossed:
         logging.info('Start/Finish')
         self.leds.CrossStartFinish()
-        self.SetLapTime()
+        self.SetLapTime(crossing_ns)
+        if crossing_ns is None:
+          crossing_ns = self.point.time.ToNanoseconds()
+        self.PublishSplit(self.GetSectorTimer().EndLap(crossing_ns))
         self.AddNewLap()
         # Start and end laps on the same point just past start/finish.
         self.current_lap.append(prior_point)
+        self.lap_delta.StartLap(prior_point)
+        self.Checkpoint()
     self.current_lap.append(self.point)
 
+  def GetSectorTimer(self) -> sectors.SectorTimer:
+    """Returns the sector timer for the track of the current session."""
+    track = self.session.track
+    if not self.sector_timer or self.sector_timer.track is not track:
+      self.sector_timer = sectors.SectorTimer(track)
+    return self.sector_timer
+
+  def PublishSplit(self, split: Optional[sectors.Split]) -> None:
+    """Shows the split on the LEDs and exports it."""
+    if not split:
+      return
+    logging.info('Sector %d (%s): %.03f, delta to best: %s', split.sector,
+                 split.name, split.duration_ns / 1e9, split.best_delta_ns)
+    if split.name == sectors.START_FINISH:
+      # LEDs are already showing the start/finish crossing.
+      theoretical_best_ns = self.sector_timer.theoretical_best_ns
+      if theoretical_best_ns:
+        logging.info('Theoretical best lap: %.03f', theoretical_best_ns / 1e9)
+    else:
+      self.leds.CrossSector(split.best_delta_ns)
+    if self.config.get('postgres'):
+      end_time = datetime.datetime.fromtimestamp(split.time_ns / 1e9,
+                                                 tz=pytz.UTC)
+      self.postgres.AddToQueue(postgres.SectorEnd(
+          number=split.sector,
+          name=split.name,
+          end_time=end_time,
+          duration_ns=split.duration_ns))
+
   def ProcessLap(self) -> None:
     """Adds the point to the lap and checks if we crossed start/finish."""
     self.ProcessPoint()
     self.CrossStartFinish()
+    if self.session:
+      self.PublishSplit(self.GetSectorTimer().Update(self.point))
+    if time.time() - self.last_checkpoint > FLAGS.checkpoint_interval:
+      self.Checkpoint()
+
+  def Checkpoint(self) -> None:
+    """Saves the session and lap state for a warm restart."""
+    self.last_checkpoint = time.time()
+    if not self.session or not self.live_data:
+      return
+    checkpoint.Save(checkpoint.Snapshot(
+        session=self.session,
+        lap_number=self.lap_number,
+        prior_lap=self.laps.get(
+            self.lap_number - 1, [])[-checkpoint.PRIOR_LAP_POINTS:],
+        current_lap=list(self.current_lap),
+        saved_time=self.last_checkpoint))
+
+  def ResumeSession(self) -> bool:
+    """Restores the session from a recent checkpoint.
+
+    Returns:
+      True if the session was resumed, False if a new session is needed.
+    """
+    snapshot = checkpoint.Load()
+    if (not snapshot or
+        snapshot.session.car != self.config['car'] or
+        snapshot.session.live_data != self.live_data):
+      return False
+    self.session = snapshot.session
+    self.lap_number = snapshot.lap_number
+    self.first_full_lap = self.lap_number + 1
+    self.current_lap = list(snapshot.current_lap)
+    self.laps = {self.lap_number: self.current_lap}
+    if snapshot.prior_lap:
+      self.laps[self.lap_number - 1] = list(snapshot.prior_lap)
+    if self.current_lap:
+      self.lap_delta.StartLap(self.current_lap[0])
+    logging.info('Resumed session: \n%s', self.session)
+    logging.info('Resumed lap %d with %d points', self.lap_number,
+                 len(self.current_lap))
+    if self.config.get('postgres'):
+      if self.current_lap:
+        lap_start_time = self.current_lap[0].time.ToDatetime(tzinfo=pytz.UTC)
+      else:
+        lap_start_time = self.session.time
+      self.postgres.AddToQueue(
+          postgres.SessionResume(session=self.session,
+                                 lap_number=self.lap_number,
+                                 lap_start_time=lap_start_time))
+    return True
 
   def ProcessSession(self) -> None:
     """Populates the session proto."""
@@ -188,7 +397,16 @@ class ExitSpeed(object):
 
 
 def main(unused_argv) -> None:
-  logging.get_absl_handler().use_absl_log_file(log_dir='/home/pi/py_logs/')
+  if not FLAGS.log_dir:
+    FLAGS.log_dir = '/home/pi/py_logs/'
+  logging.get_absl_handler().use_absl_log_file()
+  if __name__ == '__main__' and FLAGS.start_method != 'fork':
+    logging.warning('Each sensor process re-imports exit_speed.main with the '
+                    '%s start method, run exit_speed.run instead.',
+                    FLAGS.start_method)
+  multiprocessing.set_start_method(FLAGS.start_method)
+  if FLAGS.start_method == 'forkserver':
+    multiprocessing.set_forkserver_preload(FORKSERVER_PRELOAD)
   es = None
   try:
     while True:
@@ -16,17 +16,24 @@
 import datetime
 import os
 import sys
+import tempfile
+import time
 import unittest
 
+import attr
 import fake_rpi
 import gps
 import mock
 from absl import flags
 from absl.testing import absltest
+from absl.testing import flagsaver
 
+from exit_speed import checkpoint
 from exit_speed import common_lib
 from exit_speed import exit_speed_pb2
 from exit_speed import postgres_test_lib
+from exit_speed import reference_lap
+from exit_speed import sectors
 from exit_speed import tracks
 # pylint: disable=wrong-import-position
 sys.modules['RPi'] = fake_rpi.RPi     # Fake RPi
@@ -37,6 +44,7 @@ import adafruit_platformdetect
 with mock.patch.object(adafruit_platformdetect, 'Detector') as mock_detector:
   mock_detector.chip.id.return_value = 'BCM2XXX'
   import adafruit_dotstar
+  import board  # pylint: disable=unused-import
   from exit_speed import main
 # pylint: enable=wrong-import-position
 
@@ -53,12 +61,70 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     super().setUp()
     self._AddMock(adafruit_dotstar, 'DotStar')
     self._AddMock(gps, 'gps')
+    FLAGS.checkpoint_path = os.path.join(tempfile.mkdtemp(),
+                                         'checkpoint.pickle')
+    self.addCleanup(FLAGS.set_default, 'checkpoint_path', None)
+    FLAGS.reference_lap_dir = tempfile.mkdtemp()
+    self.addCleanup(FLAGS.set_default, 'reference_lap_dir', None)
 
   def _AddMock(self, module, name):
     patch = mock.patch.object(module, name)
     self.addCleanup(patch.stop)
     return patch.start()
 
+  def testInitializeSubProcesses(self):
+    es = main.ExitSpeed()
+    es.config['accelerometer'] = True
+    subprocesses = (
+        ('accelerometer', 'accel', 'exit_speed.accelerometer',
+         'AccelerometerProcess'),
+        ('gyroscope', 'gyro', 'exit_speed.gyroscope', 'GyroscopeProcess'))
+    session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car=es.config['car'],
+      live_data=True)
+    manager = mock.Mock()
+    def _ProcessSession():
+      es.session = session
+    manager.ProcessSession.side_effect = _ProcessSession
+    with mock.patch.object(es, 'ProcessSession', manager.ProcessSession), \
+         mock.patch.object(es, 'LoadReferenceLap') as mock_reference:
+      with mock.patch.object(main, 'SUBPROCESSES', subprocesses):
+        with mock.patch.object(main.importlib,
+                               'import_module') as mock_import:
+          mock_accel = mock_import.return_value.AccelerometerProcess
+          manager.attach_mock(mock_accel, 'AccelerometerProcess')
+          es.InitializeSubProcesses()
+    mock_reference.assert_called_once_with()
+    mock_import.assert_called_once_with('exit_speed.accelerometer')
+    # The sensors are started before waiting on the session.
+    self.assertEqual(
+        [mock.call.AccelerometerProcess(None, es.config, es.point_queue),
+         mock.call.ProcessSession(),
+         mock.call.AccelerometerProcess().SetSession(session)],
+        manager.mock_calls)
+    self.assertEqual(mock_accel.return_value, es.accel)
+    self.assertEqual([mock_accel.return_value], es.sensors)
+    self.assertCountEqual(
+        ['postgres', 'resume', 'accelerometer', 'session', 'reference_lap'],
+        es.startup_timings)
+
+  def testInitializeSubProcessesResumed(self):
+    es = main.ExitSpeed()
+    es.config['accelerometer'] = True
+    with mock.patch.object(es, 'ResumeSession') as mock_resume, \
+         mock.patch.object(es, 'ProcessSession') as mock_session, \
+         mock.patch.object(es, 'LoadReferenceLap'):
+      mock_resume.return_value = True
+      with mock.patch.object(main.importlib,
+                             'import_module') as mock_import:
+        es.InitializeSubProcesses()
+    mock_session.assert_not_called()
+    mock_accel = mock_import.return_value.AccelerometerProcess
+    mock_accel.assert_called_once_with(es.session, es.config, es.point_queue)
+    mock_accel.return_value.SetSession.assert_not_called()
+
   def testProcessPoint(self):
     es = main.ExitSpeed()
     point = exit_speed_pb2.Gps()
@@ -68,8 +134,23 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     es.point = point
     es.ProcessPoint()
 
-  def testSetLapTime(self):
+  def testProcessPointDeltaSource(self):
     es = main.ExitSpeed()
+    es.point = exit_speed_pb2.Gps(lat=12.000001, lon=23.000002)
+    with mock.patch.object(es.lap_delta, 'Update') as mock_update, \
+         mock.patch.object(es.leds, 'UpdateLeds') as mock_update_leds:
+      mock_update.return_value = -0.5
+      with flagsaver.flagsaver(led_delta_source='speed'):
+        es.ProcessPoint()
+      mock_update.assert_not_called()
+      mock_update_leds.assert_called_once_with(es.point, None)
+      with flagsaver.flagsaver(led_delta_source='time'):
+        es.ProcessPoint()
+      mock_update.assert_called_once_with(es.point)
+      mock_update_leds.assert_called_with(es.point, -0.5)
+
+  def testSetLapTime(self):
+    es = main.ExitSpeed(min_points_per_lap=0)
     first_point = exit_speed_pb2.Gps()
     first_point.time.FromJsonString(u'2020-05-23T17:47:44.100Z')
     last_point = exit_speed_pb2.Gps()
@@ -78,7 +159,8 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     lap.append(first_point)
     lap.append(last_point)
     es.current_lap = lap
-    es.laps = {1: lap}
+    es.lap_number = 2
+    es.laps = {2: lap}
     es.session = common_lib.Session(
       time=datetime.datetime.today(),
       track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
@@ -88,6 +170,68 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.assertEqual(76 * 1e9, es.leds.best_lap_duration_ns)
     self.assertEqual(es.leds.best_lap, lap)
 
+  def testSetLapTimeFirstLap(self):
+    es = main.ExitSpeed(min_points_per_lap=0, live_data=True)
+    first_point = exit_speed_pb2.Gps()
+    first_point.time.FromJsonString(u'2020-05-23T17:47:44.100Z')
+    last_point = exit_speed_pb2.Gps()
+    last_point.time.FromJsonString(u'2020-05-23T17:49:00.100Z')
+    es.current_lap = [first_point, last_point]
+    es.laps = {1: es.current_lap}
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car=es.config['car'],
+      live_data=True)
+    with mock.patch.object(reference_lap, 'Save') as mock_save:
+      # The out lap starts in the pits.
+      es.SetLapTime()
+      self.assertIsNone(es.leds.best_lap)
+      self.assertIsNone(es.lap_delta.best_lap_duration_ns)
+      mock_save.assert_not_called()
+
+      # As does the lap a resumed session restarted on.
+      es.lap_number = 4
+      es.first_full_lap = 5
+      es.laps = {4: es.current_lap}
+      es.SetLapTime()
+      self.assertIsNone(es.leds.best_lap)
+      mock_save.assert_not_called()
+
+  def testIsFullLap(self):
+    es = main.ExitSpeed(min_points_per_lap=2)
+    es.lap_number = 3
+    lap = [exit_speed_pb2.Gps(lat=lat) for lat in range(1, 6)]
+    self.assertTrue(es.IsFullLap(lap, 90 * 1e9))
+    self.assertFalse(es.IsFullLap(lap[:1], 90 * 1e9))
+    es.leds.SetBestLap(lap, 90 * 1e9)
+    self.assertTrue(es.IsFullLap(lap, 95 * 1e9))
+    # Far shorter than the best lap, likely a GPS dropout.
+    self.assertFalse(es.IsFullLap(lap, 30 * 1e9))
+    self.assertFalse(es.IsFullLap(lap[:2], 95 * 1e9))
+
+  def testSetBestLapAndLoadReferenceLap(self):
+    es = main.ExitSpeed()
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car=es.config['car'],
+      live_data=True)
+    lap = [exit_speed_pb2.Gps(lat=45.595015, lon=-122.694526),
+           exit_speed_pb2.Gps(lat=45.595115, lon=-122.694526)]
+    lap[1].time.FromSeconds(1)
+    es.SetBestLap(lap, 90 * 1e9)
+    es.SetBestLap(lap[:1], 91 * 1e9)  # Slower laps are not saved.
+    self.assertEqual(90 * 1e9, es.lap_delta.best_lap_duration_ns)
+
+    # The next session starts with the best lap.
+    next_session = main.ExitSpeed()
+    next_session.session = es.session
+    next_session.LoadReferenceLap()
+    self.assertEqual(lap, list(next_session.leds.best_lap))
+    self.assertEqual(90 * 1e9, next_session.leds.best_lap_duration_ns)
+    self.assertEqual(90 * 1e9, next_session.lap_delta.best_lap_duration_ns)
+
   def testCrossStartFinish(self):
     point_a = exit_speed_pb2.Gps()
     point_b = exit_speed_pb2.Gps()
@@ -111,7 +255,9 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     es.point = point_c
     es.session = common_lib.Session(
       time=datetime.datetime.today(),
-      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      track=attr.evolve(
+          tracks.portland_internal_raceways.PortlandInternationalRaceway,
+          start_finish_gate=None),
       car='RC Car',
       live_data=False)
     es.CrossStartFinish()
@@ -125,6 +271,48 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.assertIn(point_c, es.laps[2])
     self.assertNotIn(point_c, es.laps[1])
 
+  def testCrossStartFinishGate(self):
+    point_a = exit_speed_pb2.Gps(lat=45.595027833, lon=-122.694447667)
+    point_b = exit_speed_pb2.Gps(lat=45.595039333, lon=-122.694491)
+    point_c = exit_speed_pb2.Gps(lat=45.595051046, lon=-122.69453468)
+    point_a.time.FromMilliseconds(900)
+    point_b.time.FromMilliseconds(1000)
+    point_c.time.FromMilliseconds(1100)
+    es = main.ExitSpeed(min_points_per_lap=0)
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car='RC Car',
+      live_data=False)
+    es.lap_number = 2
+    es.laps = {2: es.current_lap}
+    es.current_lap.append(point_a)
+    for point in (point_b, point_c):
+      es.point = point
+      es.CrossStartFinish()
+    self.assertEqual(3, es.lap_number)
+    self.assertEqual([point_a, point_b], es.laps[2])
+    self.assertEqual([point_b, point_c], es.laps[3])
+    # Lap ends where the line between point b and c crosses the gate.
+    self.assertEqual(142339837, es.leds.best_lap_duration_ns)
+
+  def testPublishSplit(self):
+    es = main.ExitSpeed()
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car='RC Car',
+      live_data=False)
+    timer = es.GetSectorTimer()
+    self.assertIs(timer, es.GetSectorTimer())
+    with mock.patch.object(es.leds, 'CrossSector') as mock_cross_sector:
+      es.PublishSplit(None)
+      self.assertFalse(mock_cross_sector.mock_calls)
+      es.PublishSplit(sectors.Split(sector=1, name='4', time_ns=1,
+                                    duration_ns=1, lap_elapsed_ns=1,
+                                    best_delta_ns=-1))
+      mock_cross_sector.assert_called_once_with(-1)
+
   def testProcessLap(self):
     es = main.ExitSpeed()
     es.AddNewLap()
@@ -132,6 +320,46 @@ class TestExitSpeed(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     es.ProcessLap()
     self.assertTrue(es.current_lap)
 
+  def testCheckpointAndResumeSession(self):
+    es = main.ExitSpeed()
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car=es.config['car'],
+      live_data=True)
+    es.leds.SetBestLap(
+        [exit_speed_pb2.Gps(lat=45.595015, lon=-122.694526)], 90 * 1e9)
+    es.lap_number = 4
+    prior_lap = [exit_speed_pb2.Gps(lat=1), exit_speed_pb2.Gps(lat=2)]
+    es.current_lap = [exit_speed_pb2.Gps(lat=2), exit_speed_pb2.Gps(lat=3)]
+    es.laps = {3: prior_lap, 4: es.current_lap}
+    es.Checkpoint()
+
+    resumed = main.ExitSpeed()
+    self.assertTrue(resumed.ResumeSession())
+    self.assertEqual(es.session, resumed.session)
+    self.assertEqual(4, resumed.lap_number)
+    self.assertEqual(5, resumed.first_full_lap)
+    self.assertEqual(es.current_lap, resumed.current_lap)
+    self.assertEqual({3: prior_lap, 4: es.current_lap}, resumed.laps)
+    # The best lap is only loaded from the saved reference lap.
+    self.assertIsNone(resumed.leds.best_lap)
+
+  def testResumeSessionStale(self):
+    es = main.ExitSpeed()
+    self.assertFalse(es.ResumeSession())
+    es.session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car=es.config['car'],
+      live_data=True)
+    es.Checkpoint()
+    with mock.patch.object(time, 'time') as mock_time:
+      mock_time.return_value = (
+          es.last_checkpoint + FLAGS.checkpoint_max_age + 1)
+      self.assertFalse(es.ResumeSession())
+    self.assertIsNotNone(checkpoint.Load())
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -54,3 +54,11 @@ CREATE TABLE laps(
   end_time         TIMESTAMPTZ,
   duration_ns      BIGINT
 );
+CREATE TABLE sectors(
+  id               SERIAL            PRIMARY KEY,
+  lap_id           INT               REFERENCES laps (id),
+  number           INT               NOT NULL,
+  name             TEXT              NOT NULL,
+  end_time         TIMESTAMPTZ       NOT NULL,
+  duration_ns      BIGINT            NOT NULL
+);
@@ -14,8 +14,11 @@
 # limitations under the License.
 """Unitests for postgres.py"""
 import datetime
+import time
 import unittest
 
+import mock
+import psycopg2
 import pytz
 from absl.testing import absltest
 
@@ -44,6 +47,25 @@ class TestPostgres(postgres_test_lib.PostgresTestBase, unittest.TestCase):
             postgres.INSERT_GPS,
             postgres.INSERT_MAP[exit_speed_pb2.Gps])
 
+  def testLazyConnection(self):
+    mock_connect = postgres.ConnectToDB
+    interface = postgres.Postgres(exit_speed_pb2.Gps, start_process=False)
+    mock_connect.assert_not_called()
+    proto = exit_speed_pb2.Gps(lat=23, lon=34, alt=45, speed_ms=86)
+    interface.AddProtoToQueue(proto)
+    interface.ExportProto()
+    interface.AddProtoToQueue(proto)
+    interface.ExportProto()
+    mock_connect.assert_called_once_with()
+
+  def testConnectWithRetry(self):
+    mock_connect = postgres.ConnectToDB
+    conn = mock_connect.side_effect()
+    mock_connect.side_effect = [psycopg2.OperationalError(), conn]
+    with mock.patch.object(time, 'sleep') as mock_sleep:
+      self.assertEqual(conn, postgres.ConnectWithRetry())
+    mock_sleep.assert_called_once_with(postgres.FLAGS.postgres_retry_interval)
+
   def testExportGps(self):
     proto = exit_speed_pb2.Gps(
       lat=23,
@@ -202,6 +224,49 @@ class TestPostgres(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.assertEqual(db_end_time, end_time)
     self.assertEqual(db_duration_ns, duration_ns)
 
+    sector_end = postgres.SectorEnd(number=1, name='4', end_time=end_time,
+                                    duration_ns=21500000000)
+    interface.AddToQueue(sector_end)
+    interface.ExportData()
+    self.cursor.execute('SELECT * FROM sectors')
+    (_, db_lap_id, db_number, db_name,
+     db_end_time, db_duration_ns) = self.cursor.fetchone()
+    self.assertEqual(db_lap_id, interface.current_lap_id)
+    self.assertEqual(db_number, 1)
+    self.assertEqual(db_name, '4')
+    self.assertEqual(db_end_time, end_time)
+    self.assertEqual(db_duration_ns, 21500000000)
+
+  def testExportSessionResume(self):
+    interface = postgres.PostgresWithoutPrepare(start_process=False)
+    start_time = datetime.datetime(
+        2020, 5, 23, 17, 47, 44, 100000, tzinfo=pytz.UTC)
+    session = common_lib.Session(
+        time=start_time,
+        track=test_track.TestTrack,
+        car='RC Car',
+        live_data=True)
+    interface.AddToQueue(session)
+    interface.ExportData()
+    interface.AddToQueue(postgres.LapStart(number=1, start_time=start_time))
+    interface.ExportData()
+
+    resumed = postgres.PostgresWithoutPrepare(start_process=False)
+    resumed.AddToQueue(postgres.SessionResume(
+        session=session, lap_number=1, lap_start_time=start_time))
+    resumed.ExportData()
+    self.assertEqual(interface.session_id, resumed.session_id)
+    self.assertEqual(interface.current_lap_id, resumed.current_lap_id)
+    self.cursor.execute('SELECT count(*) FROM sessions')
+    self.assertEqual(1, self.cursor.fetchone()[0])
+
+    resumed.AddToQueue(postgres.SessionResume(
+        session=session, lap_number=2, lap_start_time=start_time))
+    resumed.ExportData()
+    self.assertNotEqual(interface.current_lap_id, resumed.current_lap_id)
+    self.cursor.execute('SELECT count(*) FROM laps')
+    self.assertEqual(2, self.cursor.fetchone()[0])
+
 
 if __name__ == '__main__':
   absltest.main()
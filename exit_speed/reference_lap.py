@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Precomputed best lap used as the reference by the LEDs and lap delta.
+
+The best lap of each track and car is saved to local disk including its
+projected coordinates and KD tree.  Loading it at the start of a session gives
+the LEDs a reference from the out lap without rebuilding anything on the Pi.
+"""
+import collections.abc
+import os
+import pickle
+import re
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Text
+from typing import Tuple
+
+import numpy as np
+import scipy
+from absl import flags
+from absl import logging
+from scipy.spatial import cKDTree
+
+from exit_speed import common_lib
+from exit_speed import exit_speed_pb2
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('reference_lap_dir', None,
+                    'Directory of the best lap of each track and car.  '
+                    'Defaults to reference_laps in --data_log_path.')
+
+# Increment when the ReferenceLap fields change.
+FORMAT_VERSION = 1
+
+
+class ReferenceLap(NamedTuple):
+  track: Text
+  car: Text
+  duration_ns: float
+  lap: Sequence[exit_speed_pb2.Gps]
+  projection: common_lib.LocalProjection  # Centered on the first point.
+  x: np.ndarray  # Meters.
+  y: np.ndarray  # Meters.
+  distance: np.ndarray  # Cumulative meters driven at each point.
+  elapsed_ns: np.ndarray  # Since the first point.
+  tree: cKDTree  # Of x/y.
+
+
+class LazyLap(collections.abc.Sequence):
+  """Points of a saved lap which are only parsed when accessed.
+
+  Parsing every point of a lap takes tens of milliseconds on the Pi while only
+  the points near the car are needed by the LEDs.
+  """
+
+  def __init__(self, serialized: List[bytes]):
+    self.serialized = serialized
+    self.points = [None] * len(serialized)
+
+  def __len__(self) -> int:
+    return len(self.serialized)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    point = self.points[index]
+    if point is None:
+      point = exit_speed_pb2.Gps.FromString(self.serialized[index])
+      self.points[index] = point
+    return point
+
+
+def ToLazyLap(lap: Sequence[exit_speed_pb2.Gps]) -> LazyLap:
+  """Returns the lap as a LazyLap, serializing each point only once."""
+  if isinstance(lap, LazyLap):
+    return lap
+  lazy_lap = LazyLap([point.SerializeToString() for point in lap])
+  lazy_lap.points = list(lap)
+  return lazy_lap
+
+
+def Build(lap: List[exit_speed_pb2.Gps],
+          duration_ns: float,
+          track: Text = '',
+          car: Text = '') -> ReferenceLap:
+  """Projects the lap and builds the arrays and tree used for lookups."""
+  count = len(lap)
+  lat = np.fromiter((point.lat for point in lap), float, count)
+  lon = np.fromiter((point.lon for point in lap), float, count)
+  time_ns = np.fromiter((point.time.ToNanoseconds() for point in lap),
+                        np.int64, count)
+  projection = common_lib.LocalProjection(lat[0], lon[0])
+  x, y = projection.ToXY(lat, lon)
+  distance = np.concatenate(([0], np.cumsum(np.hypot(np.diff(x),
+                                                     np.diff(y)))))
+  return ReferenceLap(track=track,
+                      car=car,
+                      duration_ns=duration_ns,
+                      lap=lap,
+                      projection=projection,
+                      x=x,
+                      y=y,
+                      distance=distance,
+                      elapsed_ns=(time_ns - time_ns[0]).astype(float),
+                      tree=cKDTree(np.column_stack((x, y))))
+
+
+def GetFormat() -> Tuple[int, Text, Text]:
+  """Saved laps are only loaded by the same format and library versions.
+
+  The pickled arrays and KD tree refer to private numpy and scipy modules which
+  may not exist after an upgrade or on another machine.
+  """
+  return FORMAT_VERSION, np.__version__, scipy.__version__
+
+
+def GetPath(track: Text, car: Text) -> Text:
+  file_name = re.sub(r'[^\w.-]+', '_', '%s_%s' % (track, car)) + '.pickle'
+  return os.path.join(
+      FLAGS.reference_lap_dir or os.path.join(FLAGS.data_log_path,
+                                              'reference_laps'),
+      file_name)
+
+
+def Save(reference: ReferenceLap, path: Optional[Text] = None) -> None:
+  """Atomically writes the reference lap, see checkpoint.Save."""
+  path = path or GetPath(reference.track, reference.car)
+  temp_path = path + '.tmp'
+  serialized = reference._replace(lap=ToLazyLap(reference.lap).serialized)
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(temp_path, 'wb') as temp_file:
+      pickle.dump(GetFormat(), temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+      pickle.dump(serialized, temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+  except OSError:
+    logging.exception('Unable to write reference lap %s', path)
+
+
+def Load(track: Text,
+         car: Text,
+         path: Optional[Text] = None) -> Optional[ReferenceLap]:
+  """Returns the saved reference lap of the track and car if there is one."""
+  path = path or GetPath(track, car)
+  if not os.path.exists(path):
+    return None
+  try:
+    with open(path, 'rb') as reference_file:
+      file_format = pickle.load(reference_file)
+      if file_format != GetFormat():
+        logging.warning('Ignoring reference lap %s saved with format %s, '
+                        'expected %s.', path, file_format, GetFormat())
+        return None
+      reference = pickle.load(reference_file)
+    return reference._replace(lap=LazyLap(reference.lap))
+  # Unpickling can raise almost anything such as ModuleNotFoundError.  A bad
+  # file should never stop Exit Speed from starting.
+  except Exception:  # pylint: disable=broad-except
+    logging.exception('Unable to read reference lap %s', path)
+    return None
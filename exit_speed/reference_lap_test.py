@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for reference_lap.py"""
+import os
+import pickle
+import tempfile
+import unittest
+
+import mock
+import numpy as np
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+
+from exit_speed import exit_speed_pb2
+from exit_speed import reference_lap
+
+FLAGS = flags.FLAGS
+
+
+def _Lap():
+  """Drives north 0.0001 degrees (~11m) per second."""
+  lap = []
+  for index in range(5):
+    point = exit_speed_pb2.Gps(lat=45.0 + index * 0.0001, lon=-122.0,
+                               speed_ms=11)
+    point.time.FromSeconds(100 + index)
+    lap.append(point)
+  return lap
+
+
+class TestReferenceLap(unittest.TestCase):
+  """Reference lap unittests."""
+
+  def testBuild(self):
+    reference = reference_lap.Build(_Lap(), 4e9, track='Track', car='Car')
+    self.assertEqual('Track', reference.track)
+    np.testing.assert_allclose([0, 0, 0, 0, 0], reference.x, atol=1e-9)
+    np.testing.assert_allclose([0, 11.1, 22.2, 33.3, 44.4], reference.y,
+                               atol=0.1)
+    np.testing.assert_allclose(reference.y, reference.distance)
+    np.testing.assert_array_equal([0, 1e9, 2e9, 3e9, 4e9],
+                                  reference.elapsed_ns)
+    _, index = reference.tree.query((0, 23))
+    self.assertEqual(2, index)
+
+  def testToLazyLap(self):
+    lap = _Lap()
+    lazy_lap = reference_lap.ToLazyLap(lap)
+    self.assertEqual([point.SerializeToString() for point in lap],
+                     lazy_lap.serialized)
+    self.assertIs(lap[2], lazy_lap[2])
+    self.assertIs(lazy_lap, reference_lap.ToLazyLap(lazy_lap))
+
+  def testSaveAndLoad(self):
+    reference = reference_lap.Build(_Lap(), 4e9, track='Portland Intl.',
+                                    car='Corrado')
+    with flagsaver.flagsaver(reference_lap_dir=tempfile.mkdtemp()):
+      self.assertIsNone(reference_lap.Load('Portland Intl.', 'Corrado'))
+      reference_lap.Save(reference)
+      path = reference_lap.GetPath('Portland Intl.', 'Corrado')
+      self.assertEqual('Portland_Intl._Corrado.pickle',
+                       os.path.basename(path))
+      self.assertFalse(os.path.exists(path + '.tmp'))
+      loaded = reference_lap.Load('Portland Intl.', 'Corrado')
+      self.assertIsNone(reference_lap.Load('Portland Intl.', 'Bug'))
+    self.assertIsInstance(loaded.lap, reference_lap.LazyLap)
+    self.assertEqual(reference.lap, list(loaded.lap))
+    self.assertEqual(reference.lap[1:3], loaded.lap[1:3])
+    self.assertEqual(4e9, loaded.duration_ns)
+    np.testing.assert_array_equal(reference.distance, loaded.distance)
+    self.assertEqual(reference.projection.PointToXY(reference.lap[3]),
+                     loaded.projection.PointToXY(reference.lap[3]))
+    _, index = loaded.tree.query((0, 23))
+    self.assertEqual(2, index)
+
+  def testLoadCorrupt(self):
+    path = os.path.join(tempfile.mkdtemp(), 'corrupt.pickle')
+    with open(path, 'wb') as corrupt_file:
+      corrupt_file.write(b'not a pickle')
+    self.assertIsNone(reference_lap.Load('Track', 'Car', path))
+
+  def testLoadMissingModule(self):
+    path = os.path.join(tempfile.mkdtemp(), 'missing_module.pickle')
+    with open(path, 'wb') as reference_file:
+      pickle.dump(reference_lap.GetFormat(), reference_file)
+      # Such as a private scipy module which no longer exists.
+      reference_file.write(b'cmissing_module\nReferenceLap\n.')
+    self.assertIsNone(reference_lap.Load('Track', 'Car', path))
+
+  def testLoadOtherFormat(self):
+    path = os.path.join(tempfile.mkdtemp(), 'reference.pickle')
+    reference_lap.Save(reference_lap.Build(_Lap(), 4e9), path)
+    self.assertIsNotNone(reference_lap.Load('Track', 'Car', path))
+    with mock.patch.object(reference_lap, 'FORMAT_VERSION', 0):
+      self.assertIsNone(reference_lap.Load('Track', 'Car', path))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replays a recorded session through the main loop as fast as possible.
+
+No hardware is needed, the LEDs use the recording backend.  Reports the points
+processed per second, the latency of ExitSpeed.ProcessLap per point and the
+LED color timeline based on the GPS time of each point.
+
+  python3 -m exit_speed.replay_benchmark --replay_data=<GPSProcess data>
+"""
+import collections
+import csv
+import os
+import time
+from typing import Dict
+from typing import List
+from typing import Text
+from typing import Tuple
+
+import numpy as np
+from absl import app
+from absl import flags
+
+from exit_speed import common_lib
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import leds
+from exit_speed import main as exit_speed_main
+from exit_speed import tracks
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'replay_data',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'testdata/Corrado/Portland International Raceway/2020-06-20/'
+                 'GPSProcess_1.data'),
+    'GPSProcess data file of the session to replay.')
+flags.DEFINE_string('replay_timeline_path', None,
+                    'If set the LED timeline is written to this CSV file.')
+FLAGS.set_default(
+    'config_path',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'testdata/test_config.yaml'))
+
+COLOR_NAMES = {
+    (255, 0, 0): 'red',
+    (0, 255, 0): 'green',
+    (0, 0, 255): 'blue',
+    (255, 0, 255): 'magenta',
+    leds.OFF: 'off',
+}
+
+Frame = Tuple[float, leds.Frame]
+
+
+def DescribeFrame(frame: leds.Frame) -> Text:
+  """Returns the color name or the number of lit LEDs of a bar."""
+  if len(set(frame)) == 1:
+    return COLOR_NAMES.get(frame[0], str(frame[0]))
+  lit = [color for color in frame if color != leds.OFF]
+  if lit and lit[-1][0] > lit[-1][1]:
+    return 'red bar %d' % len(lit)
+  return 'green bar %d' % len(lit)
+
+
+def Replay(
+    points: List[exit_speed_pb2.Gps]
+) -> Tuple[List[float], List[Frame], exit_speed_main.ExitSpeed]:
+  """Returns ProcessLap seconds per point, the LED frames and ExitSpeed."""
+  FLAGS.led_backend = 'recording'
+  es = exit_speed_main.ExitSpeed(live_data=False)
+  es.leds.Flush()
+  dots = es.leds.dots
+  dots.frames.clear()
+  # Wall time passes much quicker than the session's time when replaying.
+  point_clock = lambda: es.point.time.ToNanoseconds() / 1e9
+  es.leds.clock = point_clock
+  es.leds.last_led_update = 0
+  dots.clock = point_clock
+  es.session = common_lib.Session(
+      time=points[0].time.ToDatetime(),
+      track=tracks.FindClosestTrack({'lat': points[0].lat,
+                                     'lon': points[0].lon}),
+      car=es.config['car'],
+      live_data=False)
+  latencies = []
+  for point in points:
+    es.point = point
+    start = time.perf_counter()
+    es.ProcessLap()
+    latencies.append(time.perf_counter() - start)
+    # Not timed, the main loop never waits on the LEDs.
+    es.leds.Flush()
+  es.leds.Stop()
+  return latencies, dots.frames, es
+
+
+def SummarizeTimeline(frames: List[Frame],
+                      end_time: float) -> Dict[Text, float]:
+  """Returns the seconds each description of frame was showing."""
+  durations = collections.Counter()
+  for (frame_time, frame), (next_time, _) in zip(
+      frames, frames[1:] + [(end_time, None)]):
+    durations[DescribeFrame(frame)] += next_time - frame_time
+  return durations
+
+
+def WriteTimeline(frames: List[Frame], path: Text) -> None:
+  with open(path, 'w', newline='') as timeline_file:
+    writer = csv.writer(timeline_file)
+    writer.writerow(['time', 'description'] +
+                    ['led_%d' % index for index in range(leds.LED_COUNT)])
+    for frame_time, frame in frames:
+      writer.writerow(['%.3f' % frame_time, DescribeFrame(frame)] +
+                      ['#%02x%02x%02x' % color for color in frame])
+
+
+def main(unused_argv):
+  logger = data_logger.Logger(FLAGS.replay_data,
+                              proto_class=exit_speed_pb2.Gps)
+  points = list(logger.ReadProtos())
+  start = time.perf_counter()
+  latencies, frames, es = Replay(points)
+  elapsed = time.perf_counter() - start
+  latencies_us = np.array(latencies) * 1e6
+  print('%d points in %.2fs, %.0f points/sec including LED writes' % (
+      len(points), elapsed, len(points) / elapsed))
+  print('ProcessLap us: median %.1f  p99 %.1f  max %.1f' % (
+      np.median(latencies_us), np.percentile(latencies_us, 99),
+      latencies_us.max()))
+  if es.leds.best_lap_duration_ns:
+    print('%d laps, best lap %.3fs' % (
+        es.lap_number, es.leds.best_lap_duration_ns / 1e9))
+  print('%d LED frames' % len(frames))
+  durations = SummarizeTimeline(
+      frames, points[-1].time.ToNanoseconds() / 1e9)
+  for description, seconds in durations.most_common():
+    print('  %-16s %8.1fs' % (description, seconds))
+  if FLAGS.replay_timeline_path:
+    WriteTimeline(frames, FLAGS.replay_timeline_path)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Entry point of the Exit Speed service.
+
+  python3 -m exit_speed.run --config_path=./etc/corrado.yaml
+
+Sensor processes started by forkserver or spawn re-run the module given to -m
+as __mp_main__.  Running exit_speed.main directly would make every sensor
+process import main's numpy, scipy and LED dependencies.  This module only
+imports exit_speed.main when run as __main__ so the sensor processes skip it.
+"""
+from absl import app
+
+if __name__ == '__main__':
+  # pylint: disable=g-import-not-at-top
+  from exit_speed import main
+  app.run(main.main)
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sector and split timing based on the turns of a track.
+
+Each turn of the track ends a sector when the car makes its closest approach
+to the turn.  The last sector ends at start/finish.  Only the next turn of the
+lap is checked per point so updates are O(1) and a split is available on the
+point right after the closest approach.
+"""
+import math
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Text
+
+from absl import flags
+
+from exit_speed import common_lib
+from exit_speed import exit_speed_pb2
+from exit_speed.tracks import base
+
+FLAGS = flags.FLAGS
+flags.DEFINE_float('sector_split_range', 50,
+                   'A turn ends a sector once the car has been within this '
+                   'many meters of it and starts moving away.  Keeps nearby '
+                   'turns from ending the sector early.')
+
+START_FINISH = 'Start/Finish'
+
+
+class Split(NamedTuple):
+  sector: int  # Starts at 1.
+  name: Text  # Turn number which ended the sector or START_FINISH.
+  time_ns: int  # When the sector ended.
+  duration_ns: int  # Duration of the sector.
+  lap_elapsed_ns: int  # Duration of the lap up to the end of the sector.
+  # Difference to the best sector prior to this split, negative is faster.
+  best_delta_ns: Optional[int]
+
+
+class SectorTimer(object):
+  """Times the sectors of each lap as the points arrive."""
+
+  def __init__(self, track: base.Track):
+    self.track = track
+    self.turns = track.turns
+    self.projection = common_lib.GetTrackProjection(track)
+    self.turn_xy = [self.projection.ToXY(turn.lat, turn.lon)
+                    for turn in self.turns]
+    self.best_sectors: List[Optional[int]] = [None] * (len(self.turns) + 1)
+    self.last_split: Optional[Split] = None
+    self.lap_start_ns = None
+    self.sector_start_ns = None
+    self.next_turn = 0
+    self.closest_distance = None
+    self.closest_time_ns = None
+
+  def StartLap(self, start_ns: int) -> None:
+    """Resets the splits for a new lap starting at the given time."""
+    self.lap_start_ns = start_ns
+    self.sector_start_ns = start_ns
+    self.next_turn = 0
+    self.closest_distance = None
+    self.closest_time_ns = None
+
+  def _EndSector(self, sector_index: int, name: Text, end_ns: int) -> Split:
+    duration_ns = int(end_ns - self.sector_start_ns)
+    best = self.best_sectors[sector_index]
+    split = Split(sector=sector_index + 1,
+                  name=name,
+                  time_ns=int(end_ns),
+                  duration_ns=duration_ns,
+                  lap_elapsed_ns=int(end_ns - self.lap_start_ns),
+                  best_delta_ns=None if best is None else duration_ns - best)
+    if best is None or duration_ns < best:
+      self.best_sectors[sector_index] = duration_ns
+    self.sector_start_ns = end_ns
+    self.last_split = split
+    return split
+
+  def Update(self, point: exit_speed_pb2.Gps) -> Optional[Split]:
+    """Returns a split if the point is past the closest approach to a turn.
+
+    Nothing is timed until the first lap is started at start/finish.
+    """
+    if self.lap_start_ns is None or self.next_turn >= len(self.turns):
+      return None
+    x, y = self.projection.PointToXY(point)
+    turn_x, turn_y = self.turn_xy[self.next_turn]
+    distance = math.hypot(x - turn_x, y - turn_y)
+    if self.closest_distance is None or distance <= self.closest_distance:
+      self.closest_distance = distance
+      self.closest_time_ns = point.time.ToNanoseconds()
+      return None
+    if self.closest_distance > FLAGS.sector_split_range:
+      return None
+    # Moving away from the turn, the prior closest point ended the sector.
+    split = self._EndSector(self.next_turn, self.turns[self.next_turn].number,
+                            self.closest_time_ns)
+    self.next_turn += 1
+    self.closest_distance = None
+    self.closest_time_ns = None
+    return split
+
+  def EndLap(self, end_ns: int) -> Optional[Split]:
+    """Ends the last sector at start/finish and starts the next lap.
+
+    Returns:
+      The split of the last sector or None if a turn was missed in which case
+      the sectors of the lap can't be compared with the best sectors.
+    """
+    split = None
+    if self.lap_start_ns is not None and self.next_turn == len(self.turns):
+      split = self._EndSector(len(self.turns), START_FINISH, end_ns)
+    self.StartLap(end_ns)
+    return split
+
+  @property
+  def theoretical_best_ns(self) -> Optional[int]:
+    """Sum of the best sectors, None until every sector has been timed."""
+    if None in self.best_sectors:
+      return None
+    return sum(self.best_sectors)
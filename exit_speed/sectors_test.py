@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for sectors.py"""
+import os
+import unittest
+
+from absl.testing import absltest
+
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import lap_lib
+from exit_speed import sectors
+from exit_speed import tracks
+from exit_speed.tracks import base
+
+PIR_SESSION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'testdata/Corrado/Portland International Raceway/2020-06-20/'
+    'GPSProcess_1.data')
+
+TRACK = base.Track(
+    name='Straight Line',
+    start_finish=(45.0, -122.0),
+    turns=(base.Turn('1', 45.0, -121.99),
+           base.Turn('2', 45.0, -121.98)))
+
+
+def _Point(lon: float, seconds: float) -> exit_speed_pb2.Gps:
+  point = exit_speed_pb2.Gps(lat=45.0, lon=lon)
+  point.time.FromNanoseconds(int(seconds * 1e9))
+  return point
+
+
+class TestSectors(unittest.TestCase):
+  """Sector timing unittests."""
+
+  def _DriveLap(self, timer, start_seconds, lon_per_second, seconds):
+    """Drives east along the turns at one point per second."""
+    splits = []
+    for second in range(seconds):
+      split = timer.Update(_Point(-122.0 + second * lon_per_second,
+                                  start_seconds + second))
+      if split:
+        splits.append(split)
+    splits.append(timer.EndLap(int((start_seconds + seconds) * 1e9)))
+    return splits
+
+  def testUpdateBeforeFirstLap(self):
+    timer = sectors.SectorTimer(TRACK)
+    self.assertIsNone(timer.Update(_Point(-121.99, 1)))
+    self.assertIsNone(timer.Update(_Point(-121.98, 2)))
+    self.assertIsNone(timer.last_split)
+
+  def testSplits(self):
+    timer = sectors.SectorTimer(TRACK)
+    timer.StartLap(0)
+    splits = self._DriveLap(timer, 0, 0.001, 26)
+    self.assertEqual(['1', '2', sectors.START_FINISH],
+                     [split.name for split in splits])
+    self.assertEqual([10e9, 10e9, 6e9],
+                     [split.duration_ns for split in splits])
+    self.assertEqual([10e9, 20e9, 26e9],
+                     [split.lap_elapsed_ns for split in splits])
+    self.assertEqual([None, None, None],
+                     [split.best_delta_ns for split in splits])
+    self.assertEqual(26e9, timer.theoretical_best_ns)
+
+    # Faster lap.
+    splits = self._DriveLap(timer, 26, 0.002, 13)
+    self.assertEqual([-5e9, -5e9, -3e9],
+                     [split.best_delta_ns for split in splits])
+    self.assertEqual(13e9, timer.theoretical_best_ns)
+    self.assertEqual(splits[-1], timer.last_split)
+
+  def testMissedTurn(self):
+    timer = sectors.SectorTimer(TRACK)
+    timer.StartLap(0)
+    timer.Update(_Point(-122.0, 1))
+    self.assertIsNone(timer.EndLap(2e9))
+    self.assertIsNone(timer.theoretical_best_ns)
+    self.assertEqual(2e9, timer.lap_start_ns)
+    self.assertEqual(0, timer.next_turn)
+
+  def testPortlandInternationalRaceway(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    crossings, durations = lap_lib.SplitLaps(
+        track, *lap_lib.GpsArrays(points))
+    crossings = set(crossings.tolist())
+    timer = sectors.SectorTimer(track)
+    splits = []
+    for index, point in enumerate(points):
+      if index in crossings:
+        splits.append(timer.EndLap(point.time.ToNanoseconds()))
+      splits.append(timer.Update(point))
+    lap_splits = [split for split in splits
+                  if split and split.name == sectors.START_FINISH]
+    # Timing starts at the first crossing, leaving 14 full laps.
+    self.assertEqual(14, len(lap_splits))
+    # Laps are split on the first point past the gate, within one GPS cycle.
+    for split, duration_ns in zip(lap_splits, durations[1:]):
+      self.assertAlmostEqual(duration_ns, split.lap_elapsed_ns, delta=1e8)
+    self.assertLess(timer.theoretical_best_ns, min(durations))
+    self.assertGreater(timer.theoretical_best_ns, min(durations) - 5e9)
+
+
+if __name__ == '__main__':
+  absltest.main()
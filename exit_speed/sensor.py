@@ -17,11 +17,15 @@
 Based the recommendation here.
 https://developers.google.com/protocol-buffers/docs/techniques
 """
+import collections
 import datetime
 import multiprocessing
 import os
 import time
+from typing import Callable
 from typing import Dict
+from typing import Optional
+from typing import Text
 
 from absl import flags
 from absl import logging
@@ -35,27 +39,110 @@ from exit_speed import postgres
 FLAGS = flags.FLAGS
 flags.DEFINE_string('data_log_path', '/home/pi/lap_logs',
                     'The directory to save data and logs.')
+flags.DEFINE_integer('max_pending_messages', 100000,
+                     'Messages each sensor buffers while waiting on the '
+                     'session before dropping the oldest.')
+flags.DEFINE_integer('sensor_report_interval', 60,
+                     'Seconds between logging the achieved rate and jitter '
+                     'of each polled sensor.')
 
 
-def SleepBasedOnHertz(cycle_time: float, frequency_hz: float) -> float:
-  """Calculates how to sleep to maintain the expected cycle reading.
+class Scheduler(object):
+  """Runs a sensor loop at a fixed rate using absolute monotonic deadlines.
 
-  This is useful for sensor which are polled or have high rates.
+  Deadlines are multiples of the period from the first cycle so the time spent
+  reading and exporting a value does not accumulate as drift.  If a read takes
+  longer than a period the missed deadlines are counted and skipped rather than
+  run back to back.
+  """
 
-  Args;
-    cycle_time: A float of the time in the loop before the sensor reading.
-    frequency_hz: The target frequency reading we're aiming for.
-                  See https://docs.python.org/3/tutorial/floatingpoint.html for
-                  an explanation as to why this will be slightly off.
+  def __init__(self,
+               name: Text,
+               frequency_hz: float,
+               clock: Callable[[], int] = time.monotonic_ns,
+               sleep: Callable[[float], None] = time.sleep,
+               wall_clock: Callable[[], int] = time.time_ns):
+    """Initializer.
 
-  Returns:
-    A float duration in seconds.
-  """
-  seconds = 1.0 / frequency_hz
-  sleep = seconds - (time.time() - cycle_time)
-  if sleep < 0:
-    return 0
-  return sleep
+    Args:
+      name: Name of the sensor in the reported rate and jitter.
+      frequency_hz: The target frequency reading we're aiming for.
+      clock: Returns monotonic nanoseconds.
+      sleep: Sleeps for the given seconds.
+      wall_clock: Returns wall clock nanoseconds for the proto timestamps.
+                  Read each cycle so NTP or GPS setting the clock after start
+                  up is followed.
+    """
+    self.name = name
+    self.frequency_hz = frequency_hz
+    self.period_ns = int(1e9 / frequency_hz)
+    self.clock = clock
+    self.sleep = sleep
+    self.wall_clock = wall_clock
+    self.next_deadline_ns = None
+    self.ResetStats()
+
+  def ResetStats(self) -> None:
+    self.report_start_ns = None
+    self.cycles = 0
+    self.missed_deadlines = 0
+    self.max_lateness_ns = 0
+    self.total_lateness_ns = 0
+
+  def Wait(self) -> int:
+    """Sleeps until the next deadline.
+
+    Returns:
+      The wall clock nanoseconds at which the cycle started which should be
+      used as the timestamp of the values read in this cycle.
+    """
+    now = self.clock()
+    if self.next_deadline_ns is None:
+      self.next_deadline_ns = now
+      self.report_start_ns = now
+    elif now < self.next_deadline_ns:
+      self.sleep((self.next_deadline_ns - now) / 1e9)
+      now = self.clock()
+    lateness = now - self.next_deadline_ns
+    missed = lateness // self.period_ns
+    if missed:
+      self.missed_deadlines += missed
+      self.next_deadline_ns += missed * self.period_ns
+      lateness -= missed * self.period_ns
+    self.cycles += 1
+    self.total_lateness_ns += lateness
+    self.max_lateness_ns = max(self.max_lateness_ns, lateness)
+    self.next_deadline_ns += self.period_ns
+    timestamp_ns = self.wall_clock()
+    if now - self.report_start_ns >= FLAGS.sensor_report_interval * 1e9:
+      self.Report(now)
+    return timestamp_ns
+
+  def GetStats(self, now: Optional[int] = None) -> Dict[Text, float]:
+    """Returns the achieved rate and jitter since the last report."""
+    if now is None:
+      now = self.clock()
+    elapsed_ns = 0
+    if self.report_start_ns is not None:
+      elapsed_ns = now - self.report_start_ns
+    return {
+        'hz': self.cycles / elapsed_ns * 1e9 if elapsed_ns else 0.0,
+        'missed_deadlines': self.missed_deadlines,
+        'mean_jitter_ms': (self.total_lateness_ns / self.cycles / 1e6
+                           if self.cycles else 0.0),
+        'max_jitter_ms': self.max_lateness_ns / 1e6,
+    }
+
+  def Report(self, now: Optional[int] = None) -> None:
+    if now is None:
+      now = self.clock()
+    stats = self.GetStats(now)
+    logging.info('%s %.2f/%.2f hz, %d missed deadlines, jitter mean %.2fms '
+                 'max %.2fms', self.name, stats['hz'], self.frequency_hz,
+                 stats['missed_deadlines'], stats['mean_jitter_ms'],
+                 stats['max_jitter_ms'])
+    self.ResetStats()
+    self.report_start_ns = now
 
 
 class SensorBase(object):
@@ -64,15 +151,29 @@ class SensorBase(object):
 
   def __init__(
       self,
-      session: common_lib.Session,
+      session: Optional[common_lib.Session],
       config: Dict,
       point_queue: multiprocessing.Queue,
       start_process: bool=True):
+    """Initializer.
+
+    Args:
+      session: The current session.  If None the sensor starts without waiting
+               on it and buffers the messages it logs until SetSession is
+               called.
+      config: The loaded config.yaml.
+      point_queue: GPS points are added to this queue for the main process.
+      start_process: If True the sensor's Loop is started in a new process.
+    """
     self.session = session
     self.config = config
     self._point_queue = point_queue
     self.stop_process_signal = multiprocessing.Value('b', False)
     self.data_logger = None
+    self._session_receiver, self._session_sender = multiprocessing.Pipe(
+        duplex=False)
+    self._pending_messages = collections.deque(
+        maxlen=FLAGS.max_pending_messages)
     if self.PROTO_CLASS:
       self.postgres = postgres.Postgres(self.PROTO_CLASS,
                                         start_process=start_process)
@@ -82,6 +183,17 @@ class SensorBase(object):
           daemon=True)
       self._process.start()
 
+  def __getstate__(self):
+    """Pickles the sensor for spawn and forkserver child processes."""
+    state = self.__dict__.copy()
+    state.pop('_process', None)
+    state['_flag_values'] = common_lib.GetFlagValues()
+    return state
+
+  def __setstate__(self, state):
+    common_lib.RestoreFlagValues(state.pop('_flag_values'))
+    self.__dict__.update(state)
+
   def _InitializeDataLogger(self, proto: any_pb2.Any):
     file_prefix = GetLogFilePrefix(self.session, self)
     logging.info('Logging data to %s', file_prefix)
@@ -102,14 +214,53 @@ class SensorBase(object):
     self.LogMessage(point)
     self._point_queue.put(point.SerializeToString())
 
+  def SetSession(self, session: common_lib.Session):
+    """Sends the session to the sensor process once it is known."""
+    self.session = session
+    self._session_sender.send(session)
+
+  def _ReceiveSession(self) -> bool:
+    """Returns True once the session sent by SetSession has been received."""
+    if self._session_receiver.poll():
+      self.session = self._session_receiver.recv()
+    return self.session is not None
+
   def LogMessage(self, proto: any_pb2.Any):
+    """Logs the proto, buffering it until the session is known."""
+    if self.session is None and not self._ReceiveSession():
+      if len(self._pending_messages) == self._pending_messages.maxlen:
+        logging.log_every_n_seconds(
+            logging.WARNING, '%s dropping messages logged before the session '
+            'started.', 60, self.__class__.__name__)
+      self._pending_messages.append(proto)
+      return
+    while self._pending_messages:
+      self.WriteMessage(self._pending_messages.popleft())
+    self.WriteMessage(proto)
+
+  def WriteMessage(self, proto: any_pb2.Any):
     if not self.data_logger:
       self._InitializeDataLogger(proto)
     self.data_logger.WriteProto(proto)
 
-  def LogAndExportProto(self, proto: any_pb2.Any):
-    proto.time.FromDatetime(datetime.datetime.utcnow())
+  def LogAndExportProto(self,
+                        proto: any_pb2.Any,
+                        timestamp_ns: Optional[int] = None):
+    """Timestamps, logs and exports the proto.
+
+    Args:
+      proto: The sensor values.
+      timestamp_ns: Wall clock nanoseconds at which the values were read such
+                    as returned by Scheduler.Wait.  Defaults to now.
+    """
+    if timestamp_ns:
+      proto.time.FromNanoseconds(timestamp_ns)
+    else:
+      proto.time.FromDatetime(datetime.datetime.utcnow())
     self.LogMessage(proto)
+    self.ExportProto(proto)
+
+  def ExportProto(self, proto: any_pb2.Any):
     self.postgres.AddProtoToQueue(proto)
 
   def Loop(self):
@@ -117,12 +268,19 @@ class SensorBase(object):
 
 
 def GetLogFilePrefix(session: common_lib.Session,
-                     sensor_instance: SensorBase):
-  """Formats the logging path based on sensor and the given proto."""
+                     sensor_instance: SensorBase,
+                     name: Optional[Text] = None):
+  """Formats the logging path based on sensor and the given proto.
+
+  Args:
+    session: The current session.
+    sensor_instance: The sensor logging the data.
+    name: Overrides the file name which defaults to the sensor's class name.
+  """
   current_seconds = session.time.second + session.time.microsecond / 1e6
   return os.path.join(
       FLAGS.data_log_path,
       session.car,
       session.track.name,
       '%s:%03f' % (session.time.strftime('%Y-%m-%dT%H:%M'), current_seconds),
-      '%s' % sensor_instance.__class__.__name__)
+      name or sensor_instance.__class__.__name__)
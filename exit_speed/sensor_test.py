@@ -14,12 +14,14 @@
 # limitations under the License.
 """Unitests for sensor.py"""
 import multiprocessing
+import tempfile
 import time
 import unittest
 
 import mock
 from absl import flags
 from absl.testing import absltest
+from absl.testing import flagsaver
 
 from exit_speed import common_lib
 from exit_speed import data_logger
@@ -38,17 +40,71 @@ class SensorTest(sensor.SensorBase):
 class TestAccelerometer(unittest.TestCase):
   """Accelerometer unittests."""
 
-  def testSleepBasedOnHertz(self):
-    now = time.time()
-    cycle_time = now - 0.01
-    with mock.patch.object(time, 'time') as mock_now:
-      mock_now.return_value = now
-      self.assertEqual(0.09,
-          round(sensor.SleepBasedOnHertz(cycle_time, 10), 2))
-      self.assertEqual(0.04,
-          round(sensor.SleepBasedOnHertz(cycle_time, 20), 2))
-      self.assertEqual(0.99,
-          round(sensor.SleepBasedOnHertz(cycle_time, 1), 2))
+  def testSchedulerAbsoluteDeadlines(self):
+    now = [0]
+    sleeps = []
+    def _Sleep(seconds):
+      sleeps.append(seconds)
+      now[0] += int(seconds * 1e9)
+    scheduler = sensor.Scheduler('Test', 10, clock=lambda: now[0],
+                                 sleep=_Sleep,
+                                 wall_clock=lambda: now[0] + 1_000)
+    start_ns = scheduler.Wait()
+    # Time spent reading shortens the sleep instead of delaying the next cycle.
+    now[0] += 10_000_000
+    self.assertEqual(start_ns + 100_000_000, scheduler.Wait())
+    self.assertEqual([0.09], sleeps)
+    now[0] += 30_000_000
+    self.assertEqual(start_ns + 200_000_000, scheduler.Wait())
+    self.assertEqual([0.09, 0.07], sleeps)
+    stats = scheduler.GetStats(now[0] + 100_000_000)
+    self.assertEqual(10, stats['hz'])
+    self.assertEqual(0, stats['missed_deadlines'])
+    self.assertEqual(0, stats['max_jitter_ms'])
+
+  def testSchedulerWallClockStep(self):
+    now = [0]
+    wall_now = [1590256064100000000]
+    def _Sleep(seconds):
+      now[0] += int(seconds * 1e9)
+      wall_now[0] += int(seconds * 1e9)
+    scheduler = sensor.Scheduler('Test', 10, clock=lambda: now[0],
+                                 sleep=_Sleep, wall_clock=lambda: wall_now[0])
+    self.assertEqual(1590256064100000000, scheduler.Wait())
+    # NTP steps the clock forward an hour, the deadlines are unaffected.
+    wall_now[0] += 3600 * 10**9
+    self.assertEqual(1590259664200000000, scheduler.Wait())
+    self.assertEqual(200_000_000, scheduler.next_deadline_ns)
+
+  def testSchedulerMissedDeadlines(self):
+    now = [0]
+    scheduler = sensor.Scheduler('Test', 10, clock=lambda: now[0],
+                                 sleep=mock.Mock())
+    scheduler.Wait()
+    # A slow read runs the 100ms cycle 50ms after the 200ms deadline which is
+    # skipped.
+    now[0] += 250_000_000
+    scheduler.Wait()
+    stats = scheduler.GetStats()
+    self.assertEqual(1, stats['missed_deadlines'])
+    self.assertEqual(50, stats['max_jitter_ms'])
+    self.assertEqual(300_000_000, scheduler.next_deadline_ns)
+
+  @flagsaver.flagsaver
+  def testSchedulerReport(self):
+    FLAGS.sensor_report_interval = 1
+    now = [0]
+    def _Sleep(seconds):
+      now[0] += int(seconds * 1e9) + 1_000_000
+    scheduler = sensor.Scheduler('Test', 10, clock=lambda: now[0],
+                                 sleep=_Sleep)
+    with mock.patch.object(scheduler, 'Report',
+                           wraps=scheduler.Report) as mock_report:
+      for _ in range(11):
+        scheduler.Wait()
+    mock_report.assert_called_once()
+    self.assertEqual(0, scheduler.cycles)
+    self.assertEqual(1_001_000_000, scheduler.report_start_ns)
 
   def testGetLogFilePrefix(self):
     point = exit_speed_pb2.Gps()
@@ -66,7 +122,10 @@ class TestAccelerometer(unittest.TestCase):
     self.assertEqual(expected, sensor.GetLogFilePrefix(
        session, sensor_instance))
 
+  @flagsaver.flagsaver
   def testLogMessage(self):
+    # Data files are appended to, use a fresh directory for each run.
+    FLAGS.data_log_path = tempfile.mkdtemp()
     point = exit_speed_pb2.Gps()
     point.time.FromJsonString(u'2020-05-23T17:47:44.100Z')
     queue = multiprocessing.Queue()
@@ -83,6 +142,38 @@ class TestAccelerometer(unittest.TestCase):
     for read_point in reader.ReadProtos():
       self.assertEqual(point, read_point)
 
+  @flagsaver.flagsaver
+  def testLogMessageBeforeSession(self):
+    FLAGS.data_log_path = tempfile.mkdtemp()
+    session = common_lib.Session(
+      time=exit_speed_pb2.Gps().time.ToDatetime(),
+      track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
+      car='RC Car',
+      live_data=False)
+    sensor_instance = SensorTest(
+        None, {}, multiprocessing.Queue(), start_process=False)
+    points = [exit_speed_pb2.Gps(lat=lat) for lat in range(1, 4)]
+    sensor_instance.LogMessage(points[0])
+    sensor_instance.LogMessage(points[1])
+    self.assertIsNone(sensor_instance.data_logger)
+    # Received through the pipe as it would be by the sensor process.
+    sensor_instance._session_sender.send(session)
+    sensor_instance.LogMessage(points[2])
+    self.assertEqual(session, sensor_instance.session)
+    sensor_instance.data_logger.current_file.flush()
+    reader = data_logger.Logger(sensor_instance.data_logger.file_prefix,
+                                proto_class=exit_speed_pb2.Gps)
+    self.assertEqual(points, list(reader.ReadProtos()))
+
+  @flagsaver.flagsaver(max_pending_messages=2)
+  def testPendingMessagesBounded(self):
+    sensor_instance = SensorTest(
+        None, {}, multiprocessing.Queue(), start_process=False)
+    for lat in range(3):
+      sensor_instance.LogMessage(exit_speed_pb2.Gps(lat=lat))
+    self.assertEqual([exit_speed_pb2.Gps(lat=1), exit_speed_pb2.Gps(lat=2)],
+                     list(sensor_instance._pending_messages))
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks the speed delta smoothers used by the LEDs.
+
+  python3 -m exit_speed.smoothing_benchmark
+"""
+import collections
+import random
+import statistics
+import time
+from typing import Callable
+from typing import List
+
+from absl import app
+from absl import flags
+
+from exit_speed import smoothing_lib
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('smoothing_window_sizes', ['10', '50', '100', '200', '500'],
+                  'Window sizes, IE --speed_deltas, to benchmark.')
+flags.DEFINE_integer('smoothing_updates', 20000,
+                     'Number of speed deltas added per smoother and size.')
+
+
+def StatisticsMedian(size: int) -> Callable[[float], float]:
+  """The prior smoothing which took the median of the deque twice."""
+  deltas = collections.deque(maxlen=size)
+
+  def Update(value: float) -> float:
+    deltas.append(value)
+    statistics.median(deltas)
+    return statistics.median(deltas)
+  return Update
+
+
+def RollingMedian(size: int) -> Callable[[float], float]:
+  return smoothing_lib.RollingMedian(size).Update
+
+
+def ExponentialMovingAverage(size: int) -> Callable[[float], float]:
+  return smoothing_lib.ExponentialMovingAverage(size).Update
+
+
+def Benchmark(update: Callable[[float], float], values: List[float]) -> float:
+  """Returns the mean microseconds per update."""
+  start = time.perf_counter()
+  for value in values:
+    update(value)
+  return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def main(unused_argv):
+  rand = random.Random(0)
+  values = [rand.gauss(0, 2) for _ in range(FLAGS.smoothing_updates)]
+  smoothers = (('statistics x2', StatisticsMedian),
+               ('rolling median', RollingMedian),
+               ('ema', ExponentialMovingAverage))
+  print('Microseconds per speed delta')
+  print('%-8s' % 'size' + ''.join('%16s' % name for name, _ in smoothers))
+  for size in FLAGS.smoothing_window_sizes:
+    size = int(size)
+    print('%-8d' % size + ''.join(
+        '%16.2f' % Benchmark(smoother(size), values)
+        for _, smoother in smoothers))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming smoothers for noisy sensor values such as speed deltas."""
+import bisect
+import collections
+from typing import Optional
+
+
+class RollingMedian(object):
+  """Median of the last size values.
+
+  The window is also kept sorted so each update is a binary search to remove
+  the oldest value and another to insert the newest, instead of sorting the
+  whole window for every median.  Removing from and inserting into the sorted
+  list still shifts its elements so an update is O(size) rather than
+  O(log size).  That is cheaper than a heap or skip list for windows of tens
+  of values such as --speed_deltas but not for windows of thousands.
+  """
+
+  def __init__(self, size: int):
+    self.values = collections.deque(maxlen=size)
+    self.sorted_values = []
+
+  def __len__(self) -> int:
+    return len(self.values)
+
+  def Update(self, value: float) -> float:
+    """Adds the value and returns the new median."""
+    if len(self.values) == self.values.maxlen:
+      oldest = self.values[0]
+      del self.sorted_values[bisect.bisect_left(self.sorted_values, oldest)]
+    self.values.append(value)
+    bisect.insort(self.sorted_values, value)
+    return self.Value()
+
+  def Value(self) -> Optional[float]:
+    """Returns the median, the mean of the middle two for even sizes."""
+    count = len(self.sorted_values)
+    if not count:
+      return None
+    middle = count // 2
+    if count % 2:
+      return self.sorted_values[middle]
+    return (self.sorted_values[middle - 1] + self.sorted_values[middle]) / 2
+
+
+class ExponentialMovingAverage(object):
+  """Exponential moving average weighted like a window of size values."""
+
+  def __init__(self, size: int):
+    self.alpha = 2 / (size + 1)
+    self.value = None
+
+  def Update(self, value: float) -> float:
+    """Adds the value and returns the new average."""
+    if self.value is None:
+      self.value = value
+    else:
+      self.value += self.alpha * (value - self.value)
+    return self.value
+
+  def Value(self) -> Optional[float]:
+    return self.value
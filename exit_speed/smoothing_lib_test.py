@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for smoothing_lib.py"""
+import collections
+import random
+import statistics
+import unittest
+
+from absl.testing import absltest
+
+from exit_speed import smoothing_lib
+
+
+class TestSmoothingLib(unittest.TestCase):
+  """Smoothing unittests."""
+
+  def testRollingMedian(self):
+    median = smoothing_lib.RollingMedian(3)
+    self.assertIsNone(median.Value())
+    self.assertEqual(5, median.Update(5))
+    self.assertEqual(3, median.Update(1))
+    self.assertEqual(5, median.Update(9))
+    self.assertEqual(9, median.Update(10))  # 5 is dropped.
+    self.assertEqual(3, len(median))
+    self.assertSequenceEqual([1, 9, 10], median.sorted_values)
+
+  def testRollingMedianMatchesStatistics(self):
+    rand = random.Random(0)
+    for size in (1, 2, 10, 51):
+      median = smoothing_lib.RollingMedian(size)
+      window = collections.deque(maxlen=size)
+      for _ in range(500):
+        # Repeated values exercise removing duplicates from the window.
+        value = rand.choice((rand.uniform(-10, 10), rand.randint(-3, 3)))
+        window.append(value)
+        self.assertEqual(statistics.median(window), median.Update(value))
+
+  def testExponentialMovingAverage(self):
+    average = smoothing_lib.ExponentialMovingAverage(3)
+    self.assertIsNone(average.Value())
+    self.assertEqual(4, average.Update(4))
+    self.assertEqual(2, average.Update(0))
+    self.assertEqual(3, average.Update(4))
+    self.assertEqual(3, average.Value())
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks import time, process start up and memory of sensor processes.
+
+Run on the Pi to compare multiprocessing start methods.
+  python3 -m exit_speed.startup_benchmark
+
+forkserver and spawn children re-run the module the parent was started with
+by -m as __mp_main__.  Sensor processes are started as if the parent was run
+with each of --benchmark_main_modules so their cost is included.
+"""
+import contextlib
+import datetime
+import importlib
+import importlib.util
+import multiprocessing
+import resource
+import statistics
+import subprocess
+import sys
+import textwrap
+import time
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Text
+from typing import Tuple
+
+from absl import app
+from absl import flags
+
+from exit_speed import common_lib
+from exit_speed import sensor
+from exit_speed.tracks import test_track
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('benchmark_modules',
+                  ['exit_speed.sensor',
+                   'exit_speed.accelerometer',
+                   'exit_speed.gyroscope',
+                   'exit_speed.gps_sensor',
+                   'exit_speed.labjack',
+                   'exit_speed.wbo2',
+                   'exit_speed.tire_temperature',
+                   'exit_speed.leds',
+                   'exit_speed.main',
+                   'exit_speed.run'],
+                  'Modules to measure the cold import time of.')
+flags.DEFINE_list('benchmark_start_methods', ['fork', 'forkserver', 'spawn'],
+                  'Multiprocessing start methods to compare.')
+flags.DEFINE_list('benchmark_parent_imports',
+                  ['numpy', 'psycopg2', 'scipy.spatial'],
+                  'Imported by the parent before starting sensor processes to '
+                  'mimic the module graph of the main process.')
+flags.DEFINE_list('benchmark_main_modules',
+                  ['exit_speed.run', 'exit_speed.main'],
+                  'Modules the parent is treated as being run with by -m.')
+flags.DEFINE_integer('benchmark_runs', 5,
+                     'Number of sensor processes started per start method.')
+
+# Modules which are expensive to import and are reported when present.
+HEAVY_MODULES = ('adafruit_dotstar', 'board', 'busio', 'numpy', 'psycopg2',
+                 'scipy')
+
+IMPORT_SCRIPT = textwrap.dedent("""
+  import importlib, resource, sys, time
+  start = time.perf_counter()
+  importlib.import_module(sys.argv[1])
+  elapsed = time.perf_counter() - start
+  heavy = [name for name in sys.argv[2:] if name in sys.modules]
+  print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        ','.join(heavy))
+""")
+
+
+def BenchmarkImport(
+    module_name: Text) -> Optional[Tuple[float, int, Text]]:
+  """Imports the module in a fresh interpreter.
+
+  Returns:
+    The import duration in seconds, max RSS in KiB and the heavy modules which
+    were loaded as a result.  None if the import failed.
+  """
+  result = subprocess.run(
+      [sys.executable, '-c', IMPORT_SCRIPT, module_name, *HEAVY_MODULES],
+      capture_output=True, text=True, check=False)
+  if result.returncode:
+    return None
+  # Some hardware libraries print on import so only the last line is ours.
+  last_line = result.stdout.strip().splitlines()[-1]
+  elapsed, rss_kb, heavy = (last_line.split(' ') + [''])[:3]
+  return float(elapsed), int(rss_kb), heavy
+
+
+class FirstPointSensor(sensor.SensorBase):
+  """Reports back as soon as the sensor process starts its loop."""
+  # Pickled by its importable name as __main__ differs in the children, see
+  # RunAsMainModule.
+  __module__ = 'exit_speed.startup_benchmark'
+
+  def Loop(self):
+    self._point_queue.put(
+        (time.time(),
+         resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+         [name for name in HEAVY_MODULES if name in sys.modules]))
+
+
+@contextlib.contextmanager
+def RunAsMainModule(module_name: Text) -> Iterator[None]:
+  """Makes child processes treat the parent as run with -m module_name."""
+  main_module = sys.modules['__main__']
+  spec = getattr(main_module, '__spec__', None)
+  main_module.__spec__ = importlib.util.find_spec(module_name)
+  try:
+    yield
+  finally:
+    main_module.__spec__ = spec
+
+
+def BenchmarkStartMethod(
+    start_method: Text,
+    main_module: Text,
+    session: common_lib.Session
+    ) -> Optional[Tuple[List[float], List[int], List[Text]]]:
+  """Starts sensor processes and measures the time until the loop starts.
+
+  Returns:
+    The durations, max RSS in KiB and heavy modules loaded by the sensor
+    processes.  None if a sensor process failed to start.
+  """
+  multiprocessing.set_start_method(start_method, force=True)
+  if start_method == 'forkserver':
+    multiprocessing.set_forkserver_preload(['exit_speed.sensor'])
+  durations = []
+  rss = []
+  heavy = []
+  with RunAsMainModule(main_module):
+    for _ in range(FLAGS.benchmark_runs):
+      point_queue = multiprocessing.Queue()
+      start = time.time()
+      instance = FirstPointSensor(session, {}, point_queue)
+      while point_queue.empty():
+        if not instance._process.is_alive():  # pylint: disable=protected-access
+          return None
+        time.sleep(0.001)
+      loop_time, rss_kb, heavy = point_queue.get()
+      durations.append(loop_time - start)
+      rss.append(rss_kb)
+      instance.Join()
+  return durations, rss, heavy
+
+
+def main(unused_argv):
+  print('Cold import (fresh interpreter)')
+  print('%-30s %10s %10s  %s' % ('module', 'seconds', 'rss MiB', 'heavy'))
+  for module_name in FLAGS.benchmark_modules:
+    result = BenchmarkImport(module_name)
+    if result:
+      elapsed, rss_kb, heavy = result
+      print('%-30s %10.3f %10.1f  %s' % (
+          module_name, elapsed, rss_kb / 1024, heavy))
+    else:
+      print('%-30s %10s' % (module_name, 'failed'))
+
+  for module_name in FLAGS.benchmark_parent_imports:
+    importlib.import_module(module_name)
+  session = common_lib.Session(
+      time=datetime.datetime.today(),
+      track=test_track.TestTrack,
+      car='Benchmark',
+      live_data=False)
+  print('\nSensor process start to first loop iteration (%d runs)' %
+        FLAGS.benchmark_runs)
+  print('%-12s %-18s %10s %10s %10s  %s' % (
+      'method', '-m module', 'median s', 'max s', 'rss MiB', 'heavy'))
+  for start_method in FLAGS.benchmark_start_methods:
+    for main_module in FLAGS.benchmark_main_modules:
+      result = BenchmarkStartMethod(start_method, main_module, session)
+      if not result:
+        print('%-12s %-18s %10s' % (start_method, main_module, 'failed'))
+        continue
+      durations, rss, heavy = result
+      print('%-12s %-18s %10.3f %10.3f %10.1f  %s' % (
+          start_method, main_module, statistics.median(durations),
+          max(durations), statistics.median(rss) / 1024, ','.join(heavy)))
+
+
+if __name__ == '__main__':
+  sys.modules['exit_speed.startup_benchmark'] = sys.modules[__name__]
+  app.run(main)
@@ -15,14 +15,38 @@
 """MLX90640 InfraRed sensor.
 
 https://github.com/melexis-fir/mlx9064x-driver-py
+
+Each corner's Pi zero runs a TireSensorClient which sends the temperatures to
+the TireSensorServer of the main Exit Speed process over UDP.  Packets are
+little endian:
+
+  version       uint8    PROTOCOL_VERSION
+  corner        uint8    Index into CORNERS.
+  column count  uint8    0 if the column profile is not sent.
+  padding       uint8
+  sequence      uint32   Incremented per packet, used to detect loss.
+  capture time  int64    Wall clock nanoseconds the frame was read.
+  inner         float32  Celsius.
+  middle        float32  Celsius.
+  outer         float32  Celsius.
+  columns       float32  Median Celsius of each column.
+
+Protos are timestamped when the server receives them.  Capture times are only
+used for the latency and staleness of packets as they rely on the Pi zeros'
+clocks being synchronized with the main Pi.  Capture times more than
+MAX_CLOCK_SKEW_NS from when the packet was received are counted as clock skewed
+and the receive time is used instead.
 """
-import datetime
 import multiprocessing
+import selectors
 import socket
-import statistics
 import struct
+import time
 from typing import Dict
 from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
 from typing import Text
 from typing import Tuple
 
@@ -30,17 +54,81 @@ import numpy
 from absl import app
 from absl import flags
 from absl import logging
+from google.protobuf import any_pb2
 from mlx import mlx90640
 
 from exit_speed import common_lib
 from exit_speed import exit_speed_pb2
 from exit_speed import sensor
 
+PROTOCOL_VERSION = 1
+# Field names of exit_speed_pb2.TireIrSensors in the order of their ids.
+CORNERS = ('lf_tire_temp', 'rf_tire_temp', 'lr_tire_temp', 'rr_tire_temp')
+HEADER_STRUCT = struct.Struct('<BBBxIqfff')
+# Sent by clients before the protocol was versioned.
+LEGACY_STRUCT = struct.Struct('fff')
+SEQUENCE_MODULO = 2**32
+MAX_PACKET_SIZE = HEADER_STRUCT.size + 255 * 4
+MAX_CLOCK_SKEW_NS = 5 * 1e9
+
 FLAGS = flags.FLAGS
 flags.DEFINE_string('ip_addr', None,
                     'IP address of the main Exit Speed process.')
 flags.DEFINE_integer('port', None,
-                     'Port number that corresponds to this corner.')
+                     'Port number of the main Exit Speed process.')
+flags.DEFINE_enum('corner', None, CORNERS,
+                  'Corner of the car this sensor measures.')
+flags.DEFINE_boolean('send_columns', False,
+                     'Include the median temperature of each column in the '
+                     'packets.')
+
+
+class Packet(NamedTuple):
+  corner: Optional[Text]  # None for legacy packets.
+  sequence: Optional[int]
+  capture_ns: Optional[int]
+  temps: Tuple[float, float, float]  # Celsius of inner, middle and outer.
+  columns: Optional[numpy.ndarray] = None  # Celsius.
+
+
+def EncodePacket(corner: Text,
+                 sequence: int,
+                 capture_ns: int,
+                 temps: Tuple[float, float, float],
+                 columns: Optional[Sequence[float]] = None) -> bytes:
+  """Packs the temperatures of a corner in the current protocol version."""
+  if columns is None:
+    columns = ()
+  header = HEADER_STRUCT.pack(
+      PROTOCOL_VERSION, CORNERS.index(corner), len(columns),
+      sequence % SEQUENCE_MODULO, capture_ns, *temps)
+  return header + numpy.asarray(columns, dtype='<f4').tobytes()
+
+
+def DecodePacket(data: bytes) -> Packet:
+  """Unpacks a packet of the current protocol version or a legacy packet.
+
+  Raises:
+    ValueError: If the packet is malformed or of an unknown version.
+  """
+  if len(data) == LEGACY_STRUCT.size:
+    return Packet(None, None, None, LEGACY_STRUCT.unpack(data))
+  if len(data) < HEADER_STRUCT.size:
+    raise ValueError('Packet of %d bytes is too short.' % len(data))
+  (version, corner_index, column_count, sequence, capture_ns,
+   *temps) = HEADER_STRUCT.unpack_from(data)
+  if version != PROTOCOL_VERSION:
+    raise ValueError('Unknown protocol version %d.' % version)
+  if corner_index >= len(CORNERS):
+    raise ValueError('Unknown corner %d.' % corner_index)
+  if len(data) != HEADER_STRUCT.size + column_count * 4:
+    raise ValueError('Packet of %d bytes does not match its %d columns.' %
+                     (len(data), column_count))
+  columns = None
+  if column_count:
+    columns = numpy.frombuffer(data, dtype='<f4', offset=HEADER_STRUCT.size)
+  return Packet(CORNERS[corner_index], sequence, capture_ns, tuple(temps),
+                columns)
 
 
 class InfraRedSensor(object):
@@ -66,26 +154,23 @@ class InfraRedSensor(object):
         logging.INFO, 'Raw frame: \n%s', 60 * 5, frame)
     return frame
 
-  def FormatFrame(self, frame: List[float]) -> List[List[float]]:
-    """Formats a frame by pixel positions of rows and columns."""
-    formatted = []
-    for row_number in range(24):
-      formatted.append(frame[row_number:row_number + 32])
+  def FormatFrame(self, frame: List[float]) -> numpy.ndarray:
+    """Reshapes a frame into its 24 rows by 32 columns of pixels."""
+    formatted = numpy.asarray(frame, dtype=float).reshape(24, 32)
     logging.log_every_n_seconds(
         logging.INFO, 'Formatted frame: \n%s', 60 * 5, formatted)
     return formatted
 
 
-def FindTireIndex(jumps) -> int:
-  first_jump = False
-  index = 0
-  for jump in jumps:
-    if jump:
-      first_jump = True
-    if not jump and first_jump:
-      return index
-    index += 1
-  return 0
+def FindTireIndex(jumps: numpy.ndarray) -> int:
+  """Returns the index of the first column without a jump after a jump."""
+  first_jump = numpy.argmax(jumps)
+  if not jumps[first_jump]:
+    return 0
+  no_jumps = numpy.flatnonzero(~jumps[first_jump:])
+  if not no_jumps.size:
+    return 0
+  return int(first_jump + no_jumps[0])
 
 
 class TireSensor(InfraRedSensor):
@@ -93,61 +178,64 @@ class TireSensor(InfraRedSensor):
   # Temperature delta from tire edge to air/suspension.
   TEMP_EDGE_SENSITIVITY = 40
 
-  def GetTempsByColumn(self) -> Dict[int, List[float]]:
-    """Returns temperature in Celsius per column where key is column index."""
-    formated_frame = self.FormatFrame(self.ReadFrame())
-    column_temps = {}
-    col_index = 0
-    for row in formated_frame:
-      for temp in row:
-        column_temps.setdefault(col_index, []).append(temp)
-      col_index += 1
-    logging.log_every_n_seconds(
-        logging.INFO, 'Column temps: \n%s', 60 * 5, column_temps)
-    return column_temps
-
-  def GetMedianColumnTemps(self) -> Dict[int, float]:
-    """Returns the median temperature in Celsius per column."""
-    column_temps = self.GetTempsByColumn()
-    median_temps = {}
-    for column, temps in column_temps.items():
-      median_temps[column] = statistics.median(temps)
+  def GetMedianColumnTemps(self) -> numpy.ndarray:
+    """Returns the median temperature in Celsius of each of the 32 columns."""
+    median_temps = numpy.median(self.FormatFrame(self.ReadFrame()), axis=0)
     logging.log_every_n_seconds(
         logging.INFO, 'Median temps: \n%s', 60 * 5, median_temps)
     return median_temps
 
-  def GetTireTemps(self) -> Tuple[float, float, float]:
-    """Attempts to find the edge of the tire based on temperature changes."""
-    median_temps = self.GetMedianColumnTemps()
-    diff = numpy.diff(list(median_temps.values()))
-    jumps = abs(diff) > self.TEMP_EDGE_SENSITIVITY
-    reverse_jumps = list(jumps)
-    reverse_jumps.reverse()
+  def GetTireTemps(
+      self,
+      median_temps: Optional[numpy.ndarray] = None
+      ) -> Tuple[float, float, float]:
+    """Attempts to find the edge of the tire based on temperature changes.
+
+    Args:
+      median_temps: As returned by GetMedianColumnTemps.  Defaults to reading
+                    a new frame.
+    """
+    if median_temps is None:
+      median_temps = self.GetMedianColumnTemps()
+    median_temps = numpy.asarray(median_temps)
+    jumps = numpy.abs(numpy.diff(median_temps)) > self.TEMP_EDGE_SENSITIVITY
     inner_tire_index = FindTireIndex(jumps)
-    outer_tire_index = len(median_temps) - FindTireIndex(reverse_jumps) - 1
-    middle_tire_index = round(statistics.mean(
-        [inner_tire_index, outer_tire_index]))
+    outer_tire_index = len(median_temps) - FindTireIndex(jumps[::-1]) - 1
+    middle_tire_index = round((inner_tire_index + outer_tire_index) / 2)
     logging.log_every_n_seconds(
         logging.INFO, 'Inner index: %s, Middle index: %s, Outer index:%s',
         60 * 5, inner_tire_index, middle_tire_index, outer_tire_index,)
     return (
-        median_temps[inner_tire_index],
-        median_temps[middle_tire_index],
-        median_temps[outer_tire_index])
+        float(median_temps[inner_tire_index]),
+        float(median_temps[middle_tire_index]),
+        float(median_temps[outer_tire_index]))
 
 
 class TireSensorClient(object):
   """Client for sending data from the Pi zeros."""
 
-  def __init__(self, ip_addr: Text, port: int):
+  def __init__(self,
+               ip_addr: Text,
+               port: int,
+               corner: Text,
+               send_columns: bool = False):
     self.ip_addr = ip_addr
     self.port = port
+    self.corner = corner
+    self.send_columns = send_columns
+    self.sequence = 0
     self.sensor = TireSensor()
     self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
   def ReadAndSendData(self):
-    temps = struct.pack('fff', *self.sensor.GetTireTemps())
-    self.sock.sendto(temps, (self.ip_addr, self.port))
+    median_temps = self.sensor.GetMedianColumnTemps()
+    capture_ns = time.time_ns()
+    packet = EncodePacket(
+        self.corner, self.sequence, capture_ns,
+        self.sensor.GetTireTemps(median_temps),
+        median_temps if self.send_columns else None)
+    self.sock.sendto(packet, (self.ip_addr, self.port))
+    self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
 
   def Loop(self):
     logging.info('Sending tire temperature data...')
@@ -155,61 +243,191 @@ class TireSensorClient(object):
       self.ReadAndSendData()
 
 
+class CornerStats(object):
+  """Packet loss, staleness and latency of a corner since the last report.
+
+  Packets which arrive after a newer packet are counted as stale and dropped.
+  They were already counted as lost when the newer packet arrived.  Latency is
+  not measured for clock skewed packets.
+  """
+
+  def __init__(self):
+    self.last_sequence = None
+    self.last_capture_ns = None
+    self.Reset()
+
+  def Reset(self) -> None:
+    self.received = 0
+    self.lost = 0
+    self.stale = 0
+    self.clock_skewed = 0
+    self.latency_count = 0
+    self.total_latency_ns = 0
+    self.max_latency_ns = 0
+
+  def Update(self, packet: Packet, receive_ns: int) -> bool:
+    """Returns False if the packet is stale and should be dropped."""
+    self.received += 1
+    if packet.sequence is None:
+      return True
+    capture_ns = packet.capture_ns
+    skewed = abs(receive_ns - capture_ns) > MAX_CLOCK_SKEW_NS
+    if skewed:
+      self.clock_skewed += 1
+      capture_ns = receive_ns
+    if self.last_sequence is not None:
+      gap = (packet.sequence - self.last_sequence) % SEQUENCE_MODULO
+      if gap == 0 or gap > SEQUENCE_MODULO // 2:
+        if capture_ns <= self.last_capture_ns:
+          self.stale += 1
+          return False
+        # Otherwise the client restarted and its sequence began again.
+      else:
+        self.lost += gap - 1
+    self.last_sequence = packet.sequence
+    self.last_capture_ns = capture_ns
+    if skewed:
+      return True
+    latency_ns = receive_ns - capture_ns
+    self.latency_count += 1
+    self.total_latency_ns += latency_ns
+    self.max_latency_ns = max(self.max_latency_ns, latency_ns)
+    return True
+
+  def GetStats(self) -> Dict[Text, float]:
+    return {
+        'received': self.received,
+        'lost': self.lost,
+        'stale': self.stale,
+        'clock_skewed': self.clock_skewed,
+        'mean_latency_ms': (self.total_latency_ns / self.latency_count / 1e6
+                            if self.latency_count else 0.0),
+        'max_latency_ms': self.max_latency_ns / 1e6,
+    }
+
+
 class TireSensorServer(sensor.SensorBase):
-  """Server for receiving data from the Pi zeros."""
+  """Server for receiving data from the Pi zeros of every corner.
+
+  config['tire_temps'] maps each corner to the ip_addr and port its client
+  sends to.  Corners may share a port as packets include their corner.  Legacy
+  packets do not, so clients sending them need a port of their own.
+  """
 
   def __init__(
       self,
-      corner: Text,
-      ip_addr: Text,
-      port: int,
-      session_time: datetime.datetime,
+      session: common_lib.Session,
       config: Dict,
       point_queue: multiprocessing.Queue,
       start_process: bool=True):
-    self.corner = corner
-    self.ip_addr = ip_addr
-    self.port = port
-    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Sockets are bound in Loop as they can not be pickled.
+    self.addresses = {}
+    for corner, ip_port in config['tire_temps'].items():
+      if corner not in CORNERS:
+        raise ValueError('Unknown tire_temps corner %s, expected one of %s.' %
+                         (corner, ', '.join(CORNERS)))
+      address = (ip_port['ip_addr'], int(ip_port['port']))
+      self.addresses.setdefault(address, []).append(corner)
+    self.corner_stats = {
+        corner: CornerStats() for corner in config['tire_temps']}
+    self.malformed = 0
     super().__init__(
-        session_time, config, point_queue, start_process=start_process)
-
-  def Loop(self):
-    self.sock.bind((self.ip_addr, self.port))
-    while not self.stop_process_signal.value:
-      data, _ = self.sock.recvfrom(1024)
-      inside, middle, outside = struct.unpack('fff', data)
-      proto = exit_speed_pb2.TireIrSensors()
-      corner = getattr(proto, self.corner)
-      setattr(corner, 'inner', (inside * 9/5) + 32)
-      setattr(corner, 'middle', (middle * 9/5) + 32)
-      setattr(corner, 'outer', (outside * 9/5) + 32)
-      self.LogAndExportProto(proto)
+        session, config, point_queue, start_process=start_process)
 
+  def ExportProto(self, proto: any_pb2.Any):
+    """Tire temperatures are only logged as Postgres has no table for them."""
 
-class MultiTireInterface(object):
-  """Main class used by exit speed to hold each tire server."""
+  def ProcessPacket(self,
+                    data: bytes,
+                    corners: List[Text],
+                    receive_ns: int) -> Optional[exit_speed_pb2.TireIrSensors]:
+    """Logs the packet received on the socket of the given corners.
 
-  def __init__(self,
-							 session: common_lib.Session,
-							 config: Dict,
-							 point_queue: multiprocessing.Queue):
-    """Initializer."""
-    self.servers = {}
-    for corner, ip_port in config['tire_temps'].items():
-      self.servers[corner] = TireSensorServer(corner,
-                                              ip_port['ip_addr'],
-                                              int(ip_port['port']),
-																							session,
-                                              config,
-                                              point_queue)
+    Returns:
+      The logged proto or None if the packet was dropped.
+    """
+    try:
+      packet = DecodePacket(data)
+    except ValueError:
+      self.malformed += 1
+      logging.log_every_n_seconds(
+          logging.WARNING, 'Dropping malformed tire temperature packet.', 60,
+          exc_info=True)
+      return None
+    corner = packet.corner
+    if corner is None:
+      if len(corners) != 1:
+        logging.log_every_n_seconds(
+            logging.WARNING, 'Dropping legacy packet on the port shared by %s.',
+            60, ', '.join(corners))
+        return None
+      corner = corners[0]
+    if corner not in self.corner_stats:
+      logging.log_every_n_seconds(
+          logging.WARNING, 'Dropping packet of unconfigured corner %s.', 60,
+          corner)
+      return None
+    if not self.corner_stats[corner].Update(packet, receive_ns):
+      return None
+    if packet.columns is not None:
+      logging.log_every_n_seconds(
+          logging.INFO, '%s column temps: \n%s', 60 * 5, corner,
+          packet.columns)
+    proto = exit_speed_pb2.TireIrSensors()
+    corner_proto = getattr(proto, corner)
+    inside, middle, outside = packet.temps
+    corner_proto.inner = (inside * 9/5) + 32
+    corner_proto.middle = (middle * 9/5) + 32
+    corner_proto.outer = (outside * 9/5) + 32
+    self.LogAndExportProto(proto, receive_ns)
+    return proto
+
+  def ReadPackets(self, sock: socket.socket, corners: List[Text]):
+    """Processes every packet waiting on the non-blocking socket."""
+    while True:
+      try:
+        data, _ = sock.recvfrom(MAX_PACKET_SIZE)
+      except BlockingIOError:
+        return
+      self.ProcessPacket(data, corners, time.time_ns())
+
+  def Report(self):
+    for corner, stats in self.corner_stats.items():
+      values = stats.GetStats()
+      logging.info('%s %d packets, %d lost, %d stale, %d clock skewed, '
+                   'latency mean %.1fms max %.1fms', corner,
+                   values['received'], values['lost'], values['stale'],
+                   values['clock_skewed'], values['mean_latency_ms'],
+                   values['max_latency_ms'])
+      stats.Reset()
+    if self.malformed:
+      logging.info('%d malformed tire temperature packets', self.malformed)
+      self.malformed = 0
 
+  def Loop(self):
+    with selectors.DefaultSelector() as selector:
+      for address, corners in self.addresses.items():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(address)
+        selector.register(sock, selectors.EVENT_READ, corners)
+      report_start = time.monotonic()
+      while not self.stop_process_signal.value:
+        for key, _ in selector.select(timeout=1):
+          self.ReadPackets(key.fileobj, key.data)
+        if time.monotonic() - report_start >= FLAGS.sensor_report_interval:
+          self.Report()
+          report_start = time.monotonic()
+      for key in list(selector.get_map().values()):
+        key.fileobj.close()
 
 
 def main(unused_argv):
-  client = TireSensorClient(FLAGS.ip_addr, FLAGS.port)
+  client = TireSensorClient(
+      FLAGS.ip_addr, FLAGS.port, FLAGS.corner, FLAGS.send_columns)
   client.Loop()
 
 
 if __name__ == '__main__':
+  flags.mark_flags_as_required(['ip_addr', 'port', 'corner'])
   app.run(main)
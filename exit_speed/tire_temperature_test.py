@@ -15,15 +15,18 @@
 """Unitests for tire_temperature.py"""
 import datetime
 import multiprocessing
+import threading
 import time
 import unittest
 
 import mock
+import numpy
 from absl import flags
 from absl.testing import absltest
 from mlx import mlx90640
 
 from exit_speed import common_lib
+from exit_speed import exit_speed_pb2
 from exit_speed import tire_temperature
 from exit_speed import tracks
 
@@ -37,15 +40,8 @@ def _CreateRawFrame():
   return frame
 
 def _CreateFormattedFrame():
-  formatted_frame = []
-  for _ in range(32):
-    row = []
-    temp = 0
-    for _ in range(24):
-      row.append(temp)
-      temp += 10
-    formatted_frame.append(row)
-  return formatted_frame
+  """Each row is 10 degrees warmer than the previous."""
+  return numpy.repeat(numpy.arange(0, 240, 10, dtype=float), 32).reshape(24, 32)
 
 
 class MockMlx9064xSensorBase(unittest.TestCase):
@@ -71,11 +67,13 @@ class TestInfraRedSensor(MockMlx9064xSensorBase):
   def testFormatFrame(self):
     raw_frame = _CreateRawFrame()
     formatted_frame = self.sensor.FormatFrame(raw_frame)
-    row_count = 0
-    for row in formatted_frame:
-      row_count += 1
-      self.assertEqual(32, len(row))
-    self.assertEqual(24, row_count)
+    self.assertEqual((24, 32), formatted_frame.shape)
+
+  def testFormatFrameRowMajor(self):
+    formatted_frame = self.sensor.FormatFrame(list(range(32 * 24)))
+    self.assertEqual(list(range(32)), formatted_frame[0].tolist())
+    self.assertEqual(list(range(32, 64)), formatted_frame[1].tolist())
+    self.assertEqual(32 * 24 - 1, formatted_frame[23][31])
 
 
 class TestTireSensor(MockMlx9064xSensorBase):
@@ -85,30 +83,11 @@ class TestTireSensor(MockMlx9064xSensorBase):
     super().setUp()
     self.sensor = tire_temperature.TireSensor()
 
-  def testGetTempsByColumn(self):
-    expected = {}
-    col_index = 0
-    for _ in range(32):
-      temp = 0
-      temps = []
-      for _ in range(24):
-        temps.append(temp)
-        temp += 10
-      expected[col_index] = temps
-      col_index += 1
-    with mock.patch.object(self.sensor, 'FormatFrame') as mock_format_frame:
-      mock_format_frame.return_value = _CreateFormattedFrame()
-      self.assertDictEqual(expected, self.sensor.GetTempsByColumn())
-
   def testGetMedianColumnTemps(self):
-    expected = {}
-    col_index = 0
-    for _ in range(32):
-      expected[col_index] = 115.0
-      col_index += 1
     with mock.patch.object(self.sensor, 'FormatFrame') as mock_format_frame:
       mock_format_frame.return_value = _CreateFormattedFrame()
-      self.assertDictEqual(expected, self.sensor.GetMedianColumnTemps())
+      self.assertEqual([115.0] * 32,
+                       self.sensor.GetMedianColumnTemps().tolist())
 
   def testGetTireTemps(self):
     column_temp = {
@@ -152,31 +131,230 @@ class TestTireSensor(MockMlx9064xSensorBase):
     }
     expected = (190.0, 200.0, 230.0)
     with mock.patch.object(self.sensor, 'GetMedianColumnTemps') as mock_col:
-      mock_col.return_value = column_temp
+      mock_col.return_value = numpy.array(list(column_temp.values()))
       self.assertTupleEqual(expected, self.sensor.GetTireTemps())
 
 
-class TestClientServer(unittest.TestCase):
-  """Tests the ability for the Pi zero client to send data to the server."""
+  def testGetTireTempsNoEdges(self):
+    with mock.patch.object(self.sensor, 'GetMedianColumnTemps') as mock_col:
+      mock_col.return_value = numpy.arange(150.0, 182.0)
+      self.assertTupleEqual((150.0, 166.0, 181.0), self.sensor.GetTireTemps())
 
-  def testClientServer(self):
-    mock_sensor = mock.create_autospec(tire_temperature.TireSensor)
-    mock_sensor.GetTireTemps.return_value = (87.0, 93.0, 98)
-    point_queue = multiprocessing.Queue()
-    session = common_lib.Session(
+
+class TestFindTireIndex(unittest.TestCase):
+  """FindTireIndex unittests."""
+
+  def testFindTireIndex(self):
+    for jumps, expected in (
+        ([False, True, True, False, False], 3),
+        ([True, False], 1),
+        ([False, False, False], 0),
+        ([False, True, True], 0)):
+      self.assertEqual(expected, tire_temperature.FindTireIndex(
+          numpy.array(jumps)))
+
+
+class TestProtocol(unittest.TestCase):
+  """Wire protocol unittests."""
+
+  def testEncodeDecode(self):
+    data = tire_temperature.EncodePacket(
+        'rf_tire_temp', 7, 1590256064100000000, (87.0, 93.0, 98.0))
+    self.assertEqual(tire_temperature.HEADER_STRUCT.size, len(data))
+    self.assertEqual(
+        tire_temperature.Packet('rf_tire_temp', 7, 1590256064100000000,
+                                (87.0, 93.0, 98.0), None),
+        tire_temperature.DecodePacket(data))
+
+  def testEncodeDecodeColumns(self):
+    columns = numpy.arange(32, dtype=float)
+    packet = tire_temperature.DecodePacket(tire_temperature.EncodePacket(
+        'rr_tire_temp', 2**32 + 1, 1, (1.0, 2.0, 3.0), columns))
+    self.assertEqual('rr_tire_temp', packet.corner)
+    self.assertEqual(1, packet.sequence)
+    self.assertEqual(columns.tolist(), packet.columns.tolist())
+
+  def testDecodeLegacy(self):
+    packet = tire_temperature.DecodePacket(
+        tire_temperature.LEGACY_STRUCT.pack(87.0, 93.0, 98.0))
+    self.assertEqual(
+        tire_temperature.Packet(None, None, None, (87.0, 93.0, 98.0)), packet)
+
+  def testDecodeMalformed(self):
+    data = tire_temperature.EncodePacket(
+        'lf_tire_temp', 1, 1, (1.0, 2.0, 3.0), [1.0, 2.0])
+    for malformed, regex in (
+        (data[:20], 'too short'),
+        (data[:-4], 'does not match its 2 columns'),
+        (b'\x02' + data[1:], 'Unknown protocol version 2'),
+        (data[:1] + b'\x04' + data[2:], 'Unknown corner 4')):
+      with self.assertRaisesRegex(ValueError, regex):
+        tire_temperature.DecodePacket(malformed)
+
+
+def _Packet(sequence, capture_ns):
+  return tire_temperature.Packet(
+      'lf_tire_temp', sequence, capture_ns, (1.0, 2.0, 3.0))
+
+
+class TestCornerStats(unittest.TestCase):
+  """CornerStats unittests."""
+
+  def testLossAndLatency(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(_Packet(1, 100), 2000100))
+    self.assertTrue(stats.Update(_Packet(4, 400), 4000400))
+    self.assertEqual(
+        {'received': 2, 'lost': 2, 'stale': 0, 'clock_skewed': 0,
+         'mean_latency_ms': 3.0, 'max_latency_ms': 4.0},
+        stats.GetStats())
+    stats.Reset()
+    self.assertEqual(0, stats.GetStats()['received'])
+    self.assertEqual(4, stats.last_sequence)
+
+  def testStale(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(_Packet(5, 500), 500))
+    self.assertFalse(stats.Update(_Packet(3, 300), 500))
+    self.assertFalse(stats.Update(_Packet(5, 500), 500))
+    self.assertEqual(2, stats.GetStats()['stale'])
+    self.assertEqual(5, stats.last_sequence)
+
+  def testClockSkew(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(_Packet(1, 100), 100 + 6 * 10**9))
+    self.assertTrue(stats.Update(_Packet(2, 7 * 10**9), 7 * 10**9 + 1000000))
+    # Skewed packets are compared by when they were received.
+    self.assertFalse(stats.Update(_Packet(1, 100), 7 * 10**9))
+    self.assertEqual(
+        {'received': 3, 'lost': 0, 'stale': 1, 'clock_skewed': 2,
+         'mean_latency_ms': 1.0, 'max_latency_ms': 1.0},
+        stats.GetStats())
+
+  def testSequenceWraps(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(_Packet(2**32 - 1, 100), 100))
+    self.assertTrue(stats.Update(_Packet(1, 200), 200))
+    self.assertEqual(1, stats.GetStats()['lost'])
+
+  def testClientRestart(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(_Packet(500, 100), 100))
+    self.assertTrue(stats.Update(_Packet(0, 200), 200))
+    self.assertEqual(0, stats.GetStats()['stale'])
+    self.assertEqual(0, stats.last_sequence)
+
+  def testLegacy(self):
+    stats = tire_temperature.CornerStats()
+    self.assertTrue(stats.Update(
+        tire_temperature.Packet(None, None, None, (1.0, 2.0, 3.0)), 100))
+    self.assertEqual(
+        {'received': 1, 'lost': 0, 'stale': 0, 'clock_skewed': 0,
+         'mean_latency_ms': 0.0, 'max_latency_ms': 0.0},
+        stats.GetStats())
+
+
+class TestTireSensorServer(unittest.TestCase):
+  """TireSensorServer unittests."""
+
+  def setUp(self):
+    super().setUp()
+    self.session = common_lib.Session(
       time=datetime.datetime.today(),
       track=tracks.portland_internal_raceways.PortlandInternationalRaceway,
       car='RC Car',
       live_data=False)
-    self.server = tire_temperature.TireSensorServer(
-        'lf_tire_temp', '127.0.0.1', 27001,
-        session, {}, point_queue)
-    with mock.patch.object(tire_temperature, 'TireSensor') as mock_tire_sensor:
-      mock_tire_sensor.return_value = mock_sensor
-      client = tire_temperature.TireSensorClient('127.0.0.1', 27001)
-    time.sleep(3)
-    client.ReadAndSendData()
-    time.sleep(3)
+
+  def _CreateServer(self, tire_temps):
+    server = tire_temperature.TireSensorServer(
+        self.session, {'tire_temps': tire_temps}, multiprocessing.Queue(),
+        start_process=False)
+    patch = mock.patch.object(server, 'LogAndExportProto')
+    self.addCleanup(patch.stop)
+    self.mock_log = patch.start()
+    return server
+
+  def testUnknownCorner(self):
+    with self.assertRaisesRegex(ValueError, 'Unknown tire_temps corner lf'):
+      tire_temperature.TireSensorServer(
+          self.session, {'tire_temps': {'lf': {'ip_addr': '127.0.0.1',
+                                                'port': '27001'}}},
+          multiprocessing.Queue(), start_process=False)
+
+  def testProcessPacket(self):
+    server = self._CreateServer(
+        {'lf_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27001'}})
+    data = tire_temperature.EncodePacket(
+        'lf_tire_temp', 1, 1590256064100000000, (100.0, 50.0, 0.0))
+    proto = server.ProcessPacket(data, ['lf_tire_temp'], 1590256064200000000)
+    self.assertEqual(
+        exit_speed_pb2.TireIrSensor(inner=212, middle=122, outer=32),
+        proto.lf_tire_temp)
+    self.mock_log.assert_called_once_with(proto, 1590256064200000000)
+    self.assertEqual(
+        100.0, server.corner_stats['lf_tire_temp'].GetStats()['max_latency_ms'])
+    # Stale.
+    self.assertIsNone(server.ProcessPacket(
+        data, ['lf_tire_temp'], 1590256064200000000))
+    # Unconfigured corner.
+    self.assertIsNone(server.ProcessPacket(
+        tire_temperature.EncodePacket('rr_tire_temp', 1, 1, (1.0, 2.0, 3.0)),
+        ['lf_tire_temp'], 1))
+    # Malformed.
+    self.assertIsNone(server.ProcessPacket(b'\x00', ['lf_tire_temp'], 1))
+    self.assertEqual(1, server.malformed)
+    self.mock_log.assert_called_once()
+
+  def testProcessLegacyPacket(self):
+    server = self._CreateServer(
+        {'lf_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27001'},
+         'rf_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27001'},
+         'lr_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27002'}})
+    self.assertEqual(
+        {('127.0.0.1', 27001): ['lf_tire_temp', 'rf_tire_temp'],
+         ('127.0.0.1', 27002): ['lr_tire_temp']},
+        server.addresses)
+    data = tire_temperature.LEGACY_STRUCT.pack(100.0, 50.0, 0.0)
+    proto = server.ProcessPacket(data, ['lr_tire_temp'], 1590256064200000000)
+    self.assertEqual(
+        exit_speed_pb2.TireIrSensor(inner=212, middle=122, outer=32),
+        proto.lr_tire_temp)
+    self.mock_log.assert_called_once_with(proto, 1590256064200000000)
+    # Ambiguous on a shared port.
+    self.assertIsNone(server.ProcessPacket(
+        data, ['lf_tire_temp', 'rf_tire_temp'], 1590256064200000000))
+
+  def testClientServer(self):
+    server = self._CreateServer(
+        {'lf_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27001'},
+         'rf_tire_temp': {'ip_addr': '127.0.0.1', 'port': '27001'}})
+    thread = threading.Thread(target=server.Loop)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(server.StopProcess)
+    time.sleep(0.5)
+    for corner, temps in (('lf_tire_temp', (87.0, 93.0, 98.0)),
+                          ('rf_tire_temp', (80.0, 85.0, 90.0))):
+      mock_sensor = mock.create_autospec(tire_temperature.TireSensor)
+      mock_sensor.GetMedianColumnTemps.return_value = numpy.full(32, 90.0)
+      mock_sensor.GetTireTemps.return_value = temps
+      with mock.patch.object(
+          tire_temperature, 'TireSensor') as mock_tire_sensor:
+        mock_tire_sensor.return_value = mock_sensor
+        client = tire_temperature.TireSensorClient(
+            '127.0.0.1', 27001, corner, send_columns=True)
+      client.ReadAndSendData()
+      self.assertEqual(1, client.sequence)
+    deadline = time.time() + 5
+    while self.mock_log.call_count < 2 and time.time() < deadline:
+      time.sleep(0.1)
+    self.assertEqual(2, self.mock_log.call_count)
+    lf_proto = self.mock_log.call_args_list[0][0][0]
+    rf_proto = self.mock_log.call_args_list[1][0][0]
+    self.assertAlmostEqual(87.0 * 9/5 + 32, lf_proto.lf_tire_temp.inner,
+                           places=4)
+    self.assertAlmostEqual(90.0 * 9/5 + 32, rf_proto.rf_tire_temp.outer,
+                           places=4)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Follows the nearest point of a reference lap as the car drives.
+
+The car moves monotonically along the reference lap so each lookup only
+searches a small window ahead of the prior match.  After a pit stop, off track
+or GPS outage the window no longer contains the car and the whole lap is
+searched with a KD tree instead.
+"""
+from typing import Optional
+
+import numpy as np
+from absl import flags
+from scipy.spatial import cKDTree
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('track_cursor_window', 20,
+                     'Number of reference lap points ahead of the last match '
+                     'searched for the current position.')
+flags.DEFINE_float('track_cursor_resync_distance', 30,
+                   'If the nearest reference lap point within the window is '
+                   'further away than this many meters the whole lap is '
+                   'searched.')
+
+
+class TrackCursor(object):
+  """Nearest point lookups along a lap of projected x/y meters."""
+
+  def __init__(self,
+               x: np.ndarray,
+               y: np.ndarray,
+               tree: Optional[cKDTree] = None):
+    """Initializer.
+
+    Args:
+      x: Meters east of the reference lap points.
+      y: Meters north of the reference lap points.
+      tree: A KD tree of x/y if one has already been built.
+    """
+    self.x = x
+    self.y = y
+    self.tree = tree if tree is not None else cKDTree(np.column_stack((x, y)))
+    self.index = 0
+    self.global_searches = 0
+
+  def Reset(self, index: int = 0) -> None:
+    """Moves the cursor, for example back to the start of the lap."""
+    self.index = index
+
+  def FindNearest(self, x: float, y: float) -> int:
+    """Returns the index of the reference lap point nearest to x/y."""
+    start = max(self.index - 1, 0)
+    end = min(self.index + FLAGS.track_cursor_window, len(self.x) - 1) + 1
+    window_2 = (self.x[start:end] - x) ** 2 + (self.y[start:end] - y) ** 2
+    nearest = int(np.argmin(window_2))
+    if window_2[nearest] > FLAGS.track_cursor_resync_distance ** 2:
+      _, index = self.tree.query((x, y))
+      self.global_searches += 1
+      self.index = int(index)
+    else:
+      self.index = start + nearest
+    return self.index
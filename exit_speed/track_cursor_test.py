@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unitests for track_cursor.py"""
+import os
+import unittest
+
+import numpy as np
+from absl.testing import absltest
+
+from exit_speed import common_lib
+from exit_speed import data_logger
+from exit_speed import exit_speed_pb2
+from exit_speed import lap_lib
+from exit_speed import track_cursor
+from exit_speed import tracks
+
+PIR_SESSION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'testdata/Corrado/Portland International Raceway/2020-06-20/'
+    'GPSProcess_1.data')
+
+
+class TestTrackCursor(unittest.TestCase):
+  """Track cursor unittests."""
+
+  def setUp(self):
+    super().setUp()
+    # Straight line east with a point every 10 meters.
+    self.cursor = track_cursor.TrackCursor(np.arange(100) * 10.0,
+                                           np.zeros(100))
+
+  def testFindNearest(self):
+    self.assertEqual(0, self.cursor.FindNearest(1, 1))
+    self.assertEqual(1, self.cursor.FindNearest(11, 1))
+    self.assertEqual(3, self.cursor.FindNearest(29, -1))
+    # Slightly backwards is still within the window.
+    self.assertEqual(2, self.cursor.FindNearest(21, 0))
+    self.assertEqual(0, self.cursor.global_searches)
+
+  def testFindNearestOutsideWindow(self):
+    self.assertEqual(0, self.cursor.FindNearest(0, 0))
+    # Nearest point in the window is further than the resync distance.
+    self.assertEqual(80, self.cursor.FindNearest(801, 1))
+    self.assertEqual(1, self.cursor.global_searches)
+    self.assertEqual(81, self.cursor.FindNearest(811, 1))
+    self.assertEqual(1, self.cursor.global_searches)
+
+  def testReset(self):
+    self.cursor.FindNearest(500, 0)
+    self.cursor.Reset()
+    self.assertEqual(0, self.cursor.index)
+    self.assertEqual(0, self.cursor.FindNearest(0, 0))
+
+  def testPortlandInternationalRaceway(self):
+    track = tracks.portland_internal_raceways.PortlandInternationalRaceway
+    logger = data_logger.Logger(PIR_SESSION, proto_class=exit_speed_pb2.Gps)
+    points = list(logger.ReadProtos())
+    lat, lon, time_ns, speed_ms = lap_lib.GpsArrays(points)
+    crossings, _ = lap_lib.SplitLaps(track, lat, lon, time_ns, speed_ms)
+    x, y = common_lib.GetTrackProjection(track).ToXY(lat, lon)
+    # Laps start with the point prior to crossing start/finish.
+    best_lap = slice(crossings[-2] - 1, crossings[-1])
+    cursor = track_cursor.TrackCursor(x[best_lap], y[best_lap])
+    lookups = 0
+    for start, end in zip(crossings[:-2], crossings[1:-1]):
+      cursor.Reset()
+      for index in range(start - 1, end):
+        nearest = cursor.FindNearest(x[index], y[index])
+        distance, global_nearest = cursor.tree.query((x[index], y[index]))
+        lookups += 1
+        if abs(global_nearest - nearest) > len(cursor.x) / 2:
+          # Near start/finish the global search can match the other end of the
+          # lap, the cursor keeps following the current lap instead.
+          continue
+        # Slow sections make the index ambiguous but not the distance.
+        self.assertAlmostEqual(
+            distance,
+            np.hypot(cursor.x[nearest] - x[index],
+                     cursor.y[nearest] - y[index]),
+            delta=0.01)
+    self.assertGreater(lookups, 20000)
+    self.assertLess(cursor.global_searches, 10)
+
+
+if __name__ == '__main__':
+  absltest.main()
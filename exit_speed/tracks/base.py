@@ -15,11 +15,26 @@
 """Track list and helper functions."""
 import attr
 
+@attr.s(frozen=True)
+class Gate(object):
+  """A line across the track such as start/finish or a sector boundary.
+
+  Crossings are only counted driving forward over the line with point a on
+  the left of the car and point b on the right.
+  """
+  lat_a = attr.ib(type=float)
+  lon_a = attr.ib(type=float)
+  lat_b = attr.ib(type=float)
+  lon_b = attr.ib(type=float)
+
+
 @attr.s(frozen=True)
 class Track(object):
   name = attr.ib(type=str)
   start_finish = attr.ib(type=tuple)
   turns = attr.ib(type=tuple)
+  # Tracks without a gate fall back to the start_finish point and range.
+  start_finish_gate = attr.ib(type=Gate, default=None)
 
 
 @attr.s(frozen=True)
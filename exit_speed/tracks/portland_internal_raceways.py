@@ -32,4 +32,6 @@ PortlandInternationalRaceway = base.Track(
         base.Turn('10', 45.595370, -122.689487),
         base.Turn('11', 45.595004, -122.688507),
         base.Turn('12', 45.593828, -122.687975),
-        ))
+        ),
+    start_finish_gate=base.Gate(45.594889, -122.694597,
+                                45.595141, -122.694455))
@@ -16,11 +16,12 @@
 
 https://www.wbo2.com/sw/logger.htm Frame and byte info.
 """
-import datetime
-import multiprocessing
+import struct
 import time
 from typing import Dict
 from typing import Generator
+from typing import List
+from typing import Optional
 from typing import Text
 
 import serial
@@ -41,46 +42,73 @@ flags.DEFINE_integer('cylinders', 6,
 # http://techedge.com.au/vehicle/wbo2/wblambda.htm
 
 FRAME_SIZE = 28
-# {'frame_type': (slice_left, slice_right)}
-# pylint: disable=bad-continuation
-# pylint: disable=bad-whitespace
-FRAME_FORMAT = {
-  'header':         (0, 2),    # Bytes 1 & 2
-  'sequence':       (2, 3),    # Byte 3
-  'tick':           (3, 5),    # Bytes 4 & 5
-  'lambda_16':      (5, 7),    # Bytes 6 & 7
-  'ipx':            (7, 9),    # Bytes 8 & 9
-  'user_1':         (9, 11),   # Bytes 10 & 11
-  'user_2':         (11, 13),  # Bytes 11 & 13
-  'user_3':         (13, 15),  # Bytes 13 & 14
-  'thermocouple_1': (15, 17),  # Bytes 16 & 17
-  'thermocouple_2': (17, 19),  # Bytes 18 & 19
-  'thermocouple_3': (19, 21),  # Bytes 20 & 21
-  'thermistor':     (21, 23),  # Bytes 22 & 23
-  'rpm_count':      (23, 25),  # Bytes 24 & 25
-  'status':         (25, 27),  # Bytes 26 & 27
-  'crc':            (27, 28),  # Byte 28
-}
-# pylint: enable=bad-continuation
-# pylint: enable=bad-whitespace
-
-
-def FindFrameStart(ser) -> bytes:
-  """Find the frame's header start bytes based on the terminal stream."""
-  while True:
-    header_byte_1 = None
-    header_byte_2 = None
-    byte = ser.read()
-    if byte[0] == 0x5a:
-      header_byte_1 = byte
-    if header_byte_1:
-      byte = ser.read()
-      if byte[0] == 0xa5:
-        header_byte_2 = byte
+FRAME_HEADER = b'\x5a\xa5'
+# Big endian fields of a frame.
+FRAME_FIELDS = (
+    'header',          # Bytes 1 & 2
+    'sequence',        # Byte 3
+    'tick',            # Bytes 4 & 5
+    'lambda_16',       # Bytes 6 & 7
+    'ipx',             # Bytes 8 & 9
+    'user_1',          # Bytes 10 & 11
+    'user_2',          # Bytes 12 & 13
+    'user_3',          # Bytes 14 & 15
+    'thermocouple_1',  # Bytes 16 & 17
+    'thermocouple_2',  # Bytes 18 & 19
+    'thermocouple_3',  # Bytes 20 & 21
+    'thermistor',      # Bytes 22 & 23
+    'rpm_count',       # Bytes 24 & 25
+    'status',          # Bytes 26 & 27
+    'crc',             # Byte 28
+)
+FRAME_STRUCT = struct.Struct('>2sB12HB')
+SEQUENCE_INDEX = FRAME_FIELDS.index('sequence')
+
+
+class FrameParser(object):
+  """Splits the serial stream into frames with valid checksums.
+
+  Bytes are fed in as they are read and the header is searched for within the
+  buffer rather than reading the port a byte at a time.
+  """
+
+  def __init__(self):
+    self.buffer = bytearray()
+    self.frames = 0
+    self.checksum_failures = 0
+    self.skipped_bytes = 0
+
+  def Feed(self, data: bytes) -> List[bytes]:
+    """Adds the data to the buffer and returns any complete frames."""
+    self.buffer += data
+    frames = []
+    start = 0
+    while True:
+      index = self.buffer.find(FRAME_HEADER, start)
+      if index < 0:
+        # The last byte could be the first of a header.
+        end = len(self.buffer)
+        if self.buffer.endswith(FRAME_HEADER[:1]):
+          end -= 1
+        self.skipped_bytes += max(end - start, 0)
+        start = max(end, start)
+        break
+      self.skipped_bytes += index - start
+      start = index
+      if index + FRAME_SIZE > len(self.buffer):
+        break
+      frame = bytes(self.buffer[index:index + FRAME_SIZE])
+      if CheckFrame(frame):
+        frames.append(frame)
+        start = index + FRAME_SIZE
       else:
-        header_byte_1 = None  # Reset, perhaps another byte was set to 0x5a.
-    if header_byte_1 and header_byte_2:
-      return header_byte_1 + header_byte_2 + ser.read(FRAME_SIZE - 2)
+        # The header bytes can also occur within a frame's data.
+        self.checksum_failures += 1
+        self.skipped_bytes += 1
+        start = index + 1
+    del self.buffer[:start]
+    self.frames += len(frames)
+    return frames
 
 
 def CheckFrame(frame) -> bool:
@@ -88,26 +116,38 @@ def CheckFrame(frame) -> bool:
 
 
 def ReadSerial(ser) -> Generator[bytes, None, None]:
+  """Yields frames read from the serial port in bulk."""
+  parser = FrameParser()
   while True:
-    frame = FindFrameStart(ser)
-    if CheckFrame(frame):
+    # Blocks until at least a frame's worth of bytes has arrived.
+    for frame in parser.Feed(ser.read(max(ser.in_waiting, FRAME_SIZE))):
       yield frame
 
 
-def GetBytes(frame: bytes, frame_key: Text) -> float:
-  """Converts byte data into something usable."""
-  low, high = FRAME_FORMAT[frame_key]
-  frame_bytes = frame[low:high]
+def ConvertValue(frame_key: Text, value: int) -> float:
+  """Converts the integer of a field into something usable."""
   if 'lambda_16' == frame_key:
-    return Lambda16ToAFR(int.from_bytes(frame_bytes, 'big'))
+    return Lambda16ToAFR(value)
   if 'rpm_count' == frame_key:
-    return RPMCountToRPM(int.from_bytes(frame_bytes, 'big'),
-                         FLAGS.cylinders)
+    return RPMCountToRPM(value, FLAGS.cylinders)
   elif 'user' in frame_key:
-    return int.from_bytes(frame_bytes, 'big') / 8184 * 5
+    return value / 8184 * 5
   elif 'thermocouple' in frame_key:
-    return int.from_bytes(frame_bytes, 'big') / 1023 * 5 / 101
-  return int.from_bytes(frame_bytes, 'big')
+    return value / 1023 * 5 / 101
+  return value
+
+
+def DecodeFrame(frame: bytes) -> Dict[Text, float]:
+  """Returns the converted values of every field of the frame."""
+  return {frame_key: ConvertValue(frame_key, value)
+          for frame_key, value in zip(FRAME_FIELDS, FRAME_STRUCT.unpack(frame))
+          if frame_key != 'header'}
+
+
+def GetBytes(frame: bytes, frame_key: Text) -> float:
+  """Converts byte data into something usable."""
+  return ConvertValue(
+      frame_key, FRAME_STRUCT.unpack(frame)[FRAME_FIELDS.index(frame_key)])
 
 
 def Lambda16ToAFR(lambda_16: float) -> float:
@@ -125,33 +165,112 @@ def RPMCountToRPM(rpm_count: float, cylinders: int) -> float:
   return 0
 
 
+class FrameAverager(object):
+  """Averages the configured fields of every frame down to the logging rate."""
+
+  def __init__(self, wbo2_config: Dict, frequency_hz: float):
+    """Initializer.
+
+    Args:
+      wbo2_config: Mapping of frame fields to WBO2 proto fields.
+      frequency_hz: Rate at which averaged protos are returned.
+    """
+    self.fields = [(FRAME_FIELDS.index(frame_key), frame_key, proto_field)
+                   for frame_key, proto_field in wbo2_config.items()
+                   if frame_key in FRAME_FIELDS]
+    self.period_ns = int(1e9 / frequency_hz)
+    self.sums = [0.0] * len(self.fields)
+    self.count = 0
+    self.window_end_ns = None
+    self.last_sequence = None
+    self.frames = 0
+    self.dropped_frames = 0
+
+  def AddFrame(self,
+               frame: bytes,
+               now_ns: int) -> Optional[exit_speed_pb2.WBO2]:
+    """Adds the frame and returns the average once the period has elapsed.
+
+    Args:
+      frame: A frame with a valid checksum.
+      now_ns: Monotonic nanoseconds the frame was read.
+
+    Returns:
+      A WBO2 proto of the average of each field since the last one returned.
+    """
+    values = FRAME_STRUCT.unpack(frame)
+    sequence = values[SEQUENCE_INDEX]
+    if self.last_sequence is not None:
+      self.dropped_frames += (sequence - self.last_sequence - 1) % 256
+    self.last_sequence = sequence
+    self.frames += 1
+    for field_index, (index, frame_key, _) in enumerate(self.fields):
+      self.sums[field_index] += ConvertValue(frame_key, values[index])
+    self.count += 1
+    if self.window_end_ns is None:
+      self.window_end_ns = now_ns + self.period_ns
+    if now_ns < self.window_end_ns:
+      return None
+    proto = exit_speed_pb2.WBO2(**{
+        proto_field: total / self.count
+        for (_, _, proto_field), total in zip(self.fields, self.sums)})
+    self.sums = [0.0] * len(self.fields)
+    self.count = 0
+    self.window_end_ns += self.period_ns
+    if self.window_end_ns <= now_ns:
+      # Frames stopped arriving for longer than a period.
+      self.window_end_ns = now_ns + self.period_ns
+    return proto
+
+
 class WBO2(sensor.SensorBase):
   """Interface for the WBO2 wideband lambda/AFR controller."""
   PROTO_CLASS = exit_speed_pb2.WBO2
 
-  def __init__(self,
-							 start_time: datetime.datetime,
-							 config: Dict,
-							 point_queue: multiprocessing.Queue):
-    self._next_cycle = 0
-    super().__init__(start_time, config, point_queue)
+  def LogStats(self,
+               parser: FrameParser,
+               averager: FrameAverager,
+               elapsed_ns: int) -> None:
+    """Logs and resets the frame statistics."""
+    logging.info('WBO2 %.1f frames/s, %d checksum failures, %d dropped frames, '
+                 '%d skipped bytes', parser.frames / elapsed_ns * 1e9,
+                 parser.checksum_failures, averager.dropped_frames,
+                 parser.skipped_bytes)
+    parser.frames = 0
+    parser.checksum_failures = 0
+    parser.skipped_bytes = 0
+    averager.dropped_frames = 0
+
+  def ProcessData(self,
+                  parser: FrameParser,
+                  averager: FrameAverager,
+                  data: bytes) -> None:
+    """Logs and exports the averages completed by the data read."""
+    # Monotonic time for the averaging periods and the wall clock, read per
+    # block so NTP or GPS setting it is followed, for the timestamps.
+    now_ns = time.monotonic_ns()
+    timestamp_ns = time.time_ns()
+    for frame in parser.Feed(data):
+      proto = averager.AddFrame(frame, now_ns)
+      if proto:
+        self.LogAndExportProto(proto, timestamp_ns)
 
   def Loop(self):
     frequency_hz = int(
         self.config.get('wbo2', {}).get('frequency_hz')) or 10
-    with serial.Serial('/dev/ttyUSB0', 19200) as ser:
-      for frame in ReadSerial(ser):
-        while not self.stop_process_signal.value:
-          logging.log_every_n_seconds(logging.DEBUG, 'WBO2 Frame: %s',
-                                      10, frame)
-          now = time.time()
-          if now > self._next_cycle:
-            self._next_cycle = now + 1.0 / frequency_hz
-            proto = exit_speed_pb2.WBO2()
-            for frame_key, point_value in self.config['wbo2'].items():
-              if frame_key in FRAME_FORMAT:
-                setattr(proto, point_value, GetBytes(frame, frame_key))
-            self.LogAndExportProto(proto)
+    parser = FrameParser()
+    averager = FrameAverager(self.config['wbo2'], frequency_hz)
+    report_start_ns = time.monotonic_ns()
+    # The timeout allows the stop signal to be checked if the WBO2 goes quiet.
+    with serial.Serial('/dev/ttyUSB0', 19200, timeout=1) as ser:
+      while not self.stop_process_signal.value:
+        # Blocks until at least a frame's worth of bytes has arrived.
+        self.ProcessData(parser, averager,
+                         ser.read(max(ser.in_waiting, FRAME_SIZE)))
+        elapsed_ns = time.monotonic_ns() - report_start_ns
+        if elapsed_ns >= FLAGS.sensor_report_interval * 1e9:
+          self.LogStats(parser, averager, elapsed_ns)
+          report_start_ns += elapsed_ns
 
 
 def main(unused_argv):
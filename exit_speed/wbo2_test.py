@@ -43,10 +43,23 @@ class TestWBO2(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.start += size
     return output
 
-  def testFindFrameStart(self):
-    mock_serial = mock.create_autospec(serial.Serial)
-    mock_serial.read.side_effect = self.MockRead
-    self.assertEqual(TEST_FRAME, wbo2.FindFrameStart(mock_serial))
+  def testFrameParser(self):
+    parser = wbo2.FrameParser()
+    # Starts mid frame and the second frame is split across reads.
+    self.assertEqual([], parser.Feed(TEST_FRAME[5:]))
+    self.assertEqual([TEST_FRAME], parser.Feed(TEST_FRAME + TEST_FRAME[:1]))
+    self.assertEqual([TEST_FRAME], parser.Feed(TEST_FRAME[1:]))
+    self.assertEqual(2, parser.frames)
+    self.assertEqual(0, parser.checksum_failures)
+    self.assertEqual(len(TEST_FRAME) - 5, parser.skipped_bytes)
+    self.assertEqual(b'', parser.buffer)
+
+  def testFrameParserChecksumFailure(self):
+    parser = wbo2.FrameParser()
+    corrupt = TEST_FRAME[:-1] + b'\x00'
+    self.assertEqual([TEST_FRAME], parser.Feed(corrupt + TEST_FRAME))
+    self.assertEqual(1, parser.checksum_failures)
+    self.assertEqual(len(corrupt), parser.skipped_bytes)
 
   def testCheckFrame(self):
     self.assertTrue(wbo2.CheckFrame(TEST_FRAME))
@@ -54,6 +67,7 @@ class TestWBO2(postgres_test_lib.PostgresTestBase, unittest.TestCase):
 
   def testReadSerial(self):
     mock_serial = mock.create_autospec(serial.Serial)
+    mock_serial.in_waiting = 0
     mock_serial.read.side_effect = self.MockRead
     for frame in wbo2.ReadSerial(mock_serial):
       self.assertEqual(TEST_FRAME, frame)
@@ -67,6 +81,14 @@ class TestWBO2(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.assertEqual(0, wbo2.GetBytes(TEST_FRAME, 'rpm_count'))
     self.assertEqual(14.69820556640625, wbo2.GetBytes(TEST_FRAME, 'lambda_16'))
 
+  def testDecodeFrame(self):
+    values = wbo2.DecodeFrame(TEST_FRAME)
+    self.assertNotIn('header', values)
+    for frame_key in wbo2.FRAME_FIELDS[1:]:
+      self.assertEqual(wbo2.GetBytes(TEST_FRAME, frame_key), values[frame_key])
+    self.assertEqual(0.5962854349951124, values['user_3'])
+    self.assertEqual(8, values['sequence'])
+
   def testLambda16ToAFR(self):
     lambda_16 = int.from_bytes(b'\x0f\xff', 'big')
     self.assertEqual(14.69820556640625, wbo2.Lambda16ToAFR(lambda_16))
@@ -79,6 +101,57 @@ class TestWBO2(postgres_test_lib.PostgresTestBase, unittest.TestCase):
     self.assertEqual(0.5962854349951124,
             wbo2.GetBytes(TEST_FRAME, 'user_3'))
 
+  def _Frame(self, sequence, user_3):
+    """Returns TEST_FRAME with the sequence, user_3 and checksum replaced."""
+    frame = bytearray(TEST_FRAME)
+    frame[2] = sequence
+    frame[13:15] = user_3.to_bytes(2, 'big')
+    frame[27] = 0
+    frame[27] = (0xFF - sum(frame)) & 0xFF
+    self.assertTrue(wbo2.CheckFrame(frame))
+    return bytes(frame)
+
+  def testFrameAverager(self):
+    averager = wbo2.FrameAverager(
+        {'frequency_hz': '10', 'user_3': 'tps_voltage', 'rpm_count': 'rpm'},
+        10)
+    self.assertEqual([(7, 'user_3', 'tps_voltage'), (12, 'rpm_count', 'rpm')],
+                     averager.fields)
+    self.assertIsNone(averager.AddFrame(self._Frame(253, 1000), 0))
+    self.assertIsNone(averager.AddFrame(self._Frame(254, 2000), 50000000))
+    proto = averager.AddFrame(self._Frame(255, 3000), 100000000)
+    self.assertAlmostEqual(2000 / 8184 * 5, proto.tps_voltage)
+    self.assertEqual(0, proto.rpm)
+    self.assertEqual(3, averager.frames)
+    self.assertEqual(0, averager.dropped_frames)
+    # Sequence numbers wrap around, 0 and 1 were dropped.
+    self.assertIsNone(averager.AddFrame(self._Frame(2, 4000), 150000000))
+    proto = averager.AddFrame(self._Frame(3, 5000), 200000000)
+    self.assertAlmostEqual(4500 / 8184 * 5, proto.tps_voltage)
+    self.assertEqual(2, averager.dropped_frames)
+    # After a gap in frames the next period starts from the latest frame.
+    self.assertIsNotNone(averager.AddFrame(self._Frame(4, 0), 900000000))
+    self.assertEqual(1000000000, averager.window_end_ns)
+
+  def testProcessData(self):
+    instance = wbo2.WBO2(0, {'wbo2': {'user_3': 'tps_voltage'}},
+                         None, start_process=False)
+    parser = wbo2.FrameParser()
+    averager = wbo2.FrameAverager({'user_3': 'tps_voltage'}, 10)
+    averager.period_ns = 0  # Return every frame.
+    with mock.patch.object(instance, 'LogAndExportProto') as mock_export, \
+         mock.patch.object(wbo2.time, 'time_ns') as mock_time_ns:
+      mock_time_ns.return_value = 1590256064100000000
+      instance.ProcessData(parser, averager, TEST_FRAME * 3)
+    self.assertEqual(3, mock_export.call_count)
+    # Timestamped by the wall clock when the data was read.
+    self.assertEqual(1590256064100000000, mock_export.call_args[0][1])
+    self.assertEqual(3, parser.frames)
+    with mock.patch.object(wbo2.logging, 'info') as mock_info:
+      instance.LogStats(parser, averager, 1e9)
+    self.assertEqual(3.0, mock_info.call_args[0][1])
+    self.assertEqual(0, parser.frames)
+
 
 if __name__ == '__main__':
   absltest.main()
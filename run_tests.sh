@@ -1,16 +1,24 @@
 #!/bin/bash
 set -ex
 python3 -m exit_speed.accelerometer_test
+python3 -m exit_speed.checkpoint_test
 python3 -m exit_speed.common_lib_test
 python3 -m exit_speed.data_logger_test
 python3 -m exit_speed.gyroscope_test
+python3 -m exit_speed.imu_calibration_test
+python3 -m exit_speed.imu_test
 python3 -m exit_speed.import_data_test
 python3 -m exit_speed.labjack_test
+python3 -m exit_speed.lap_delta_test
 python3 -m exit_speed.lap_lib_test
 python3 -m exit_speed.leds_test
 python3 -m exit_speed.main_test
 python3 -m exit_speed.postgres_test
+python3 -m exit_speed.reference_lap_test
+python3 -m exit_speed.sectors_test
 python3 -m exit_speed.sensor_test
+python3 -m exit_speed.smoothing_lib_test
 python3 -m exit_speed.tire_temperature_test
+python3 -m exit_speed.track_cursor_test
 python3 -m exit_speed.tracks_test
 python3 -m exit_speed.wbo2_test